@@ -2,13 +2,58 @@
 API interaction module for making requests to the Groq API.
 """
 
+import base64
 import os
-import requests
-import streamlit as st
-import json
-from app.constants import ENV_VAR_API_KEY, SUCCESS_GENERATING_REPORT
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app.constants import (ENV_VAR_API_KEY, ENV_VAR_REPORT_SERVICE_URL, REPORT_SECTIONS,
+                           SUCCESS_GENERATING_REPORT, SUCCESS_REGENERATING_SECTION,
+                           FANOUT_SUBSECTION_FAILED, FANOUT_SYNTHESIS_FAILED)
+from app.audit import audit_logger, get_operator, hash_text
 from app.config_manager import config_manager
-from app.prompt_builder import build_xray_analysis_prompt
+from app.lazy import LazySingleton, lazy_import
+from app.exemplars import exemplar_index
+from app.metrics import metrics
+from app.profiler import request_profiler
+from app.prompt_builder import (build_xray_analysis_prompt, build_section_regeneration_prompt,
+                                build_findings_subsection_prompt, build_sections_prompt,
+                                get_findings_subsections)
+from app.rate_limiter import AdmissionError, admission_controller, estimate_tokens
+from app.utils import (format_report_for_display, extract_section_text, splice_section,
+                       assemble_report, split_at_last_section, stitch_continuation, generate_report_id)
+
+# Heavy dependencies are only imported when a report is actually generated
+requests = lazy_import("requests")
+st = lazy_import("streamlit")
+
+
+class APIError(Exception):
+    """Raised when the report backend returns an error."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _clean_subsection(text, name):
+    """Normalize a generated FINDINGS subsection so it starts with its own header."""
+    text = text.strip()
+    if text.upper().startswith("FINDINGS:"):
+        text = text[len("FINDINGS:"):].strip()
+    if not text.lower().startswith(name.lower()):
+        text = f"{name}:\n{text}"
+    return text
+
+
+def _fallback_preamble(clinical):
+    """Build the sections before FINDINGS from the form data alone."""
+    history = clinical.get("clinical_history")
+    return {
+        "EXAMINATION:": "Chest radiograph, frontal and lateral views.",
+        "CLINICAL INFORMATION:": clinical["indication"] + (f". {history}" if history else ""),
+        "COMPARISON:": clinical["comparison"],
+        "TECHNIQUE:": clinical["technique"],
+    }
 
 
 class APIClient:
@@ -18,65 +63,557 @@ class APIClient:
         """Initialize the API client."""
         self.api_key = os.getenv(ENV_VAR_API_KEY)
         self.endpoint = config_manager.get_api_endpoint()
+        self.timeout = config_manager.get_rate_limit_config().get("request_timeout_s", 90)
 
     def is_configured(self):
         """Check if the API client is properly configured."""
         return bool(self.api_key and self.endpoint)
 
+    def build_payload(self, prompt, **parameter_overrides):
+        """
+        Build the chat completion payload for a prompt.
+
+        Args:
+            prompt (str): The user prompt.
+            **parameter_overrides: Model parameters overriding the configured ones.
+
+        Returns:
+            dict: The request payload.
+        """
+        # Get model parameters from configuration
+        model_name = config_manager.get_model_name()
+        model_params = config_manager.get_model_parameters()
+        model_params.update(parameter_overrides)
+
+        return {
+            "model": model_name,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            **model_params
+        }
+
+    def _complete(self, payload):
+        """
+        Send a chat completion request.
+
+        Args:
+            payload (dict): The request payload.
+
+        Returns:
+            tuple: The completion text and its finish_reason ("stop", "length", ...).
+
+        Raises:
+            AdmissionError: If the admission controller rejects the request.
+            APIError: If the API returns a non-200 response or does not answer
+                      within rate_limit.request_timeout_s.
+        """
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+        with request_profiler.stage("admission"):
+            ticket = admission_controller.acquire(estimate_tokens(payload))
+        response = None
+        timed_out = False
+        try:
+            with request_profiler.stage("upstream"):
+                response = requests.post(self.endpoint, headers=headers, json=payload, timeout=self.timeout)
+        except requests.Timeout:
+            timed_out = True
+            raise APIError(f"Upstream did not respond within {self.timeout}s", 504)
+        finally:
+            admission_controller.release(ticket,
+                                         response.status_code if response is not None else None,
+                                         response.headers if response is not None else None,
+                                         timed_out=timed_out)
+
+        if response.status_code != 200:
+            raise APIError(f"{response.status_code} - {response.text}", response.status_code)
+
+        choice = response.json()["choices"][0]
+        finish_reason = choice.get("finish_reason")
+        if finish_reason == "length":
+            metrics.increment("upstream.finish_reason.length")
+        return choice["message"]["content"], finish_reason
+
+    def _post_chat(self, payload):
+        """
+        Send a chat completion request.
+
+        Args:
+            payload (dict): The request payload.
+
+        Returns:
+            str: The completion text.
+
+        Raises:
+            AdmissionError: If the admission controller rejects the request.
+            APIError: If the API returns a non-200 response.
+        """
+        return self._complete(payload)[0]
+
+    def _select_exemplars(self, indication, clinical_history):
+        """Retrieve similar past reports for the prompt (none if the index is unavailable)."""
+        if not exemplar_index.enabled:
+            return []
+        try:
+            return exemplar_index.select_exemplars(indication, clinical_history)
+        except Exception as e:
+            print(f"Error retrieving exemplar reports: {e}")
+            return []
+
+    def build_report_prompt(self, clinical):
+        """
+        Build the single-completion report prompt, with similar past reports as exemplars.
+
+        Args:
+            clinical (dict): patient_age, patient_sex, indication, clinical_history,
+                             comparison and technique.
+
+        Returns:
+            tuple: The prompt and the selected exemplar records.
+        """
+        with request_profiler.stage("exemplars"):
+            exemplars = self._select_exemplars(clinical["indication"], clinical["clinical_history"])
+        with request_profiler.stage("build_prompt"):
+            prompt = build_xray_analysis_prompt(**clinical, exemplars=[exemplar["text"] for exemplar in exemplars])
+        return prompt, exemplars
+
+    def _generate_complete_report(self, prompt, clinical, prompts):
+        """
+        Generate a full report, continuing it while the model stops at max_tokens.
+
+        A truncated report is cut before its last (incomplete) section, and a
+        follow-up request writes the remaining sections with the complete ones
+        as context. The number of follow-ups is bounded by
+        generation.max_continuations.
+
+        Args:
+            prompt (str): The full report prompt.
+            clinical (dict): The clinical fields, for the continuation prompts.
+            prompts (list): Every prompt sent is appended to it.
+
+        Returns:
+            tuple: The report text and the number of continuations used.
+        """
+        analysis, finish_reason = self._complete(self.build_payload(prompt))
+        metrics.increment("report.completions")
+        continuations = 0
+        if finish_reason == "length":
+            metrics.increment("report.truncated")
+            max_continuations = config_manager.get_generation_config().get("max_continuations", 2)
+            while finish_reason == "length" and continuations < max_continuations:
+                complete_text, remaining = split_at_last_section(analysis)
+                continuation_prompt = build_sections_prompt(
+                    remaining, context_sections=format_report_for_display(complete_text), **clinical)
+                prompts.append(continuation_prompt)
+                continuations += 1
+                metrics.increment("report.continuations")
+                with request_profiler.stage("continuation"):
+                    continuation, finish_reason = self._complete(self.build_payload(continuation_prompt))
+                analysis = stitch_continuation(complete_text, continuation, remaining[0])
+
+            if finish_reason == "length":
+                metrics.increment("report.truncated_final")
+                print(f"Report still truncated after {continuations} continuation(s)")
+
+        completions = metrics.get_counter("report.completions")
+        metrics.set_gauge("report.truncation_rate",
+                          round(metrics.get_counter("report.truncated") / completions, 4))
+        metrics.set_gauge("report.continuations_per_report",
+                          round(metrics.get_counter("report.continuations") / completions, 4))
+        return analysis, continuations
+
+    def _audit(self, event, audit, prompts, status, started, **fields):
+        """Queue an audit record for a generation request."""
+        audit = audit or {}
+        audit_logger.record(
+            event,
+            report_id=audit.get("report_id") or generate_report_id(),
+            operator=audit.get("operator") or get_operator(),
+            patient_id=audit.get("patient_id") or None,
+            study=audit.get("study") or None,
+            model=config_manager.get_model_name(),
+            template_version=config_manager.get_template_version(),
+            prompt_sha256=hash_text("\n\n".join(prompts)),
+            status=status,
+            latency_ms=round((time.perf_counter() - started) * 1000.0, 1),
+            **fields
+        )
+
+    def generate_report(self, indication, comparison, technique,
+                        patient_age=None, patient_sex=None, clinical_history=None, mode=None,
+                        audit=None):
+        """
+        Generate a radiology report without touching the UI.
+
+        Args:
+            mode (str): "single" for one completion or "fanout" for parallel
+                        FINDINGS subsections (defaults to generation.mode).
+            audit (dict): Audit fields such as report_id, patient_id and
+                          operator (optional).
+
+        Returns:
+            str: The report text.
+
+        Raises:
+            APIError: If the API returns an error.
+        """
+        mode = mode or config_manager.get_generation_config().get("mode", "single")
+        started = time.perf_counter()
+        prompts = []
+        status = "error"
+        continuations = 0
+        exemplars = []
+        try:
+            if mode == "fanout":
+                with request_profiler.stage("fanout"):
+                    analysis = self.generate_report_fanout(indication, comparison, technique, patient_age,
+                                                           patient_sex, clinical_history, prompts=prompts)
+            else:
+                # Build the prompt for the model
+                clinical = {
+                    "patient_age": patient_age,
+                    "patient_sex": patient_sex,
+                    "indication": indication,
+                    "clinical_history": clinical_history,
+                    "comparison": comparison,
+                    "technique": technique,
+                }
+                prompt, exemplars = self.build_report_prompt(clinical)
+                prompts.append(prompt)
+                analysis, continuations = self._generate_complete_report(prompt, clinical, prompts)
+
+            status = "ok"
+            return analysis
+        finally:
+            self._audit("report_generated", audit, prompts, status, started, mode=mode,
+                        continuations=continuations,
+                        exemplars=[exemplar.get("report_id") for exemplar in exemplars])
+
+    def generate_report_fanout(self, indication, comparison, technique,
+                               patient_age=None, patient_sex=None, clinical_history=None, prompts=None):
+        """
+        Generate a report with the FINDINGS subsections as concurrent requests.
+
+        The sections before FINDINGS and every FINDINGS subsection are generated
+        in parallel; IMPRESSION and RECOMMENDATIONS are then synthesized from the
+        merged findings. Failed subsections are marked in the report instead of
+        failing the whole report.
+
+        Args:
+            prompts (list): If given, every prompt sent is appended to it.
+
+        Returns:
+            str: The report text.
+
+        Raises:
+            APIError: If every FINDINGS subsection fails.
+        """
+        clinical = {
+            "patient_age": patient_age,
+            "patient_sex": patient_sex,
+            "indication": indication,
+            "clinical_history": clinical_history,
+            "comparison": comparison,
+            "technique": technique,
+        }
+        generation = config_manager.get_generation_config()
+        findings_index = REPORT_SECTIONS.index("FINDINGS:")
+        preamble_sections = REPORT_SECTIONS[:findings_index]
+        synthesis_sections = REPORT_SECTIONS[findings_index + 1:]
+        subsections = get_findings_subsections()
+
+        preamble_prompt = build_sections_prompt(preamble_sections, **clinical)
+        subsection_prompts = [build_findings_subsection_prompt(subsection, **clinical)
+                              for subsection in subsections]
+        if prompts is not None:
+            prompts.extend([preamble_prompt] + subsection_prompts)
+
+        with ThreadPoolExecutor(max_workers=generation.get("max_workers", 8)) as pool:
+            preamble_future = pool.submit(self._post_chat, self.build_payload(
+                preamble_prompt, max_tokens=generation.get("preamble_max_tokens", 300)))
+            subsection_futures = [
+                pool.submit(self._post_chat, self.build_payload(
+                    prompt, max_tokens=generation.get("subsection_max_tokens", 250)))
+                for prompt in subsection_prompts
+            ]
+
+            # Collect in template order regardless of completion order
+            findings = []
+            failures = []
+            for subsection, future in zip(subsections, subsection_futures):
+                try:
+                    findings.append(_clean_subsection(future.result(), subsection["name"]))
+                except Exception as e:
+                    failures.append(e)
+                    metrics.increment("fanout.subsection_failures")
+                    print(f"Error generating findings subsection {subsection['name']}: {e}")
+                    findings.append(f"{subsection['name']}:\n{FANOUT_SUBSECTION_FAILED}")
+
+            if subsections and len(failures) == len(subsections):
+                raise failures[-1]
+
+            try:
+                section_content = format_report_for_display(preamble_future.result())
+            except Exception as e:
+                metrics.increment("fanout.preamble_failures")
+                print(f"Error generating report preamble: {e}")
+                section_content = {}
+
+        # Fill any missing preamble section from the form data
+        for section, text in _fallback_preamble(clinical).items():
+            if not section_content.get(section):
+                section_content[section] = text
+        section_content["FINDINGS:"] = "\n\n".join(findings)
+
+        synthesis_prompt = build_sections_prompt(synthesis_sections,
+                                                 {"FINDINGS:": section_content["FINDINGS:"]}, **clinical)
+        if prompts is not None:
+            prompts.append(synthesis_prompt)
+        try:
+            synthesis = format_report_for_display(self._post_chat(self.build_payload(
+                synthesis_prompt, max_tokens=generation.get("synthesis_max_tokens", 500))))
+        except Exception as e:
+            metrics.increment("fanout.synthesis_failures")
+            print(f"Error synthesizing impression: {e}")
+            synthesis = {}
+
+        for section in synthesis_sections:
+            section_content[section] = synthesis.get(section) or FANOUT_SYNTHESIS_FAILED
+
+        return assemble_report(section_content)
+
+    def regenerate_section(self, analysis, section, reviewer_notes, indication, comparison, technique,
+                           patient_age=None, patient_sex=None, clinical_history=None, audit=None):
+        """
+        Regenerate one report section and splice it back into the report.
+
+        Args:
+            analysis (str): The current report text.
+            section (str): The section header to regenerate (e.g. "IMPRESSION:").
+            reviewer_notes (str): The radiologist's corrections (optional).
+            audit (dict): Audit fields such as report_id, patient_id and
+                          operator (optional).
+
+        Returns:
+            str: The updated report text.
+
+        Raises:
+            APIError: If the API returns an error.
+        """
+        prompt = build_section_regeneration_prompt(
+            section,
+            format_report_for_display(analysis),
+            reviewer_notes=reviewer_notes,
+            patient_age=patient_age,
+            patient_sex=patient_sex,
+            indication=indication,
+            clinical_history=clinical_history,
+            comparison=comparison,
+            technique=technique
+        )
+
+        # A single section needs far fewer output tokens than the full report
+        regeneration = config_manager.get_regeneration_config()
+        max_tokens = regeneration.get("findings_max_tokens" if section == "FINDINGS:" else "max_tokens", 400)
+
+        started = time.perf_counter()
+        status = "error"
+        try:
+            response = self._post_chat(self.build_payload(prompt, max_tokens=max_tokens))
+            status = "ok"
+        finally:
+            self._audit("section_regenerated", audit, [prompt], status, started, section=section)
+
+        return splice_section(analysis, section, extract_section_text(response, section))
+
+    def regenerate_report_section(self, analysis, section, reviewer_notes, indication, comparison,
+                                  technique, patient_age=None, patient_sex=None, clinical_history=None,
+                                  audit=None):
+        """Regenerate one report section, reporting errors in the UI."""
+        try:
+            with st.spinner(SUCCESS_REGENERATING_SECTION.format(section=section)):
+                return self.regenerate_section(analysis, section, reviewer_notes, indication, comparison,
+                                               technique, patient_age, patient_sex, clinical_history,
+                                               audit=audit)
+
+        except AdmissionError as e:
+            st.error(str(e))
+
+        except APIError as e:
+            st.error(f"Error from API: {e}")
+
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            st.error(f"Error: {str(e)}")
+
+        return None
+
     def analyze_xray_images(self, frontal_image, lateral_image, indication, comparison, technique,
-                            patient_age=None, patient_sex=None, clinical_history=None):
+                            patient_age=None, patient_sex=None, clinical_history=None, audit=None):
         """Use Groq API to generate a comprehensive radiology report."""
         try:
-            # Build the prompt for the model
-            prompt = build_xray_analysis_prompt(
-                patient_age=patient_age,
-                patient_sex=patient_sex,
-                indication=indication,
-                clinical_history=clinical_history,
-                comparison=comparison,
-                technique=technique
-            )
-
-            # Prepare API request
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
+            # Make the API request
+            with st.spinner(SUCCESS_GENERATING_REPORT), request_profiler.profile("analyze_xray_images"):
+                return self.generate_report(indication, comparison, technique,
+                                            patient_age, patient_sex, clinical_history, audit=audit)
 
-            # Get model parameters from configuration
-            model_name = config_manager.get_model_name()
-            model_params = config_manager.get_model_parameters()
-
-            # Prepare the payload
-            payload = {
-                "model": model_name,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                **model_params
-            }
+        except AdmissionError as e:
+            st.error(str(e))
+            return f"Error: {e}"
 
-            # Make the API request
-            with st.spinner(SUCCESS_GENERATING_REPORT):
-                response = requests.post(self.endpoint, headers=headers, json=payload)
+        except APIError as e:
+            st.error(f"Error from API: {e}")
+            return f"Error: {e}"
 
-            # Handle response
-            if response.status_code != 200:
-                st.error(f"Error from API: {response.text}")
-                return f"Error: {response.status_code} - {response.text}"
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return f"Error: {str(e)}"
 
-            # Extract and return the analysis text
-            analysis = response.json()["choices"][0]["message"]["content"]
-            return analysis
+
+def _encode_image(image_file):
+    """Encode an uploaded image's original bytes as base64 for transport to the report service."""
+    return base64.b64encode(image_file.getvalue()).decode("ascii")
+
+
+class RemoteAPIClient:
+    """Client that delegates report generation to the HTTP report service."""
+
+    def __init__(self, service_url=None):
+        """
+        Initialize the remote client.
+
+        Args:
+            service_url (str): Base URL of the report service (optional).
+        """
+        backend = config_manager.get_backend_config()
+        self.service_url = (service_url or backend.get("service_url") or "").rstrip("/")
+        self.timeout = backend.get("timeout", 120)
+
+    def is_configured(self):
+        """Check if the remote client is properly configured."""
+        return bool(self.service_url)
+
+    def _post(self, path, body, headers=None):
+        """
+        Post a JSON body to the report service.
+
+        Args:
+            path (str): The endpoint path.
+            body (dict): The request body.
+            headers (dict): Extra request headers (optional).
+
+        Returns:
+            dict: The decoded JSON response.
+
+        Raises:
+            APIError: If the service returns a non-200 response.
+        """
+        response = requests.post(f"{self.service_url}{path}", json=body, headers=headers,
+                                 timeout=self.timeout)
+        if response.status_code != 200:
+            try:
+                message = response.json().get("error", response.text)
+            except ValueError:
+                message = response.text
+            raise APIError(f"{response.status_code} - {message}", response.status_code)
+        return response.json()
+
+    def analyze_xray_images(self, frontal_image, lateral_image, indication, comparison, technique,
+                            patient_age=None, patient_sex=None, clinical_history=None, audit=None):
+        """Generate a comprehensive radiology report through the report service."""
+        try:
+            with request_profiler.profile("analyze_xray_images") as profile:
+                with request_profiler.stage("encode_images"):
+                    # The uploads are sent as-is; re-encoding would be lossy for JPEG films
+                    frontal_data = _encode_image(frontal_image)
+                    lateral_data = _encode_image(lateral_image)
+                body = {
+                    "frontal_image": frontal_data,
+                    "lateral_image": lateral_data,
+                    "indication": indication,
+                    "comparison": comparison,
+                    "technique": technique,
+                    "patient_age": patient_age,
+                    "patient_sex": patient_sex,
+                    "clinical_history": clinical_history,
+                    "audit": audit,
+                }
+
+                # Ask the service to sample its side too when this request is sampled
+                headers = {"X-Profile": "1"} if profile is not None and profile.sampled else None
+                with st.spinner(SUCCESS_GENERATING_REPORT), request_profiler.stage("report_service"):
+                    return self._post("/v1/reports", body, headers)["analysis"]
+
+        except APIError as e:
+            st.error(f"Error from report service: {e}")
+            return f"Error: {e}"
 
         except Exception as e:
             import traceback
             traceback.print_exc()
             return f"Error: {str(e)}"
 
+    def regenerate_report_section(self, analysis, section, reviewer_notes, indication, comparison,
+                                  technique, patient_age=None, patient_sex=None, clinical_history=None,
+                                  audit=None):
+        """Regenerate one report section through the report service."""
+        try:
+            body = {
+                "analysis": analysis,
+                "section": section,
+                "reviewer_notes": reviewer_notes,
+                "indication": indication,
+                "comparison": comparison,
+                "technique": technique,
+                "patient_age": patient_age,
+                "patient_sex": patient_sex,
+                "clinical_history": clinical_history,
+                "audit": audit,
+            }
+
+            with st.spinner(SUCCESS_REGENERATING_SECTION.format(section=section)):
+                return self._post("/v1/reports/section", body)["analysis"]
+
+        except APIError as e:
+            st.error(f"Error from report service: {e}")
+
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            st.error(f"Error: {str(e)}")
+
+        return None
+
+
+def create_api_client():
+    """
+    Create the API client for the configured backend.
+
+    The report service URL can be set in settings.yaml (backend.service_url
+    with backend.mode: remote) or through the REPORT_SERVICE_URL environment
+    variable, which always selects the remote backend.
+
+    Returns:
+        APIClient or RemoteAPIClient: The client instance.
+    """
+    service_url = os.getenv(ENV_VAR_REPORT_SERVICE_URL)
+    if service_url:
+        return RemoteAPIClient(service_url)
+
+    if config_manager.get_backend_config().get("mode") == "remote":
+        return RemoteAPIClient()
+
+    return APIClient()
+
 
-# Create a singleton instance
-api_client = APIClient()
\ No newline at end of file
+# Create a lazily-initialized singleton instance
+api_client = LazySingleton(create_api_client)
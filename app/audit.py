@@ -0,0 +1,322 @@
+"""
+Append-only audit log for report generation.
+
+Records are handed to a background writer thread, so recording an event costs
+a dictionary build and a queue put on the request path. The writer commits
+records in groups: it drains whatever has queued up (up to batch_size, or
+for at most flush_interval_ms), writes the batch, then flushes and fsyncs once.
+
+Each process writes its own segment file named audit-<ULID>-<pid>.jsonl, so
+workers never interleave writes, and segments sort by creation time. Every
+record carries the SHA-256 of the previous line, which chains the segment and
+makes edits, deletions and reordering detectable. Segments rotate once they
+reach max_segment_mb and end with a "segment_end" record.
+
+Verify the log with:
+    python -m app.audit verify [--dir DIRECTORY]
+"""
+
+import argparse
+import atexit
+import getpass
+import glob
+import hashlib
+import json
+import multiprocessing.util
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+from app.config_manager import config_manager
+from app.constants import AUDIT_DIR, ENV_VAR_OPERATOR, ROOT_DIR
+from app.lazy import LazySingleton
+from app.utils import generate_ulid
+
+GENESIS_HASH = "0" * 64
+SEGMENT_PATTERN = "audit-*.jsonl"
+
+# Sentinel asking the writer thread to flush and stop
+_STOP = object()
+
+
+def hash_line(line):
+    """Return the SHA-256 hex digest of a serialized record line."""
+    return hashlib.sha256(line.encode("utf-8")).hexdigest()
+
+
+def hash_text(text):
+    """Return the SHA-256 hex digest of a text (e.g. a prompt)."""
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def get_operator():
+    """Get the operator recorded in audit entries."""
+    operator = os.getenv(ENV_VAR_OPERATOR)
+    if operator:
+        return operator
+    try:
+        return getpass.getuser()
+    except Exception:
+        return "unknown"
+
+
+class AuditLogger:
+    """Non-blocking, group-committed audit log writer."""
+
+    def __init__(self, directory=None, settings=None):
+        """
+        Initialize the logger.
+
+        Args:
+            directory (str): Directory holding the segments (defaults to settings).
+            settings (dict): Audit settings (defaults to settings.yaml audit).
+        """
+        settings = config_manager.get_audit_config() if settings is None else settings
+        self.enabled = settings.get("enabled", True)
+        self.directory = directory or settings.get("directory") or AUDIT_DIR
+        if not os.path.isabs(self.directory):
+            self.directory = os.path.join(ROOT_DIR, self.directory)
+        self.max_segment_bytes = int(settings.get("max_segment_mb", 64) * 1024 * 1024)
+        self.batch_size = settings.get("batch_size", 256)
+        self.flush_interval = settings.get("flush_interval_ms", 50) / 1000.0
+
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._file = None
+        self._segment_path = None
+        self._segment_records = 0
+        self._last_hash = GENESIS_HASH
+        self._flushed = threading.Condition()
+        self._enqueued = 0
+        self._written = 0
+
+    def _ensure_writer(self):
+        """Start the writer thread (again, after a fork)."""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            # A forked child inherits neither the thread nor a usable segment
+            self._queue = queue.SimpleQueue()
+            self._flushed = threading.Condition()
+            self._file = None
+            self._enqueued = 0
+            self._written = 0
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+            # multiprocessing workers exit without running atexit handlers
+            multiprocessing.util.Finalize(self, self.close, exitpriority=10)
+
+    def record(self, event, **fields):
+        """
+        Queue an audit record without blocking.
+
+        Args:
+            event (str): The event type (e.g. "report_generated").
+            **fields: JSON-serializable record fields.
+        """
+        if not self.enabled:
+            return
+        self._ensure_writer()
+        fields["event"] = event
+        fields["ts"] = time.time()
+        with self._flushed:
+            self._enqueued += 1
+        self._queue.put(fields)
+
+    def flush(self, timeout=5.0):
+        """
+        Wait until every queued record has been written and fsynced.
+
+        Returns:
+            bool: True if the queue drained within the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self._flushed:
+            while self._written < self._enqueued:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._flushed.wait(remaining)
+        return True
+
+    def close(self):
+        """Flush pending records, seal the current segment and stop the writer."""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid() or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout=5.0)
+        self._thread = None
+
+    def _open_segment(self):
+        """Start a new segment file."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._segment_path = os.path.join(self.directory, f"audit-{generate_ulid()}-{os.getpid()}.jsonl")
+        self._file = open(self._segment_path, "a", encoding="utf-8")
+        self._segment_records = 0
+        self._last_hash = GENESIS_HASH
+
+    def _seal_segment(self):
+        """Write the segment_end record and close the segment."""
+        if self._file is None:
+            return
+        self._write_record({"event": "segment_end", "ts": time.time(), "records": self._segment_records})
+        self._sync()
+        self._file.close()
+        self._file = None
+
+    def _write_record(self, record):
+        """Serialize, chain and write one record (without syncing)."""
+        record["seq"] = self._segment_records
+        record["pid"] = self._pid
+        record["time"] = datetime.fromtimestamp(record["ts"], timezone.utc).isoformat()
+        record["prev"] = self._last_hash
+        line = json.dumps(record, sort_keys=True, separators=(",", ":"), default=str)
+        self._file.write(line + "\n")
+        self._last_hash = hash_line(line)
+        self._segment_records += 1
+
+    def _sync(self):
+        """Flush and fsync the current segment."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _run(self):
+        """Writer loop: group-commit batches of queued records."""
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            if _STOP in batch:
+                stopping = True
+                batch = [record for record in batch if record is not _STOP]
+
+            try:
+                if batch:
+                    if self._file is None:
+                        self._open_segment()
+                    for record in batch:
+                        self._write_record(record)
+                    self._sync()
+                    if self._file.tell() >= self.max_segment_bytes:
+                        self._seal_segment()
+                if stopping:
+                    self._seal_segment()
+            except Exception as e:
+                print(f"Error writing audit log: {e}")
+
+            with self._flushed:
+                self._written += len(batch)
+                self._flushed.notify_all()
+
+
+def verify_segment(path):
+    """
+    Verify the hash chain and sequence numbers of one segment.
+
+    Args:
+        path (str): Path of the segment file.
+
+    Returns:
+        dict: {"path", "records", "sealed", "errors", "report_ids"}.
+    """
+    result = {"path": path, "records": 0, "sealed": False, "errors": [], "report_ids": []}
+    previous_hash = GENESIS_HASH
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.rstrip("\n")
+            if result["sealed"]:
+                result["errors"].append(f"line {line_number}: record after segment_end")
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                result["errors"].append(f"line {line_number}: not valid JSON (torn write?)")
+                break
+            if record.get("prev") != previous_hash:
+                result["errors"].append(f"line {line_number}: hash chain broken")
+            if record.get("seq") != line_number - 1:
+                result["errors"].append(f"line {line_number}: expected seq {line_number - 1}, got {record.get('seq')}")
+            if record.get("event") == "segment_end":
+                result["sealed"] = True
+                if record.get("records") != line_number - 1:
+                    result["errors"].append(f"line {line_number}: segment_end count mismatch")
+            if record.get("event") == "report_generated" and record.get("report_id"):
+                result["report_ids"].append(record["report_id"])
+            previous_hash = hash_line(line)
+            result["records"] += 1
+    return result
+
+
+def verify_log(directory=None):
+    """
+    Verify every segment in the audit directory.
+
+    Args:
+        directory (str): The audit directory (defaults to the configured one).
+
+    Returns:
+        bool: True if no errors were found.
+    """
+    directory = directory or AuditLogger().directory
+    paths = sorted(glob.glob(os.path.join(directory, SEGMENT_PATTERN)))
+    if not paths:
+        print(f"No audit segments found in {directory}")
+        return True
+
+    ok = True
+    seen_ids = {}
+    for path in paths:
+        result = verify_segment(path)
+        status = "OK" if not result["errors"] else "FAILED"
+        seal = "sealed" if result["sealed"] else "open"
+        print(f"{status:<7} {os.path.basename(path)}  {result['records']} records ({seal})")
+        for error in result["errors"]:
+            print(f"        {error}")
+        ok = ok and not result["errors"]
+
+        for report_id in result["report_ids"]:
+            if report_id in seen_ids:
+                print(f"FAILED  duplicate report ID {report_id} in {os.path.basename(seen_ids[report_id])} "
+                      f"and {os.path.basename(path)}")
+                ok = False
+            seen_ids[report_id] = path
+
+    print(f"{len(paths)} segments, {len(seen_ids)} reports: {'verified' if ok else 'VERIFICATION FAILED'}")
+    return ok
+
+
+# Create a lazily-initialized process-wide instance
+audit_logger = LazySingleton(AuditLogger)
+
+
+def main():
+    """Command-line entry point for audit log tools."""
+    parser = argparse.ArgumentParser(description="Audit log tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    verify_parser = subparsers.add_parser("verify", help="Verify hash chains and report ID uniqueness")
+    verify_parser.add_argument("--dir", help="Audit directory (defaults to settings.yaml audit.directory)")
+    args = parser.parse_args()
+
+    if args.command == "verify":
+        raise SystemExit(0 if verify_log(args.dir) else 1)
+
+
+if __name__ == "__main__":
+    main()
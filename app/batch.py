@@ -0,0 +1,586 @@
+"""
+Offline batch mode: JSONL request files out, result files in.
+
+Non-urgent studies (overnight backlogs, outreach work) can be sent through an
+OpenAI-compatible batch API instead of one chat completion each, trading
+turnaround for the provider's batch pricing and separate rate limits. A job
+goes through three steps, each of which can be rerun:
+
+    compile   Read a folder of studies in the hot-folder layout (see
+              app.ingest), run the image checks, keep the films in the blob
+              store and write one chat completion request per study, built
+              exactly like a single-mode report, to input.jsonl. The report ID
+              is the request's custom_id. Compiling again before submitting
+              keeps the report ID and film references of unchanged studies.
+    submit    Upload input.jsonl (POST /files, purpose "batch") and create the
+              batch (POST /batches).
+    collect   Poll the batch (GET /batches/{id}) until it finishes, download
+              the output file (GET /files/{id}/content) and turn every result
+              into a report and a cached draft.
+
+Each job lives in its own directory under batch.directory:
+
+    input.jsonl      the request file
+    studies.json     custom_id -> study, film digests and clinical fields
+    state.json       file and batch IDs and status
+    output.jsonl     the downloaded result file (and errors.jsonl)
+    ingested.txt     the custom_ids already turned into reports, one per line
+    reports/         <report_id>.txt and <report_id>.json per study
+
+Collecting again re-downloads the result file but skips every custom_id in
+ingested.txt, so a rerun (or a resumed, interrupted collect) never writes a
+second report, draft or audit record for the same study.
+
+Run with:
+    python -m app.batch run DIRECTORY [--name NAME]
+    python -m app.batch compile DIRECTORY [--name NAME]
+    python -m app.batch submit|status|collect NAME [--wait]
+"""
+
+import argparse
+import json
+import os
+import time
+
+from app.audit import audit_logger, get_operator, hash_text
+from app.config_manager import config_manager
+from app.constants import ENV_VAR_API_KEY, ROOT_DIR
+from app.draft_cache import DraftCache, study_key
+from app.ingest import IngestError, classify_file, prepare_study, read_sidecar
+from app.lazy import lazy_import
+from app.metrics import metrics
+from app.utils import format_report_for_display, generate_report_id
+
+requests = lazy_import("requests")
+
+# Batch statuses after which the batch no longer changes
+FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchError(Exception):
+    """Raised when a batch job cannot proceed."""
+
+
+def find_studies(directory):
+    """
+    Group the files of a folder into studies.
+
+    Args:
+        directory (str): A folder in the hot-folder layout.
+
+    Returns:
+        dict: Study name -> {"frontal", "lateral", "sidecar"} paths, for the
+              studies with both films.
+    """
+    studies = {}
+    for name in sorted(os.listdir(directory)):
+        classified = classify_file(name)
+        if classified is None:
+            continue
+        study, kind = classified
+        studies.setdefault(study, {})[kind] = os.path.join(directory, name)
+    return {study: files for study, files in studies.items() if "frontal" in files and "lateral" in files}
+
+
+def _write_json(path, data):
+    """Write a JSON file atomically."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _read_jsonl(path):
+    """Read the records of a JSONL file (none if it does not exist)."""
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class BatchAPI:
+    """Client for the files and batches endpoints of an OpenAI-compatible API."""
+
+    def __init__(self, base_url=None, api_key=None):
+        """
+        Initialize the client.
+
+        Args:
+            base_url (str): API base URL (defaults to batch.base_url, or the chat
+                            completions endpoint without /chat/completions).
+            api_key (str): API key (defaults to the GROQ_API_KEY environment variable).
+        """
+        endpoint = config_manager.get_api_endpoint() or ""
+        self.base_url = (base_url or config_manager.get_batch_config().get("base_url")
+                         or endpoint.rsplit("/chat/completions", 1)[0]).rstrip("/")
+        self.api_key = api_key or os.getenv(ENV_VAR_API_KEY)
+
+    def _request(self, method, path, **kwargs):
+        """Send a request and return the response, raising BatchError on failure."""
+        response = requests.request(method, f"{self.base_url}{path}",
+                                    headers={"Authorization": f"Bearer {self.api_key}"}, **kwargs)
+        if response.status_code != 200:
+            raise BatchError(f"{method} {path}: {response.status_code} - {response.text}")
+        return response
+
+    def upload_file(self, path):
+        """
+        Upload a batch request file.
+
+        Returns:
+            str: The file ID.
+        """
+        with open(path, "rb") as f:
+            response = self._request("POST", "/files", data={"purpose": "batch"},
+                                     files={"file": (os.path.basename(path), f, "application/jsonl")})
+        return response.json()["id"]
+
+    def create_batch(self, input_file_id, endpoint, completion_window):
+        """
+        Start a batch over an uploaded request file.
+
+        Returns:
+            dict: The batch object.
+        """
+        return self._request("POST", "/batches", json={
+            "input_file_id": input_file_id,
+            "endpoint": endpoint,
+            "completion_window": completion_window,
+        }).json()
+
+    def get_batch(self, batch_id):
+        """
+        Get the status of a batch.
+
+        Returns:
+            dict: The batch object.
+        """
+        return self._request("GET", f"/batches/{batch_id}").json()
+
+    def download_file(self, file_id):
+        """
+        Download the content of a file.
+
+        Returns:
+            bytes: The file content.
+        """
+        return self._request("GET", f"/files/{file_id}/content").content
+
+
+class BatchJob:
+    """One batch of studies, from request file to reports."""
+
+    def __init__(self, name, settings=None, api=None, client=None):
+        """
+        Initialize the job.
+
+        Args:
+            name (str): The job name (its directory under batch.directory).
+            settings (dict): Batch settings (defaults to settings.yaml batch).
+            api (BatchAPI): Batch API client (created on first use).
+            client (APIClient): Report client building the request payloads
+                                (created on first use).
+        """
+        self.settings = config_manager.get_batch_config() if settings is None else settings
+        directory = self.settings.get("directory", "batches")
+        if not os.path.isabs(directory):
+            directory = os.path.join(ROOT_DIR, directory)
+        self.name = name
+        self.directory = os.path.join(directory, name)
+        self.reports_dir = os.path.join(self.directory, "reports")
+        self._api = api
+        self._client = client
+
+    @property
+    def api(self):
+        """The batch API client."""
+        if self._api is None:
+            self._api = BatchAPI()
+        return self._api
+
+    @property
+    def client(self):
+        """The report client used to build request payloads."""
+        if self._client is None:
+            from app.api import APIClient
+            self._client = APIClient()
+        return self._client
+
+    def _path(self, name):
+        """Get the path of a job file."""
+        return os.path.join(self.directory, name)
+
+    def load_state(self):
+        """
+        Read the job state.
+
+        Returns:
+            dict: The state (empty before the job is compiled).
+        """
+        try:
+            with open(self._path("state.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _save_state(self, **fields):
+        """Update the job state."""
+        state = self.load_state()
+        state.update(fields)
+        _write_json(self._path("state.json"), state)
+        return state
+
+    def _load_studies(self):
+        """Read the custom_id -> study mapping."""
+        with open(self._path("studies.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def compile(self, source_dir):
+        """
+        Write the request file for a folder of studies.
+
+        Studies that fail the image checks or have an invalid sidecar are left
+        out and listed in the job state. Studies already compiled into this job
+        (same film digests) keep their report ID and blob references; films of
+        studies no longer compiled are released.
+
+        Args:
+            source_dir (str): A folder in the hot-folder layout.
+
+        Returns:
+            int: The number of requests written.
+
+        Raises:
+            BatchError: If the job was already submitted.
+        """
+        from app.blob_store import BlobNotFoundError, blob_store
+
+        if self.load_state().get("batch_id"):
+            raise BatchError(f"Batch job {self.name} was already submitted")
+        os.makedirs(self.directory, exist_ok=True)
+        ingest_settings = config_manager.get_ingest_config()
+        endpoint = self.settings.get("endpoint", "/v1/chat/completions")
+
+        # Studies from an earlier compile of this job, by film digests
+        try:
+            compiled = {study_key(entry["digests"]["frontal"], entry["digests"]["lateral"]): (report_id, entry)
+                        for report_id, entry in self._load_studies().items()}
+        except FileNotFoundError:
+            compiled = {}
+
+        studies = {}
+        skipped = {}
+        with open(self._path("input.jsonl"), "w", encoding="utf-8") as f:
+            for study, files in find_studies(source_dir).items():
+                try:
+                    clinical = read_sidecar(files.get("sidecar"))
+                    arguments, digests, image_qa = prepare_study(files, clinical, ingest_settings, store=False)
+                    previous = compiled.pop(study_key(digests["frontal"], digests["lateral"]), None)
+                    if previous is None and blob_store.enabled:
+                        for view in ("frontal", "lateral"):
+                            with open(files[view], "rb") as film:
+                                blob_store.put_file(film)
+                except (OSError, IngestError) as e:
+                    skipped[study] = str(e)
+                    print(f"Skipping study {study}: {e}")
+                    continue
+
+                prompt, exemplars = self.client.build_report_prompt(arguments)
+                report_id = previous[0] if previous else generate_report_id()
+                f.write(json.dumps({
+                    "custom_id": report_id,
+                    "method": "POST",
+                    "url": endpoint,
+                    "body": self.client.build_payload(prompt),
+                }) + "\n")
+                studies[report_id] = {
+                    "study": study,
+                    "digests": digests,
+                    "clinical": arguments,
+                    "patient_id": clinical.get("patient_id"),
+                    "patient_name": clinical.get("patient_name"),
+                    "image_qa": image_qa,
+                    "exemplars": [exemplar.get("report_id") for exemplar in exemplars],
+                    "prompt_sha256": hash_text(prompt),
+                }
+
+        _write_json(self._path("studies.json"), studies)
+
+        # Drop the references taken for studies that are no longer in the job
+        if blob_store.enabled:
+            for _, entry in compiled.values():
+                for digest in entry["digests"].values():
+                    try:
+                        blob_store.release(digest)
+                    except BlobNotFoundError:
+                        pass
+
+        self._save_state(source=os.path.abspath(source_dir), status="compiled", requests=len(studies),
+                         skipped=skipped, compiled_at=time.time())
+        metrics.increment("batch.requests", len(studies))
+        return len(studies)
+
+    def submit(self):
+        """
+        Upload the request file and start the batch.
+
+        Returns:
+            dict: The batch object.
+
+        Raises:
+            BatchError: If the job has no requests or was already submitted.
+        """
+        state = self.load_state()
+        if state.get("batch_id"):
+            raise BatchError(f"Batch job {self.name} was already submitted as {state['batch_id']}")
+        if not state.get("requests"):
+            raise BatchError(f"Batch job {self.name} has no requests to submit")
+
+        # Keep the file ID so a failed batch creation does not upload again
+        input_file_id = state.get("input_file_id") or self.api.upload_file(self._path("input.jsonl"))
+        self._save_state(input_file_id=input_file_id)
+        batch = self.api.create_batch(input_file_id, self.settings.get("endpoint", "/v1/chat/completions"),
+                                      self.settings.get("completion_window", "24h"))
+        self._save_state(batch_id=batch["id"], status=batch.get("status"), submitted_at=time.time())
+        return batch
+
+    def status(self):
+        """
+        Refresh the batch status.
+
+        Returns:
+            dict: The batch object.
+
+        Raises:
+            BatchError: If the job was not submitted.
+        """
+        batch_id = self.load_state().get("batch_id")
+        if not batch_id:
+            raise BatchError(f"Batch job {self.name} was not submitted")
+        batch = self.api.get_batch(batch_id)
+        self._save_state(status=batch.get("status"), request_counts=batch.get("request_counts"))
+        return batch
+
+    def wait(self, timeout=None):
+        """
+        Poll the batch until it reaches a final status.
+
+        Args:
+            timeout (float): Seconds to wait before giving up (no limit by default).
+
+        Returns:
+            dict: The batch object.
+
+        Raises:
+            BatchError: If the timeout passes first.
+        """
+        interval = self.settings.get("poll_interval_s", 30)
+        deadline = time.monotonic() + timeout if timeout else None
+        batch = self.status()
+        while batch.get("status") not in FINAL_STATUSES:
+            if deadline is not None and time.monotonic() + interval > deadline:
+                raise BatchError(f"Batch {batch['id']} still {batch.get('status')} after {timeout:.0f}s")
+            time.sleep(interval)
+            batch = self.status()
+        return batch
+
+    def collect(self, wait=False, timeout=None):
+        """
+        Download the results and write the reports.
+
+        Args:
+            wait (bool): Poll until the batch finishes instead of failing if it has not.
+            timeout (float): Seconds to wait when polling.
+
+        Returns:
+            dict: Counts of reports written, truncated and failed by this
+                  collect, and of results already ingested by an earlier one.
+
+        Raises:
+            BatchError: If the batch has not finished, or finished without results.
+        """
+        batch = self.wait(timeout) if wait else self.status()
+        if batch.get("status") not in FINAL_STATUSES:
+            raise BatchError(f"Batch {batch['id']} is still {batch.get('status')}")
+
+        for file_key, name in (("output_file_id", "output.jsonl"), ("error_file_id", "errors.jsonl")):
+            if batch.get(file_key):
+                with open(self._path(name), "wb") as f:
+                    f.write(self.api.download_file(batch[file_key]))
+        if not batch.get("output_file_id") and not batch.get("error_file_id"):
+            raise BatchError(f"Batch {batch['id']} {batch.get('status')} without a result file")
+
+        summary = self._ingest_results(batch)
+        # Keep the totals over every collect, not just this one
+        previous = self.load_state().get("summary") or {}
+        totals = {key: previous.get(key, 0) + summary[key] for key in ("reports", "truncated", "failed")}
+        self._save_state(status="collected", collected_at=time.time(), summary=totals)
+        return summary
+
+    def _load_ingested(self):
+        """Read the custom_ids whose results were already ingested."""
+        try:
+            with open(self._path("ingested.txt"), "r", encoding="utf-8") as f:
+                return {line.strip() for line in f if line.strip()}
+        except FileNotFoundError:
+            return set()
+
+    def _ingest_results(self, batch):
+        """Turn every result line into a report, a cached draft and an audit record."""
+        studies = self._load_studies()
+        state = self.load_state()
+        drafts = DraftCache()
+        os.makedirs(self.reports_dir, exist_ok=True)
+        latency_ms = round((time.time() - state.get("submitted_at", time.time())) * 1000.0, 1)
+
+        summary = {"reports": 0, "truncated": 0, "failed": 0, "already_ingested": 0}
+        results = _read_jsonl(self._path("output.jsonl")) + _read_jsonl(self._path("errors.jsonl"))
+        ingested = self._load_ingested()
+        seen = set()
+        with open(self._path("ingested.txt"), "a", encoding="utf-8") as ingested_file:
+            for result in results:
+                report_id = result.get("custom_id")
+                study = studies.get(report_id)
+                if study is None or report_id in seen:
+                    continue
+                seen.add(report_id)
+                if report_id in ingested:
+                    summary["already_ingested"] += 1
+                    continue
+                self._ingest_result(report_id, study, result, batch, latency_ms, drafts, summary)
+                # Recorded only once the report and its audit record are written
+                ingested_file.write(f"{report_id}\n")
+                ingested_file.flush()
+
+            # Requests the provider dropped without a result line
+            for report_id in sorted(studies.keys() - seen - ingested):
+                self._write_report(report_id, studies[report_id], None, None,
+                                   {"message": f"No result in batch {batch['id']}"}, drafts)
+                self._audit(report_id, studies[report_id], batch, "error", latency_ms)
+                summary["failed"] += 1
+                metrics.increment("batch.failed")
+                ingested_file.write(f"{report_id}\n")
+        return summary
+
+    def _ingest_result(self, report_id, study, result, batch, latency_ms, drafts, summary):
+        """Turn one result line into a report, a cached draft and an audit record."""
+        response = result.get("response") or {}
+        error = result.get("error")
+        analysis = None
+        finish_reason = None
+        if not error and response.get("status_code") == 200:
+            choice = response["body"]["choices"][0]
+            analysis = choice["message"]["content"]
+            finish_reason = choice.get("finish_reason")
+        else:
+            error = error or {"message": f"status {response.get('status_code')}",
+                              "body": response.get("body")}
+        self._write_report(report_id, study, analysis, finish_reason, error, drafts)
+        self._audit(report_id, study, batch, "ok" if analysis is not None else "error", latency_ms)
+
+        if analysis is None:
+            summary["failed"] += 1
+            metrics.increment("batch.failed")
+            return
+        summary["reports"] += 1
+        metrics.increment("batch.reports")
+        if finish_reason == "length":
+            summary["truncated"] += 1
+            metrics.increment("batch.truncated")
+
+    def _write_report(self, report_id, study, analysis, finish_reason, error, drafts):
+        """Write the report files of one study and cache it as a draft."""
+        record = {
+            "report_id": report_id,
+            "study": study["study"],
+            "patient_id": study.get("patient_id"),
+            "patient_name": study.get("patient_name"),
+            "clinical": study["clinical"],
+            "finish_reason": finish_reason,
+            # Truncated batch results are kept but flagged, since they cannot be continued offline
+            "truncated": finish_reason == "length",
+            "error": error,
+            "analysis": analysis,
+            "sections": format_report_for_display(analysis) if analysis is not None else None,
+        }
+        _write_json(os.path.join(self.reports_dir, f"{report_id}.json"), record)
+        if analysis is None:
+            return
+
+        with open(os.path.join(self.reports_dir, f"{report_id}.txt"), "w", encoding="utf-8") as f:
+            f.write(analysis)
+        drafts.put(study["digests"]["frontal"], study["digests"]["lateral"], {
+            "report_id": report_id,
+            "analysis": analysis,
+            "clinical": study["clinical"],
+            "patient_id": study.get("patient_id"),
+            "patient_name": study.get("patient_name"),
+            "image_qa": study.get("image_qa"),
+            "source": f"batch:{self.name}/{study['study']}",
+        })
+
+    def _audit(self, report_id, study, batch, status, latency_ms):
+        """Queue the audit record of one batch report."""
+        audit_logger.record(
+            "report_generated",
+            report_id=report_id,
+            operator=get_operator(),
+            patient_id=study.get("patient_id") or None,
+            study=study["digests"],
+            model=config_manager.get_model_name(),
+            template_version=config_manager.get_template_version(),
+            prompt_sha256=study["prompt_sha256"],
+            status=status,
+            latency_ms=latency_ms,
+            mode="batch",
+            batch_id=batch["id"],
+            exemplars=study.get("exemplars", []),
+        )
+
+
+def main():
+    """Command-line entry point for batch jobs."""
+    parser = argparse.ArgumentParser(description="Generate reports through the batch API")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command, help_text in (("run", "Compile, submit and collect a folder of studies"),
+                               ("compile", "Write the request file for a folder of studies")):
+        command_parser = subparsers.add_parser(command, help=help_text)
+        command_parser.add_argument("source", help="Folder of studies in the hot-folder layout")
+        command_parser.add_argument("--name", help="Job name (defaults to the folder name and time)")
+    for command, help_text in (("submit", "Upload the request file and start the batch"),
+                               ("status", "Show the batch status"),
+                               ("collect", "Download the results and write the reports")):
+        command_parser = subparsers.add_parser(command, help=help_text)
+        command_parser.add_argument("name", help="Job name")
+        if command == "collect":
+            command_parser.add_argument("--wait", action="store_true", help="Poll until the batch finishes")
+    args = parser.parse_args()
+
+    if args.command in ("run", "compile"):
+        name = args.name or f"{os.path.basename(os.path.abspath(args.source))}-{time.strftime('%Y%m%d-%H%M%S')}"
+    else:
+        name = args.name
+    job = BatchJob(name)
+
+    try:
+        if args.command in ("run", "compile"):
+            print(f"{job.compile(args.source)} requests written to {job._path('input.jsonl')}")
+        if args.command in ("run", "submit"):
+            batch = job.submit()
+            print(f"Submitted batch {batch['id']} ({batch.get('status')})")
+        if args.command == "status":
+            batch = job.status()
+            print(f"Batch {batch['id']}: {batch.get('status')} {batch.get('request_counts') or ''}")
+        if args.command in ("run", "collect"):
+            summary = job.collect(wait=args.command == "run" or args.wait)
+            print(f"{summary['reports']} reports ({summary['truncated']} truncated), "
+                  f"{summary['failed']} failed, {summary['already_ingested']} already collected, "
+                  f"in {job.reports_dir}")
+    except BatchError as e:
+        parser.exit(1, f"Error: {e}\n")
+    finally:
+        audit_logger.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+"""
+Content-addressed blob store for uploaded studies.
+
+Every blob is stored once under its SHA-256 digest, sharded by digest prefix
+(objects/ab/cd/<digest>), so identical re-uploads cost nothing but a
+reference count increment. A SQLite index (safe across worker processes)
+tracks size, codec and reference counts. Films are only stored once they
+have passed the image checks. A film is retained for storage.retention_days
+after it was last stored: expire() then releases its references, and gc()
+deletes unreferenced blobs after a further grace period.
+
+Blobs are zlib-compressed only when that actually saves space. PNG and JPEG
+films are already compressed: they are recognized by their magic bytes (other
+content by trial-compressing a prefix) and stored raw without a compression
+pass, and read() returns a zero-copy memoryview over a memory-mapped file.
+Compressed blobs are decompressed on read.
+
+Maintain the store with:
+    python -m app.blob_store stats|gc [--retention-days DAYS] [--grace-hours HOURS]
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import mmap
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from app.config_manager import config_manager
+from app.constants import ROOT_DIR
+from app.lazy import LazySingleton
+
+CODEC_RAW = "raw"
+CODEC_ZLIB = "zlib"
+
+# Signatures of formats that are already compressed and not worth a zlib pass
+_COMPRESSED_SIGNATURES = (
+    b"\x89PNG\r\n\x1a\n",             # PNG
+    b"\xff\xd8\xff",                  # JPEG
+    b"\x00\x00\x00\x0cjP  \r\n",      # JPEG 2000 (JP2)
+    b"\xffO\xffQ",                    # JPEG 2000 codestream
+    b"GIF8",                          # GIF
+    b"\x1f\x8b",                      # gzip
+    b"PK\x03\x04",                    # zip
+)
+
+# Size of the prefix trial-compressed before compressing a whole blob
+_TRIAL_SIZE = 64 * 1024
+
+# Temp files younger than this may still be being written by put()
+_TMP_GRACE_SECONDS = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL,
+    codec TEXT NOT NULL,
+    refcount INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_ref REAL NOT NULL
+)
+"""
+
+
+class BlobNotFoundError(KeyError):
+    """Raised when a digest is not in the store."""
+
+
+class BlobStore:
+    """Content-addressed, compressed, reference-counted blob store."""
+
+    def __init__(self, root=None, settings=None):
+        """
+        Initialize the store.
+
+        Args:
+            root (str): Store directory (defaults to settings.yaml storage.root).
+            settings (dict): Storage settings (defaults to settings.yaml storage).
+        """
+        settings = config_manager.get_storage_config() if settings is None else settings
+        self.enabled = settings.get("enabled", True)
+        self.root = root or settings.get("root", "blobs")
+        if not os.path.isabs(self.root):
+            self.root = os.path.join(ROOT_DIR, self.root)
+        self.codec = settings.get("codec", CODEC_ZLIB)
+        self.compression_level = settings.get("compression_level", 6)
+        self.min_compression_ratio = settings.get("min_compression_ratio", 0.9)
+        self.gc_grace_seconds = settings.get("gc_grace_hours", 24) * 3600
+        retention_days = settings.get("retention_days", 90)
+        self.retention_seconds = retention_days * 86400 if retention_days else None
+        self._local = threading.local()
+
+    def _connection(self):
+        """Get this thread's index connection, creating the index if needed."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None or getattr(self._local, "pid", None) != os.getpid():
+            os.makedirs(self.root, exist_ok=True)
+            connection = sqlite3.connect(os.path.join(self.root, "index.sqlite3"), timeout=30,
+                                         isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(_SCHEMA)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @contextlib.contextmanager
+    def _write_lock(self):
+        """
+        Hold the index's write lock (a BEGIN IMMEDIATE transaction).
+
+        Every process takes the same SQLite lock, so put() publishing an object
+        and gc() unlinking one never interleave.
+
+        Yields:
+            sqlite3.Connection: This thread's index connection.
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def path_for(self, digest):
+        """Get the object path for a digest (sharded by its first two bytes)."""
+        return os.path.join(self.root, "objects", digest[:2], digest[2:4], digest)
+
+    def _worth_compressing(self, data):
+        """
+        Cheaply decide whether compressing a blob is likely to save space.
+
+        Args:
+            data (bytes): The blob content.
+
+        Returns:
+            bool: False for known compressed formats and content whose prefix does not compress.
+        """
+        if not data or data.startswith(_COMPRESSED_SIGNATURES):
+            return False
+        if len(data) <= _TRIAL_SIZE:
+            return True
+        prefix = data[:_TRIAL_SIZE]
+        return len(zlib.compress(prefix, 1)) < len(prefix) * self.min_compression_ratio
+
+    def put(self, data):
+        """
+        Store bytes, or add a reference if they are already stored.
+
+        Args:
+            data (bytes): The blob content.
+
+        Returns:
+            str: The SHA-256 hex digest of the content.
+        """
+        data = bytes(data)
+        digest = hashlib.sha256(data).hexdigest()
+        now = time.time()
+        connection = self._connection()
+
+        # Fast path: already stored, just take another reference
+        cursor = connection.execute(
+            "UPDATE blobs SET refcount = refcount + 1, last_ref = ? WHERE digest = ?", (now, digest))
+        if cursor.rowcount:
+            return digest
+
+        codec, payload = CODEC_RAW, data
+        if self.codec == CODEC_ZLIB and self._worth_compressing(data):
+            compressed = zlib.compress(data, self.compression_level)
+            if len(compressed) < len(data) * self.min_compression_ratio:
+                codec, payload = CODEC_ZLIB, compressed
+
+        # Write atomically; concurrent writers of the same digest write identical bytes
+        path = self.path_for(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Publish the file and its row together, so gc() sees both or neither
+        with self._write_lock() as connection:
+            os.replace(tmp_path, path)
+            connection.execute(
+                "INSERT INTO blobs (digest, size, stored_size, codec, refcount, created, last_ref) "
+                "VALUES (?, ?, ?, ?, 1, ?, ?) "
+                "ON CONFLICT(digest) DO UPDATE SET refcount = refcount + 1, last_ref = excluded.last_ref",
+                (digest, len(data), len(payload), codec, now, now))
+        return digest
+
+    def put_file(self, file):
+        """
+        Store an uploaded file (anything with getvalue() or read()).
+
+        Returns:
+            str: The SHA-256 hex digest of the content.
+        """
+        if hasattr(file, "getvalue"):
+            return self.put(file.getvalue())
+        position = file.tell() if hasattr(file, "tell") else None
+        data = file.read()
+        if position is not None:
+            file.seek(position)
+        return self.put(data)
+
+    def info(self, digest):
+        """
+        Get the index entry for a digest.
+
+        Returns:
+            dict: size, stored_size, codec, refcount, created and last_ref.
+
+        Raises:
+            BlobNotFoundError: If the digest is not stored.
+        """
+        row = self._connection().execute(
+            "SELECT size, stored_size, codec, refcount, created, last_ref FROM blobs WHERE digest = ?",
+            (digest,)).fetchone()
+        if row is None:
+            raise BlobNotFoundError(digest)
+        return dict(zip(["size", "stored_size", "codec", "refcount", "created", "last_ref"], row))
+
+    def contains(self, digest):
+        """Check whether a digest is stored."""
+        try:
+            self.info(digest)
+            return True
+        except BlobNotFoundError:
+            return False
+
+    def read(self, digest, verify=False):
+        """
+        Read a blob.
+
+        Raw blobs are returned as a zero-copy memoryview over a read-only memory
+        map; the map stays open for as long as the view is referenced.
+
+        Args:
+            digest (str): The blob digest.
+            verify (bool): Recompute the digest and compare (costs a full pass).
+
+        Returns:
+            memoryview: The blob content.
+
+        Raises:
+            BlobNotFoundError: If the digest is not stored.
+            ValueError: If verification fails.
+        """
+        info = self.info(digest)
+        if info["size"] == 0:
+            return memoryview(b"")
+
+        with open(self.path_for(digest), "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if info["codec"] == CODEC_ZLIB:
+            content = memoryview(zlib.decompress(mapped))
+            mapped.close()
+        else:
+            content = memoryview(mapped)
+
+        if verify and hashlib.sha256(content).hexdigest() != digest:
+            raise ValueError(f"Blob {digest} is corrupt")
+        return content
+
+    def release(self, digest):
+        """Drop a reference; the blob becomes collectable at zero references."""
+        cursor = self._connection().execute(
+            "UPDATE blobs SET refcount = MAX(refcount - 1, 0), last_ref = ? WHERE digest = ?",
+            (time.time(), digest))
+        if not cursor.rowcount:
+            raise BlobNotFoundError(digest)
+
+    def expire(self, retention_seconds=None):
+        """
+        Release every reference to blobs that have not been stored again within the retention period.
+
+        Args:
+            retention_seconds (float): Retention period (defaults to
+                                       storage.retention_days; None keeps blobs forever).
+
+        Returns:
+            int: The number of blobs released.
+        """
+        retention_seconds = self.retention_seconds if retention_seconds is None else retention_seconds
+        if not retention_seconds:
+            return 0
+        now = time.time()
+        # One statement, so a concurrent put() either lands before (and keeps the blob) or after
+        cursor = self._connection().execute(
+            "UPDATE blobs SET refcount = 0, last_ref = ? WHERE refcount > 0 AND last_ref < ?",
+            (now, now - retention_seconds))
+        return cursor.rowcount
+
+    def gc(self, grace_seconds=None):
+        """
+        Delete unreferenced blobs and orphaned object files.
+
+        Args:
+            grace_seconds (float): Minimum age since the last reference change
+                                   (defaults to storage.gc_grace_hours).
+
+        Returns:
+            dict: Counts of deleted blobs, orphans and bytes freed.
+        """
+        grace_seconds = self.gc_grace_seconds if grace_seconds is None else grace_seconds
+        cutoff = time.time() - grace_seconds
+        connection = self._connection()
+        stats = {"deleted": 0, "orphans": 0, "bytes_freed": 0}
+
+        candidates = connection.execute(
+            "SELECT digest, stored_size FROM blobs WHERE refcount = 0 AND last_ref < ?", (cutoff,)).fetchall()
+        for digest, stored_size in candidates:
+            # Re-check and unlink under the write lock, so a concurrent put() either
+            # re-references the blob first or publishes a fresh copy afterwards
+            with self._write_lock() as locked:
+                cursor = locked.execute(
+                    "DELETE FROM blobs WHERE digest = ? AND refcount = 0 AND last_ref < ?", (digest, cutoff))
+                if cursor.rowcount:
+                    try:
+                        os.remove(self.path_for(digest))
+                    except FileNotFoundError:
+                        pass
+            if cursor.rowcount:
+                stats["deleted"] += 1
+                stats["bytes_freed"] += stored_size
+
+        # Object files without an index row (e.g. a crash between write and insert),
+        # and temp files left behind by a put() that died before publishing
+        objects_dir = os.path.join(self.root, "objects")
+        tmp_cutoff = min(cutoff, time.time() - _TMP_GRACE_SECONDS)
+        for directory, _, files in os.walk(objects_dir):
+            for name in files:
+                path = os.path.join(directory, name)
+                digest = name.split(".", 1)[0]
+                is_tmp = name.endswith(".tmp")
+                try:
+                    if os.path.getmtime(path) >= (tmp_cutoff if is_tmp else cutoff):
+                        continue
+                    if is_tmp:
+                        size = os.path.getsize(path)
+                        os.remove(path)
+                    else:
+                        # A put() publishes the file and its row under the same lock
+                        with self._write_lock():
+                            if self.contains(digest):
+                                continue
+                            size = os.path.getsize(path)
+                            os.remove(path)
+                except FileNotFoundError:
+                    continue
+                stats["bytes_freed"] += size
+                stats["orphans"] += 1
+
+        return stats
+
+    def stats(self):
+        """
+        Summarize the store.
+
+        Returns:
+            dict: Blob count, logical and stored bytes, and total references.
+        """
+        row = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(stored_size), 0), "
+            "COALESCE(SUM(refcount), 0) FROM blobs").fetchone()
+        return dict(zip(["blobs", "bytes", "stored_bytes", "references"], row))
+
+
+# Create a lazily-initialized singleton instance
+blob_store = LazySingleton(BlobStore)
+
+
+def main():
+    """Command-line entry point for blob store maintenance."""
+    parser = argparse.ArgumentParser(description="Blob store tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="Show blob counts and sizes")
+    gc_parser = subparsers.add_parser("gc", help="Release expired films, then delete unreferenced blobs")
+    gc_parser.add_argument("--retention-days", type=float,
+                           help="Release films not stored again for this long (defaults to storage.retention_days)")
+    gc_parser.add_argument("--grace-hours", type=float,
+                           help="Minimum age of unreferenced blobs (defaults to storage.gc_grace_hours)")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        print(json.dumps(blob_store.stats(), indent=2))
+    elif args.command == "gc":
+        retention_seconds = args.retention_days * 86400 if args.retention_days is not None else None
+        grace_seconds = args.grace_hours * 3600 if args.grace_hours is not None else None
+        expired = blob_store.expire(retention_seconds)
+        print(json.dumps(dict(blob_store.gc(grace_seconds), expired=expired), indent=2))
+
+
+if __name__ == "__main__":
+    main()
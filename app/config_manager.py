@@ -5,8 +5,10 @@ Handles loading and accessing configuration from different sources.
 
 import os
 import json
-import yaml
-from app.constants import CONFIG_FILE, SETTINGS_FILE, PROMPTS_FILE
+import hashlib
+from app.constants import (ENV_VAR_API_ENDPOINT, CONFIG_FILE, SETTINGS_FILE, PROMPTS_FILE,
+                           CONFIG_CACHE_FILE, CONFIG_CACHE_VERSION)
+from app.lazy import LazySingleton
 
 
 class ConfigManager:
@@ -17,13 +19,79 @@ class ConfigManager:
         self.config = {}
         self.settings = {}
         self.prompts = {}
+        self.loaded_from_cache = False
+        self._template_version = None
         self._load_all()
 
     def _load_all(self):
-        """Load all configuration files."""
+        """Load all configuration files, preferring the precompiled cache."""
+        signature = self._source_signature()
+        if self._load_cache(signature):
+            self.loaded_from_cache = True
+            return
+
         self._load_config()
         self._load_settings()
         self._load_prompts()
+        self._write_cache(signature)
+
+    def _source_signature(self):
+        """Build a signature of the configuration sources (path, mtime, size)."""
+        signature = [CONFIG_CACHE_VERSION]
+        for path in (CONFIG_FILE, SETTINGS_FILE, PROMPTS_FILE):
+            try:
+                stat = os.stat(path)
+                signature.append((path, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append((path, None, None))
+        return tuple(signature)
+
+    def _load_cache(self, signature):
+        """
+        Load parsed configuration from the precompiled cache.
+
+        Args:
+            signature (tuple): The current source signature.
+
+        Returns:
+            bool: True if the cache was valid and loaded, False otherwise.
+        """
+        # Plain JSON, so a tampered cache file can at worst change settings, never run code
+        try:
+            with open(CONFIG_CACHE_FILE, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        # JSON has no tuples; compare in the form the signature was written
+        if not isinstance(cached, dict) or cached.get("signature") != json.loads(json.dumps(signature)):
+            return False
+
+        self.config = cached.get("config", {})
+        self.settings = cached.get("settings", {})
+        self.prompts = cached.get("prompts", {})
+        return True
+
+    def _write_cache(self, signature):
+        """Write the parsed configuration to the precompiled cache."""
+        if not (self.config and self.settings and self.prompts):
+            # Never cache a partial load; it would mask a broken file.
+            return
+
+        try:
+            os.makedirs(os.path.dirname(CONFIG_CACHE_FILE), exist_ok=True)
+            tmp_path = f"{CONFIG_CACHE_FILE}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "signature": signature,
+                    "config": self.config,
+                    "settings": self.settings,
+                    "prompts": self.prompts,
+                }, f)
+            os.replace(tmp_path, CONFIG_CACHE_FILE)
+        except (OSError, TypeError, ValueError) as e:
+            # TypeError: a YAML value (e.g. a date) that JSON cannot hold; just skip the cache
+            print(f"Error writing config cache: {e}")
 
     def _load_config(self):
         """Load the main configuration from JSON."""
@@ -36,6 +104,8 @@ class ConfigManager:
 
     def _load_settings(self):
         """Load user-configurable settings from YAML."""
+        import yaml
+
         try:
             with open(SETTINGS_FILE, 'r') as f:
                 self.settings = yaml.safe_load(f)
@@ -57,7 +127,11 @@ class ConfigManager:
         return self.config.get("api", {})
 
     def get_api_endpoint(self):
-        """Get the API endpoint URL."""
+        """Get the API endpoint URL (overridable through GROQ_API_ENDPOINT)."""
+        override = os.getenv(ENV_VAR_API_ENDPOINT)
+        if override:
+            return override
+
         endpoints = self.get_api_config().get("endpoints", {})
         return endpoints.get("groq")
 
@@ -116,6 +190,71 @@ class ConfigManager:
         """Get the report disclaimer text."""
         return self.config.get("report", {}).get("disclaimer", "")
 
+    def get_backend_config(self):
+        """Get the report backend configuration (local or remote service)."""
+        return self.settings.get("backend", {})
+
+    def get_service_config(self):
+        """Get the HTTP report service configuration."""
+        return self.settings.get("service", {})
+
+    def get_generation_config(self):
+        """Get report generation configuration (single-call or fan-out mode)."""
+        return self.settings.get("generation", {})
+
+    def get_regeneration_config(self):
+        """Get single-section regeneration configuration."""
+        return self.settings.get("regeneration", {})
+
+    def get_rate_limit_config(self):
+        """Get the upstream admission control configuration."""
+        return self.settings.get("rate_limit", {})
+
+    def get_image_qa_config(self):
+        """Get the pre-flight image quality check configuration."""
+        return self.settings.get("image_qa", {})
+
+    def get_audit_config(self):
+        """Get the audit log configuration."""
+        return self.settings.get("audit", {})
+
+    def get_storage_config(self):
+        """Get the blob store configuration."""
+        return self.settings.get("storage", {})
+
+    def get_profiling_config(self):
+        """Get the request profiler configuration."""
+        return self.settings.get("profiling", {})
+
+    def get_ingest_config(self):
+        """Get the hot-folder ingest configuration."""
+        return self.settings.get("ingest", {})
+
+    def get_exemplar_config(self):
+        """Get the few-shot exemplar index configuration."""
+        return self.settings.get("exemplars", {})
+
+    def get_batch_config(self):
+        """Get the offline batch-API configuration."""
+        return self.settings.get("batch", {})
+
+    def get_template_version(self):
+        """
+        Get the prompt template version recorded in audit entries.
+
+        Returns:
+            str: The report format version plus a short hash of the prompt templates.
+        """
+        if self._template_version is None:
+            digest = hashlib.sha256(json.dumps(self.prompts, sort_keys=True).encode("utf-8")).hexdigest()
+            format_version = self.config.get("report", {}).get("format_version", "")
+            self._template_version = f"{format_version}+{digest[:12]}"
+        return self._template_version
+
+    def get_startup_config(self):
+        """Get startup profiling configuration (budgets in milliseconds)."""
+        return self.config.get("startup", {})
+
 
-# Create a singleton instance
-config_manager = ConfigManager()
\ No newline at end of file
+# Create a lazily-initialized singleton instance
+config_manager = LazySingleton(ConfigManager)
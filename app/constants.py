@@ -9,14 +9,21 @@ from pathlib import Path
 ROOT_DIR = Path(__file__).parent.parent
 CONFIG_DIR = os.path.join(ROOT_DIR, "config")
 ASSETS_DIR = os.path.join(ROOT_DIR, "assets")
+AUDIT_DIR = os.path.join(ROOT_DIR, "audit")
+CACHE_DIR = os.getenv("RADIOLOGY_CACHE_DIR", os.path.join(ROOT_DIR, ".cache"))
 
 # Configuration files
 CONFIG_FILE = os.path.join(CONFIG_DIR, "config.json")
 SETTINGS_FILE = os.path.join(CONFIG_DIR, "settings.yaml")
 PROMPTS_FILE = os.path.join(CONFIG_DIR, "prompts.json")
+CONFIG_CACHE_FILE = os.path.join(CACHE_DIR, "config_cache.json")
+CONFIG_CACHE_VERSION = 2
 
 # Environment variables
 ENV_VAR_API_KEY = "GROQ_API_KEY"
+ENV_VAR_API_ENDPOINT = "GROQ_API_ENDPOINT"
+ENV_VAR_REPORT_SERVICE_URL = "REPORT_SERVICE_URL"
+ENV_VAR_OPERATOR = "RADIOLOGY_OPERATOR"
 
 # Report sections
 REPORT_SECTIONS = [
@@ -29,6 +36,10 @@ REPORT_SECTIONS = [
     "RECOMMENDATIONS:"
 ]
 
+# Placeholders for parts of a fan-out report that failed to generate
+FANOUT_SUBSECTION_FAILED = "Not assessed: this subsection could not be generated. Please regenerate FINDINGS."
+FANOUT_SYNTHESIS_FAILED = "Not available: this section could not be generated. Please regenerate it."
+
 # Default values
 DEFAULT_TECHNIQUE = "PA and lateral views of the chest"
 DEFAULT_COMPARISON = "No prior studies available for comparison."
@@ -40,9 +51,14 @@ Please create a .env file with your Groq API key: GROQ_API_KEY=your_key_here
 """
 ERROR_MISSING_IMAGES = "⚠️ Please upload both frontal and lateral X-ray images"
 ERROR_MISSING_INDICATION = "⚠️ Please provide at least the clinical indication"
+ERROR_UPSTREAM_UNAVAILABLE = ("⚠️ The AI service is currently unavailable after repeated failures. "
+                              "Please try again in a minute.")
+ERROR_UPSTREAM_BUSY = ("⚠️ The AI service is at capacity right now. "
+                       "Please try again shortly.")
 
 # Success messages
 SUCCESS_GENERATING_REPORT = "Generating comprehensive radiology report..."
+SUCCESS_REGENERATING_SECTION = "Regenerating {section} section..."
 
 # File upload
 ALLOWED_EXTENSIONS = ["png", "jpg", "jpeg"]
\ No newline at end of file
@@ -0,0 +1,111 @@
+"""
+Cache of draft reports generated ahead of the radiologist.
+
+Drafts are keyed by the SHA-256 digests of the frontal and lateral films, so
+when the same films are uploaded in the UI the draft is found without any
+worklist integration. Each draft is one JSON file written atomically, which
+lets the ingest daemon and any number of UI processes share the cache.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from app.config_manager import config_manager
+from app.constants import CACHE_DIR, ROOT_DIR
+from app.lazy import LazySingleton
+
+
+def study_key(frontal_digest, lateral_digest):
+    """
+    Build the cache key of a study from its film digests.
+
+    Args:
+        frontal_digest (str): SHA-256 hex digest of the frontal film.
+        lateral_digest (str): SHA-256 hex digest of the lateral film.
+
+    Returns:
+        str: The cache key.
+    """
+    return hashlib.sha256(f"{frontal_digest}:{lateral_digest}".encode("ascii")).hexdigest()
+
+
+class DraftCache:
+    """File-backed cache of pre-generated draft reports."""
+
+    def __init__(self, directory=None, settings=None):
+        """
+        Initialize the cache.
+
+        Args:
+            directory (str): Cache directory (defaults to ingest.draft_dir).
+            settings (dict): Ingest settings (defaults to settings.yaml ingest).
+        """
+        settings = config_manager.get_ingest_config() if settings is None else settings
+        self.directory = directory or settings.get("draft_dir") or os.path.join(CACHE_DIR, "drafts")
+        if not os.path.isabs(self.directory):
+            self.directory = os.path.join(ROOT_DIR, self.directory)
+        self.ttl_seconds = settings.get("draft_ttl_hours", 72) * 3600
+
+    def _path(self, key):
+        """Get the file path of a draft."""
+        return os.path.join(self.directory, f"{key}.json")
+
+    def put(self, frontal_digest, lateral_digest, draft):
+        """
+        Store a draft report.
+
+        Args:
+            frontal_digest (str): SHA-256 hex digest of the frontal film.
+            lateral_digest (str): SHA-256 hex digest of the lateral film.
+            draft (dict): The draft (report_id, analysis, clinical fields, ...).
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(study_key(frontal_digest, lateral_digest))
+        record = dict(draft, frontal=frontal_digest, lateral=lateral_digest, created=time.time())
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path)
+
+    def get(self, frontal_digest, lateral_digest):
+        """
+        Look up the draft for a study.
+
+        Returns:
+            dict: The draft, or None if there is none or it has expired.
+        """
+        path = self._path(study_key(frontal_digest, lateral_digest))
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                draft = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self.ttl_seconds and time.time() - draft.get("created", 0) > self.ttl_seconds:
+            return None
+        return draft
+
+    def prune(self):
+        """
+        Delete expired drafts.
+
+        Returns:
+            int: The number of drafts deleted.
+        """
+        if not self.ttl_seconds or not os.path.isdir(self.directory):
+            return 0
+        cutoff = time.time() - self.ttl_seconds
+        deleted = 0
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    deleted += 1
+            except FileNotFoundError:
+                continue
+        return deleted
+
+
+# Create a lazily-initialized singleton instance
+draft_cache = LazySingleton(DraftCache)
@@ -0,0 +1,368 @@
+"""
+Local vector index of finalized reports for few-shot exemplar retrieval.
+
+Reports are indexed by their indication and clinical history with a hashing
+embedder (unigrams and bigrams hashed into a fixed number of signed buckets),
+so no model or network access is needed. Vectors are quantized to int8 with a
+per-report scale and stored dimension-major in a memory-mapped file:
+
+    vectors.i8    int8   [dims, capacity]
+    scales.f32    float32 [capacity]
+    offsets.i64   int64  [capacity]   (line offsets into reports.jsonl)
+    reports.jsonl one finalized report per line
+    meta.json     dims, count and capacity
+
+Writers in different processes (UI replicas, the ingest daemon, batch
+collect) are serialized by an exclusive flock on index.lock, held from
+reading the metadata to publishing the new count.
+
+A query embeds to a handful of non-zero buckets, so search only reads those
+rows of the matrix (count bytes each) instead of the whole index, which keeps
+top-k in the milliseconds even for a million reports.
+
+Build and inspect the index with:
+    python -m app.exemplars add REPORTS.jsonl
+    python -m app.exemplars search "INDICATION" [--history TEXT]
+"""
+
+import argparse
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import re
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within one process
+    fcntl = None
+
+from app.config_manager import config_manager
+from app.constants import ROOT_DIR
+from app.lazy import LazySingleton, lazy_import
+
+np = lazy_import("numpy")
+
+INDEX_VERSION = 1
+SEARCH_BLOCK = 65536
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(["a", "an", "and", "are", "as", "at", "for", "in", "is", "of", "on", "or",
+                        "the", "to", "was", "with"])
+
+
+@functools.lru_cache(maxsize=65536)
+def _feature_slot(feature, dims):
+    """Hash a feature to a (bucket, sign) pair, stable across processes."""
+    value = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+    return value % dims, 1.0 if value >> 63 else -1.0
+
+
+def embed_text(text, dims):
+    """
+    Embed a text with the hashing trick.
+
+    Args:
+        text (str): The text (indication and clinical history).
+        dims (int): The number of hash buckets.
+
+    Returns:
+        numpy.ndarray: The L2-normalized float32 vector.
+    """
+    tokens = [token for token in _TOKEN.findall((text or "").lower()) if token not in _STOPWORDS]
+    features = tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+
+    vector = np.zeros(dims, dtype=np.float32)
+    for feature in features:
+        bucket, sign = _feature_slot(feature, dims)
+        vector[bucket] += sign
+
+    # Sublinear term frequency, then unit length
+    vector = np.sign(vector) * np.log1p(np.abs(vector))
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def quantize(vector):
+    """
+    Quantize a float vector to int8 with a scale factor.
+
+    Returns:
+        tuple: The int8 vector and the scale that maps it back to floats.
+    """
+    peak = float(np.abs(vector).max()) if vector.size else 0.0
+    if peak == 0:
+        return np.zeros(vector.shape, dtype=np.int8), 0.0
+    return np.round(vector * (127.0 / peak)).astype(np.int8), peak / 127.0
+
+
+def query_text(indication, clinical_history=None):
+    """Build the text that reports are indexed and searched by."""
+    return f"{indication or ''} {clinical_history or ''}".strip()
+
+
+class ExemplarIndex:
+    """Memory-mapped int8 vector index of finalized reports."""
+
+    def __init__(self, directory=None, settings=None):
+        """
+        Initialize the index.
+
+        Args:
+            directory (str): Index directory (defaults to exemplars.index_dir).
+            settings (dict): Exemplar settings (defaults to settings.yaml exemplars).
+        """
+        settings = config_manager.get_exemplar_config() if settings is None else settings
+        self.enabled = settings.get("enabled", True)
+        self.directory = directory or settings.get("index_dir", "exemplars")
+        if not os.path.isabs(self.directory):
+            self.directory = os.path.join(ROOT_DIR, self.directory)
+        self.dims = settings.get("dims", 256)
+        self.top_k = settings.get("top_k", 2)
+        self.token_budget = settings.get("token_budget", 800)
+        self.min_similarity = settings.get("min_similarity", 0.3)
+
+        self.count = 0
+        self.capacity = 0
+        self._vectors = None
+        self._scales = None
+        self._offsets = None
+        self._meta_mtime = None
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        """Get the path of an index file."""
+        return os.path.join(self.directory, name)
+
+    def _open(self, capacity):
+        """Memory-map the index files with the given capacity."""
+        self._vectors = np.memmap(self._path("vectors.i8"), dtype=np.int8, mode="r+",
+                                  shape=(self.dims, capacity))
+        self._scales = np.memmap(self._path("scales.f32"), dtype=np.float32, mode="r+", shape=(capacity,))
+        self._offsets = np.memmap(self._path("offsets.i64"), dtype=np.int64, mode="r+", shape=(capacity,))
+        self.capacity = capacity
+
+    def _refresh(self, force=False):
+        """Load the index metadata, remapping if another process changed it."""
+        meta_path = self._path("meta.json")
+        try:
+            mtime = os.stat(meta_path).st_mtime_ns
+        except FileNotFoundError:
+            self.count = 0
+            return
+        if mtime == self._meta_mtime and not force:
+            return
+
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported exemplar index version {meta.get('version')} in {self.directory}")
+        self.dims = meta["dims"]
+        if meta["capacity"] != self.capacity or self._vectors is None:
+            self._open(meta["capacity"])
+        self.count = meta["count"]
+        self._meta_mtime = mtime
+
+    @contextlib.contextmanager
+    def _write_lock(self):
+        """Hold the index's exclusive write lock across processes."""
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path("index.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_meta(self):
+        """Publish the current count and capacity (atomically, after the data)."""
+        meta_path = self._path("meta.json")
+        tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "dims": self.dims, "count": self.count,
+                       "capacity": self.capacity}, f)
+        os.replace(tmp_path, meta_path)
+        self._meta_mtime = os.stat(meta_path).st_mtime_ns
+
+    def _grow(self, needed):
+        """Grow the memory-mapped files to hold at least the given count."""
+        capacity = max(1024, self.capacity)
+        while capacity < needed:
+            capacity *= 2
+        if capacity == self.capacity:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        old_vectors = np.array(self._vectors[:, :self.count]) if self.count else None
+        for name, dtype, shape in (("scales.f32", np.float32, (capacity,)),
+                                   ("offsets.i64", np.int64, (capacity,))):
+            # Flat arrays keep their layout when extended
+            with open(self._path(name), "ab") as f:
+                f.truncate(int(np.dtype(dtype).itemsize * shape[0]))
+
+        # Dimension-major rows move when the capacity changes, so rewrite them
+        tmp_path = self._path("vectors.i8.tmp")
+        resized = np.memmap(tmp_path, dtype=np.int8, mode="w+", shape=(self.dims, capacity))
+        if old_vectors is not None:
+            resized[:, :self.count] = old_vectors
+        resized.flush()
+        del resized
+        self._vectors = None
+        os.replace(tmp_path, self._path("vectors.i8"))
+        self._open(capacity)
+
+    def add_batch(self, records):
+        """
+        Add finalized reports to the index.
+
+        Args:
+            records (list): Dicts with "report_id", "indication",
+                            "clinical_history" and "text".
+
+        Returns:
+            int: The number of reports in the index.
+        """
+        records = [record for record in records if record.get("text")]
+        if not records:
+            return self.count
+
+        with self._lock, self._write_lock():
+            # Another process may have appended or grown the files since the last
+            # refresh, even within the same mtime tick
+            self._refresh(force=True)
+            self._grow(self.count + len(records))
+
+            vectors = np.zeros((self.dims, len(records)), dtype=np.int8)
+            scales = np.zeros(len(records), dtype=np.float32)
+            offsets = np.zeros(len(records), dtype=np.int64)
+            with open(self._path("reports.jsonl"), "ab") as f:
+                for i, record in enumerate(records):
+                    vectors[:, i], scales[i] = quantize(
+                        embed_text(query_text(record.get("indication"), record.get("clinical_history")), self.dims))
+                    offsets[i] = f.tell()
+                    f.write(json.dumps(record).encode("utf-8") + b"\n")
+
+            end = self.count + len(records)
+            self._vectors[:, self.count:end] = vectors
+            self._scales[self.count:end] = scales
+            self._offsets[self.count:end] = offsets
+            for array in (self._vectors, self._scales, self._offsets):
+                array.flush()
+            self.count = end
+            self._write_meta()
+            return self.count
+
+    def add(self, report_id, indication, clinical_history, text):
+        """
+        Add one finalized report to the index.
+
+        Returns:
+            int: The number of reports in the index.
+        """
+        return self.add_batch([{"report_id": report_id, "indication": indication,
+                                "clinical_history": clinical_history, "text": text}])
+
+    def _read_record(self, position):
+        """Read one report record by its index position."""
+        with open(self._path("reports.jsonl"), "rb") as f:
+            f.seek(int(self._offsets[position]))
+            return json.loads(f.readline())
+
+    def search(self, indication, clinical_history=None, k=None):
+        """
+        Find the reports most similar to an indication and history.
+
+        Args:
+            indication (str): The clinical indication.
+            clinical_history (str): The clinical history (optional).
+            k (int): Number of results (defaults to exemplars.top_k).
+
+        Returns:
+            list: (similarity, record) tuples, most similar first.
+        """
+        k = k or self.top_k
+        with self._lock:
+            self._refresh()
+            count = self.count
+            if count == 0:
+                return []
+
+            query, query_scale = quantize(embed_text(query_text(indication, clinical_history), self.dims))
+            buckets = np.flatnonzero(query)
+            if buckets.size == 0:
+                return []
+
+            # Only the query's non-zero buckets contribute to the dot products. Rows
+            # are converted in cache-sized blocks into one reused float32 buffer.
+            weights = query[buckets].astype(np.float32)
+            scores = np.empty(count, dtype=np.float32)
+            block = np.empty((buckets.size, min(count, SEARCH_BLOCK)), dtype=np.float32)
+            for start in range(0, count, SEARCH_BLOCK):
+                end = min(count, start + SEARCH_BLOCK)
+                rows = block[:, :end - start]
+                np.copyto(rows, self._vectors[buckets, start:end], casting="unsafe")
+                np.dot(weights, rows, out=scores[start:end])
+            scores *= self._scales[:count]
+            scores *= query_scale
+
+            k = min(k, count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(float(scores[i]), self._read_record(i)) for i in top]
+
+    def select_exemplars(self, indication, clinical_history=None, token_budget=None):
+        """
+        Pick the most similar past reports that fit in the prompt token budget.
+
+        Args:
+            indication (str): The clinical indication.
+            clinical_history (str): The clinical history (optional).
+            token_budget (int): Tokens available for exemplars (defaults to exemplars.token_budget).
+
+        Returns:
+            list: The selected records, most similar first.
+        """
+        remaining = self.token_budget if token_budget is None else token_budget
+        selected = []
+        for similarity, record in self.search(indication, clinical_history):
+            if similarity < self.min_similarity:
+                break
+            # Same estimate as the admission controller: 4 characters per token
+            tokens = len(record["text"]) // 4
+            if tokens <= remaining:
+                selected.append(record)
+                remaining -= tokens
+        return selected
+
+
+# Create a lazily-initialized singleton instance
+exemplar_index = LazySingleton(ExemplarIndex)
+
+
+def main():
+    """Command-line entry point for exemplar index tools."""
+    parser = argparse.ArgumentParser(description="Exemplar report index tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    add_parser = subparsers.add_parser("add", help="Index finalized reports from a JSONL file")
+    add_parser.add_argument("path", help="JSONL with report_id, indication, clinical_history and text")
+    search_parser = subparsers.add_parser("search", help="Show the most similar indexed reports")
+    search_parser.add_argument("indication")
+    search_parser.add_argument("--history", help="Clinical history")
+    search_parser.add_argument("-k", type=int, help="Number of results")
+    args = parser.parse_args()
+
+    if args.command == "add":
+        with open(args.path, "r", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        print(f"{exemplar_index.add_batch(records)} reports indexed")
+    elif args.command == "search":
+        for similarity, record in exemplar_index.search(args.indication, args.history, args.k):
+            print(f"{similarity:.3f}  {record.get('report_id')}  {query_text(record.get('indication'), record.get('clinical_history'))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Pre-flight quality checks for uploaded chest X-ray images.
+
+The checks run on a downsampled grayscale copy of each image and are fully
+vectorized with NumPy, so a study is checked in a few milliseconds before
+any API call is made:
+
+- Exposure: 256-bin histogram, clipped dark/bright fractions and dynamic range.
+- Blank images: near-zero contrast.
+- Size: images too small to measure are rejected without further checks.
+- Orientation: left-right vs. top-bottom mirror symmetry (a chest film is
+  roughly symmetric about the vertical spine, not about a horizontal axis),
+  and dark lung fields above the brighter diaphragm for upside-down films.
+- View: frontal films show two dark lung fields either side of a bright
+  mediastinum; lateral films do not.
+"""
+
+from app.config_manager import config_manager
+from app.lazy import lazy_import
+
+np = lazy_import("numpy")
+
+# Issue severities
+SEVERITY_BLOCK = "block"
+SEVERITY_WARN = "warn"
+
+IMAGE_QUALITY_PREFIX = "Image quality (automated pre-check)"
+
+# Smallest analysis copy side the band measurements below are defined for
+MIN_ANALYSIS_SIDE = 16
+
+
+def _to_array(image, size):
+    """
+    Convert a PIL image to a small float32 grayscale array in [0, 1].
+
+    Args:
+        image (PIL.Image.Image): The image.
+        size (int): Maximum side length of the analysis copy.
+
+    Returns:
+        numpy.ndarray: The 2-D pixel array.
+    """
+    # 16-bit and float films would be clipped by convert("L"), so they keep their
+    # depth and are windowed to the full film's own pixel range instead
+    high_depth = image.mode.startswith("I") or image.mode == "F"
+    if high_depth:
+        low, high = image.getextrema()
+        small = image.convert("F")
+    else:
+        small = image.convert("L")
+    # Integer box reduction first is much cheaper than resampling the full film
+    factor = max(small.size) // size
+    if factor > 1:
+        small = small.reduce(factor)
+    small.thumbnail((size, size))
+    if not high_depth:
+        return np.asarray(small, dtype=np.float32) / 255.0
+
+    pixels = np.asarray(small, dtype=np.float32)
+    if high <= low:
+        return np.zeros_like(pixels)
+    return np.clip((pixels - low) / float(high - low), 0.0, 1.0)
+
+
+def _correlation(a, b):
+    """Pearson correlation of two equally shaped arrays (0 for flat inputs)."""
+    a = a - a.mean()
+    b = b - b.mean()
+    denominator = np.sqrt((a * a).sum() * (b * b).sum())
+    return float((a * b).sum() / denominator) if denominator > 0 else 0.0
+
+
+def _too_small(width, height):
+    """Measurements for an image too small (or too narrow) to assess."""
+    return {
+        "width": width,
+        "height": height,
+        "mean": 0.0,
+        "std": 0.0,
+        "dark_fraction": 0.0,
+        "bright_fraction": 0.0,
+        "dynamic_range": 0.0,
+        "histogram_16": [0.0] * 16,
+        "exposure": "too_small",
+        "lr_symmetry": 0.0,
+        "ud_symmetry": 0.0,
+        "orientation": "unknown",
+        "vertical_contrast": 0.0,
+        "central_contrast": 0.0,
+        "frontal_score": 0.0,
+        "view": "unknown",
+    }
+
+
+def measure_image(image, settings=None):
+    """
+    Compute quality measurements for one image.
+
+    Args:
+        image (PIL.Image.Image): The image.
+        settings (dict): QA settings (defaults to settings.yaml image_qa).
+
+    Returns:
+        dict: Exposure, contrast, symmetry, orientation and view measurements
+              (exposure "too_small" if the image is below image_qa.min_size).
+    """
+    settings = config_manager.get_image_qa_config() if settings is None else settings
+    width, height = image.size
+    if min(width, height) < settings.get("min_size", 64):
+        return _too_small(width, height)
+    pixels = _to_array(image, settings.get("analysis_size", 256))
+    # Very elongated images shrink to a sliver in the analysis copy
+    if min(pixels.shape) < MIN_ANALYSIS_SIDE:
+        return _too_small(width, height)
+
+    # Exposure histogram and its cumulative distribution
+    histogram = np.bincount((pixels * 255).astype(np.uint8).ravel(), minlength=256) / pixels.size
+    cumulative = np.cumsum(histogram)
+    p1, p99 = np.searchsorted(cumulative, [0.01, 0.99]) / 255.0
+
+    # Symmetry about the vertical and horizontal axes
+    lr_symmetry = _correlation(pixels, pixels[:, ::-1])
+    ud_symmetry = _correlation(pixels, pixels[::-1, :])
+
+    rotation_margin = settings.get("rotation_margin", 0.15)
+    if ud_symmetry > lr_symmetry + rotation_margin:
+        orientation = "rotated_90"
+        # Classify the view as if the image had been rotated back upright
+        upright = pixels.T
+    else:
+        orientation = "upright"
+        upright = pixels
+
+    # Frontal films: bright central band (mediastinum/spine) between darker lung fields
+    columns = upright.mean(axis=0)
+    n = columns.size
+    center = columns[int(n * 0.42):int(n * 0.58)].mean()
+    lungs = np.concatenate([columns[int(n * 0.2):int(n * 0.35)], columns[int(n * 0.65):int(n * 0.8)]]).mean()
+    central_contrast = float(center - lungs)
+
+    # Upright films have dark lung fields above the brighter diaphragm and abdomen.
+    # Mirror symmetry cannot tell a 180 degree rotation apart, so compare the two.
+    rows = np.concatenate([upright[:, int(n * 0.2):int(n * 0.35)], upright[:, int(n * 0.65):int(n * 0.8)]],
+                          axis=1).mean(axis=1)
+    m = rows.size
+    vertical_contrast = float(rows[int(m * 0.75):int(m * 0.95)].mean() - rows[int(m * 0.25):int(m * 0.5)].mean())
+    if orientation == "upright" and vertical_contrast < -settings.get("inverted_margin", 0.05):
+        orientation = "rotated_180"
+
+    symmetry = max(lr_symmetry, ud_symmetry) if orientation == "rotated_90" else lr_symmetry
+    frontal_score = 0.5 * symmetry + 0.5 * np.clip(0.5 + central_contrast * 5.0, 0.0, 1.0)
+
+    std = float(pixels.std())
+    mean = float(pixels.mean())
+    dark_fraction = float(histogram[:13].sum())
+    bright_fraction = float(histogram[243:].sum())
+
+    if std < settings.get("blank_std", 0.02):
+        exposure = "blank"
+    elif mean < settings.get("overexposed_mean", 0.2) or dark_fraction > settings.get("clip_warn_fraction", 0.25):
+        exposure = "overexposed"
+    elif mean > settings.get("underexposed_mean", 0.85) or bright_fraction > settings.get("clip_warn_fraction", 0.25):
+        exposure = "underexposed"
+    else:
+        exposure = "adequate"
+
+    return {
+        "width": width,
+        "height": height,
+        "mean": round(mean, 4),
+        "std": round(std, 4),
+        "dark_fraction": round(dark_fraction, 4),
+        "bright_fraction": round(bright_fraction, 4),
+        "dynamic_range": round(float(p99 - p1), 4),
+        "histogram_16": [round(float(v), 4) for v in histogram.reshape(16, 16).sum(axis=1)],
+        "exposure": exposure,
+        "lr_symmetry": round(lr_symmetry, 4),
+        "ud_symmetry": round(ud_symmetry, 4),
+        "orientation": orientation,
+        "vertical_contrast": round(vertical_contrast, 4),
+        "central_contrast": round(central_contrast, 4),
+        "frontal_score": round(float(frontal_score), 4),
+        "view": "frontal" if frontal_score >= settings.get("frontal_threshold", 0.55) else "lateral",
+    }
+
+
+def _image_issues(label, measurements, settings):
+    """List the issues found in one image's measurements."""
+    issues = []
+    if measurements["exposure"] == "too_small":
+        return [(SEVERITY_BLOCK, f"The {label} image is too small to assess "
+                                 f"({measurements['width']}x{measurements['height']} pixels).")]
+    if measurements["exposure"] == "blank":
+        issues.append((SEVERITY_BLOCK, f"The {label} image appears blank (no visible contrast)."))
+    elif measurements["exposure"] != "adequate":
+        clipped = max(measurements["dark_fraction"], measurements["bright_fraction"])
+        severity = SEVERITY_BLOCK if clipped > settings.get("clip_block_fraction", 0.6) else SEVERITY_WARN
+        issues.append((severity, f"The {label} image looks {measurements['exposure']} "
+                                 f"({clipped:.0%} of pixels clipped)."))
+    if measurements["orientation"] == "rotated_90":
+        issues.append((SEVERITY_WARN, f"The {label} image may be rotated by 90 degrees."))
+    elif measurements["orientation"] == "rotated_180":
+        issues.append((SEVERITY_WARN, f"The {label} image may be upside down."))
+    return issues
+
+
+def assess_study(frontal_image, lateral_image, settings=None):
+    """
+    Run the pre-flight checks on a frontal/lateral pair.
+
+    Args:
+        frontal_image (PIL.Image.Image): Image uploaded in the frontal slot.
+        lateral_image (PIL.Image.Image): Image uploaded in the lateral slot.
+        settings (dict): QA settings (defaults to settings.yaml image_qa).
+
+    Returns:
+        dict: {"frontal", "lateral"} measurements, "issues" as a list of
+              {"severity", "message"} and "blocked" (True if any issue blocks).
+    """
+    settings = config_manager.get_image_qa_config() if settings is None else settings
+    frontal = measure_image(frontal_image, settings)
+    lateral = measure_image(lateral_image, settings)
+
+    issues = _image_issues("frontal", frontal, settings) + _image_issues("lateral", lateral, settings)
+
+    # View checks only make sense on usable images
+    unusable = ("blank", "too_small")
+    if frontal["exposure"] not in unusable and lateral["exposure"] not in unusable:
+        if frontal["view"] == "lateral" and lateral["view"] == "frontal":
+            issues.append((SEVERITY_BLOCK, "The frontal and lateral images appear to be swapped."))
+        elif frontal["view"] == lateral["view"]:
+            issues.append((SEVERITY_WARN, f"Both images look like {frontal['view']} views."))
+
+    return {
+        "frontal": frontal,
+        "lateral": lateral,
+        "issues": [{"severity": severity, "message": message} for severity, message in issues],
+        "blocked": any(severity == SEVERITY_BLOCK for severity, _ in issues),
+    }
+
+
+def _describe(measurements):
+    """Describe one image's measurements for the prompt."""
+    return (f"{measurements['exposure']} exposure (mean brightness {measurements['mean']:.2f}, "
+            f"dynamic range {measurements['dynamic_range']:.2f}), "
+            f"{'upright' if measurements['orientation'] == 'upright' else 'possibly rotated'}, "
+            f"consistent with a {measurements['view']} view")
+
+
+def add_quality_to_technique(technique, assessment):
+    """
+    Append the QA measurements to the technique text used in the prompt.
+
+    Args:
+        technique (str): The technique entered on the form.
+        assessment (dict): The result of assess_study().
+
+    Returns:
+        str: The technique text including the image quality summary.
+    """
+    if not assessment or IMAGE_QUALITY_PREFIX in (technique or ""):
+        return technique
+    summary = (f"{IMAGE_QUALITY_PREFIX}: frontal image {_describe(assessment['frontal'])}; "
+               f"lateral image {_describe(assessment['lateral'])}.")
+    return f"{technique}. {summary}" if technique else summary
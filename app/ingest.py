@@ -0,0 +1,505 @@
+"""
+Hot-folder ingest daemon that pre-generates draft reports.
+
+Studies are dropped into the watched folder as a pair of films plus an
+optional sidecar with the clinical fields:
+
+    <study>_frontal.png   (or _pa / _ap, .jpg / .jpeg)
+    <study>_lateral.png   (or _lat)
+    <study>.json          {"indication", "comparison", "technique", "patient_age",
+                           "patient_sex", "clinical_history", "patient_id",
+                           "patient_name", "priority"}
+
+Once both films have settled, the study is queued by urgency (an explicit
+"priority" of stat/urgent/routine, otherwise keywords in the indication and
+history) and then arrival time. Workers run the image checks, keep the films
+in the blob store, generate the report through APIClient and put it in the
+draft cache, where the UI finds it as soon as the same films are uploaded.
+Processed studies are moved to done/ (or failed/, with the reason).
+
+The folder is watched with inotify on Linux, and polled elsewhere.
+
+Run with:
+    python -m app.ingest [--dir DIRECTORY] [--once]
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import hashlib
+import io
+import itertools
+import json
+import os
+import queue
+import re
+import select
+import shutil
+import struct
+import threading
+import time
+
+from app.config_manager import config_manager
+from app.constants import DEFAULT_COMPARISON, DEFAULT_TECHNIQUE, ROOT_DIR
+from app.draft_cache import DraftCache
+from app.metrics import metrics
+
+STUDY_FILE_PATTERN = re.compile(r"^(?P<study>.+?)[_\-. ](?P<view>frontal|pa|ap|lateral|lat)\.(?:png|jpe?g)$",
+                                re.IGNORECASE)
+FRONTAL_VIEWS = {"frontal", "pa", "ap"}
+
+# Queue order: lower ranks are generated first
+PRIORITY_RANKS = {"stat": 0, "urgent": 1, "routine": 2}
+
+
+class IngestError(Exception):
+    """Raised when a dropped study cannot be turned into a draft."""
+
+
+def classify_file(name):
+    """
+    Work out which study a dropped file belongs to.
+
+    Args:
+        name (str): The file name.
+
+    Returns:
+        tuple: (study, kind) with kind "frontal", "lateral" or "sidecar",
+               or None for unrelated files.
+    """
+    if name.startswith(".") or name.endswith(".tmp"):
+        return None
+    match = STUDY_FILE_PATTERN.match(name)
+    if match:
+        view = match.group("view").lower()
+        return match.group("study"), "frontal" if view in FRONTAL_VIEWS else "lateral"
+    if name.lower().endswith(".json"):
+        return name[:-len(".json")], "sidecar"
+    return None
+
+
+def study_priority(clinical, settings):
+    """
+    Determine the urgency of a study.
+
+    Args:
+        clinical (dict): The sidecar fields.
+        settings (dict): Ingest settings with "urgency_keywords".
+
+    Returns:
+        str: "stat", "urgent" or "routine".
+    """
+    explicit = str(clinical.get("priority") or "").strip().lower()
+    if explicit in PRIORITY_RANKS:
+        return explicit
+
+    text = f"{clinical.get('indication') or ''} {clinical.get('clinical_history') or ''}".lower()
+    keywords = settings.get("urgency_keywords", {})
+    for level in ("stat", "urgent"):
+        if any(keyword.lower() in text for keyword in keywords.get(level, [])):
+            return level
+    return "routine"
+
+
+def read_sidecar(path):
+    """
+    Read the clinical fields of a study.
+
+    Args:
+        path (str): The sidecar path, or None.
+
+    Returns:
+        dict: The sidecar fields (empty without a sidecar).
+
+    Raises:
+        IngestError: If the sidecar is not a JSON object.
+    """
+    if path is None:
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            clinical = json.load(f)
+    except ValueError as e:
+        raise IngestError(f"Invalid sidecar {os.path.basename(path)}: {e}")
+    if not isinstance(clinical, dict):
+        raise IngestError(f"Sidecar {os.path.basename(path)} must be a JSON object")
+    return clinical
+
+
+def prepare_study(files, clinical, settings, store=True):
+    """
+    Check a study's films, keep them in the blob store if they pass and build its generation arguments.
+
+    Args:
+        files (dict): Paths of the "frontal" and "lateral" films.
+        clinical (dict): The sidecar fields.
+        settings (dict): Ingest settings with "default_indication".
+        store (bool): Keep the films in the blob store (False to only compute their digests).
+
+    Returns:
+        tuple: (arguments, digests, image_qa) where arguments are the
+               generate_report keyword arguments and digests the film
+               SHA-256 digests by view.
+
+    Raises:
+        IngestError: If the films are unreadable or fail the image checks.
+    """
+    from PIL import Image
+    from app.blob_store import blob_store
+    from app.image_qa import add_quality_to_technique, assess_study
+
+    films = {}
+    for view in ("frontal", "lateral"):
+        with open(files[view], "rb") as f:
+            films[view] = f.read()
+
+    try:
+        frontal_image = Image.open(io.BytesIO(films["frontal"]))
+        lateral_image = Image.open(io.BytesIO(films["lateral"]))
+        frontal_image.load()
+        lateral_image.load()
+    except Exception as e:
+        raise IngestError(f"Unreadable image: {e}")
+
+    image_qa = None
+    if config_manager.get_image_qa_config().get("enabled", True):
+        image_qa = assess_study(frontal_image, lateral_image)
+        if image_qa["blocked"]:
+            raise IngestError(" ".join(issue["message"] for issue in image_qa["issues"]
+                                       if issue["severity"] == "block"))
+
+    # Only films that passed the checks are kept
+    store = store and blob_store.enabled
+    digests = {view: blob_store.put(data) if store else hashlib.sha256(data).hexdigest()
+               for view, data in films.items()}
+
+    patient_sex = clinical.get("patient_sex")
+    arguments = {
+        "indication": clinical.get("indication") or settings.get("default_indication", "Not provided"),
+        "comparison": clinical.get("comparison") or DEFAULT_COMPARISON,
+        "technique": add_quality_to_technique(clinical.get("technique") or DEFAULT_TECHNIQUE, image_qa),
+        "patient_age": clinical.get("patient_age") or None,
+        "patient_sex": patient_sex if patient_sex and patient_sex != "Other" else None,
+        "clinical_history": clinical.get("clinical_history") or None,
+    }
+    return arguments, digests, image_qa
+
+
+class _InotifyWatcher:
+    """Directory watcher using Linux inotify through libc."""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self, directory):
+        """
+        Start watching a directory.
+
+        Raises:
+            OSError: If inotify is not available.
+        """
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available on this platform")
+        self._fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # Completed writes and files moved in (e.g. by an atomic copy) only
+        if libc.inotify_add_watch(self._fd, os.fsencode(directory), self.IN_CLOSE_WRITE | self.IN_MOVED_TO) < 0:
+            error = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(error, f"inotify_add_watch failed for {directory}")
+
+    def wait(self, timeout):
+        """
+        Wait for files to be written or moved into the directory.
+
+        Returns:
+            set: Names of the changed files.
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        names = set()
+        offset = 0
+        while offset + self._EVENT.size <= len(data):
+            _, _, _, length = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if name:
+                names.add(os.fsdecode(name))
+        return names
+
+    def close(self):
+        """Stop watching."""
+        os.close(self._fd)
+
+
+class _PollingWatcher:
+    """Directory watcher comparing modification times and sizes."""
+
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self._seen = {}
+
+    def wait(self, timeout):
+        """
+        Sleep for up to one poll interval and rescan the directory.
+
+        Returns:
+            set: Names of new or changed files.
+        """
+        time.sleep(min(timeout, self.interval))
+        changed = set()
+        current = {}
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            current[entry.name] = (stat.st_mtime_ns, stat.st_size)
+            if self._seen.get(entry.name) != current[entry.name]:
+                changed.add(entry.name)
+        self._seen = current
+        return changed
+
+    def close(self):
+        """Stop watching."""
+
+
+class IngestDaemon:
+    """Watches a drop folder and pre-generates draft reports."""
+
+    def __init__(self, directory=None, settings=None, client=None):
+        """
+        Initialize the daemon.
+
+        Args:
+            directory (str): The drop folder (defaults to ingest.watch_dir).
+            settings (dict): Ingest settings (defaults to settings.yaml ingest).
+            client (APIClient): Client used for generation (defaults to a new APIClient).
+        """
+        self.settings = config_manager.get_ingest_config() if settings is None else settings
+        self.directory = directory or self.settings.get("watch_dir", "inbox")
+        if not os.path.isabs(self.directory):
+            self.directory = os.path.join(ROOT_DIR, self.directory)
+        self.done_dir = os.path.join(self.directory, "done")
+        self.failed_dir = os.path.join(self.directory, "failed")
+        self.settle = self.settings.get("settle_s", 1.0)
+        self.sidecar_wait = self.settings.get("sidecar_wait_s", 5.0)
+        self.poll_interval = self.settings.get("poll_interval_s", 2.0)
+        self.workers = self.settings.get("workers", 2)
+
+        if client is None:
+            from app.api import APIClient
+            client = APIClient()
+        self.client = client
+        self.drafts = DraftCache(settings=self.settings)
+
+        self._pending = {}
+        self._active = set()
+        self._active_lock = threading.Lock()
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._stop = threading.Event()
+
+    def _create_watcher(self):
+        """Create an inotify watcher, falling back to polling."""
+        if self.settings.get("watcher", "auto") != "polling":
+            try:
+                return _InotifyWatcher(self.directory)
+            except (OSError, AttributeError) as e:
+                print(f"inotify unavailable ({e}); polling {self.directory} instead")
+        return _PollingWatcher(self.directory, self.poll_interval)
+
+    def _note_files(self, names, now):
+        """Record dropped files against their studies."""
+        for name in names:
+            classified = classify_file(name)
+            if classified is None:
+                continue
+            study, kind = classified
+            with self._active_lock:
+                if study in self._active:
+                    continue
+            entry = self._pending.setdefault(study, {"files": {}})
+            entry["files"][kind] = os.path.join(self.directory, name)
+            entry["last_change"] = now
+
+    def _enqueue_ready(self, now, force=False):
+        """Queue the studies whose films have settled."""
+        for study, entry in list(self._pending.items()):
+            files = entry["files"]
+            if "frontal" not in files or "lateral" not in files:
+                continue
+            if not force:
+                quiet = now - entry["last_change"]
+                if quiet < self.settle or ("sidecar" not in files and quiet < self.sidecar_wait):
+                    continue
+
+            del self._pending[study]
+            try:
+                clinical = read_sidecar(files.get("sidecar"))
+                arrived = min(os.path.getmtime(path) for path in files.values())
+            except (OSError, IngestError) as e:
+                self._finish(study, files, error=e)
+                continue
+
+            priority = study_priority(clinical, self.settings)
+            with self._active_lock:
+                self._active.add(study)
+            self._queue.put((PRIORITY_RANKS[priority], arrived, next(self._counter), {
+                "study": study,
+                "files": files,
+                "clinical": clinical,
+                "priority": priority,
+                "queued_at": time.time(),
+            }))
+            metrics.increment(f"ingest.queued.{priority}")
+            metrics.set_gauge("ingest.queue_depth", self._queue.qsize())
+
+    def process_study(self, item):
+        """
+        Generate and cache the draft report for a queued study.
+
+        Args:
+            item (dict): The queued study.
+
+        Returns:
+            dict: The cached draft.
+
+        Raises:
+            IngestError: If the films fail the image checks.
+        """
+        from app.utils import generate_report_id
+
+        metrics.observe("ingest.queue_wait_ms", (time.time() - item["queued_at"]) * 1000.0)
+        started = time.perf_counter()
+
+        clinical = item["clinical"]
+        arguments, digests, image_qa = prepare_study(item["files"], clinical, self.settings)
+        report_id = generate_report_id()
+        analysis = self.client.generate_report(**arguments, audit={
+            "report_id": report_id,
+            "patient_id": clinical.get("patient_id"),
+            "operator": "ingest",
+            "study": digests,
+        })
+
+        draft = {
+            "report_id": report_id,
+            "analysis": analysis,
+            "clinical": arguments,
+            "patient_id": clinical.get("patient_id"),
+            "patient_name": clinical.get("patient_name"),
+            "image_qa": image_qa,
+            "priority": item["priority"],
+            "source": item["study"],
+        }
+        self.drafts.put(digests["frontal"], digests["lateral"], draft)
+        metrics.observe("ingest.generation_ms", (time.perf_counter() - started) * 1000.0)
+        return draft
+
+    def _finish(self, study, files, error=None):
+        """Move a study's files to done/ or failed/ (with the reason)."""
+        target = os.path.join(self.failed_dir if error else self.done_dir, study)
+        os.makedirs(target, exist_ok=True)
+        for path in files.values():
+            try:
+                shutil.move(path, os.path.join(target, os.path.basename(path)))
+            except FileNotFoundError:
+                continue
+        if error:
+            with open(os.path.join(target, "error.txt"), "w", encoding="utf-8") as f:
+                f.write(f"{error}\n")
+
+    def _worker(self):
+        """Worker loop: generate drafts in priority order until stopped."""
+        while True:
+            _, _, _, item = self._queue.get()
+            if item is None:
+                return
+            metrics.set_gauge("ingest.queue_depth", self._queue.qsize())
+            try:
+                draft = self.process_study(item)
+                metrics.increment("ingest.drafts")
+                print(f"Draft {draft['report_id']} ready for {item['study']} ({item['priority']})")
+                self._finish(item["study"], item["files"])
+            except Exception as e:
+                metrics.increment("ingest.failures")
+                print(f"Error generating draft for {item['study']}: {e}")
+                self._finish(item["study"], item["files"], error=e)
+            finally:
+                with self._active_lock:
+                    self._active.discard(item["study"])
+
+    def stop(self):
+        """Ask a running daemon to finish its queue and exit."""
+        self._stop.set()
+
+    def run(self, once=False):
+        """
+        Watch the folder and generate drafts.
+
+        Args:
+            once (bool): Process the complete studies already in the folder and exit.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        threads = [threading.Thread(target=self._worker, name=f"ingest-worker-{i}", daemon=True)
+                   for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        watcher = None if once else self._create_watcher()
+        try:
+            # Pick up studies dropped while the daemon was not running
+            self._note_files(os.listdir(self.directory), time.monotonic())
+            while not self._stop.is_set():
+                self._enqueue_ready(time.monotonic(), force=once)
+                if once:
+                    break
+                self._note_files(watcher.wait(min(self.settle, self.poll_interval)), time.monotonic())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # Sentinels sort after every real study, so the queue drains first
+            for _ in threads:
+                self._queue.put((float("inf"), 0, next(self._counter), None))
+            for thread in threads:
+                thread.join()
+            if watcher is not None:
+                watcher.close()
+
+
+def main():
+    """Run the ingest daemon from the command line."""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Pre-generate draft reports for studies dropped in a folder")
+    parser.add_argument("--dir", help="Drop folder (defaults to settings.yaml ingest.watch_dir)")
+    parser.add_argument("--once", action="store_true", help="Process the studies already present and exit")
+    args = parser.parse_args()
+
+    daemon = IngestDaemon(args.dir)
+    if not daemon.client.is_configured():
+        raise SystemExit("The API client is not configured (set GROQ_API_KEY)")
+    print(f"Watching {daemon.directory} for studies")
+    daemon.run(once=args.once)
+
+
+if __name__ == "__main__":
+    main()
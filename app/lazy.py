@@ -0,0 +1,103 @@
+"""
+Helpers for deferring expensive work until it is actually needed.
+
+Module-level singletons and heavy third-party imports (streamlit, torch,
+transformers, ...) are wrapped so that importing an ``app`` module stays cheap
+and the real cost is paid on first use.
+"""
+
+import importlib
+import threading
+
+
+class LazySingleton:
+    """
+    Proxy that builds the wrapped object on first attribute access.
+
+    Call sites keep using the proxy exactly like the real instance, e.g.
+    ``config_manager.get_model_name()``.
+    """
+
+    def __init__(self, factory):
+        """
+        Initialize the proxy.
+
+        Args:
+            factory (callable): Zero-argument callable returning the instance.
+        """
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_instance", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def _get_instance(self):
+        """Return the wrapped instance, creating it if necessary."""
+        instance = object.__getattribute__(self, "_instance")
+        if instance is None:
+            with object.__getattribute__(self, "_lock"):
+                instance = object.__getattribute__(self, "_instance")
+                if instance is None:
+                    instance = object.__getattribute__(self, "_factory")()
+                    object.__setattr__(self, "_instance", instance)
+        return instance
+
+    def is_initialized(self):
+        """Check whether the wrapped instance has been created yet."""
+        return object.__getattribute__(self, "_instance") is not None
+
+    def reset(self):
+        """Drop the wrapped instance so the next access rebuilds it."""
+        with object.__getattribute__(self, "_lock"):
+            object.__setattr__(self, "_instance", None)
+
+    def __getattr__(self, name):
+        return getattr(self._get_instance(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get_instance(), name, value)
+
+    def __repr__(self):
+        if self.is_initialized():
+            return repr(self._get_instance())
+        return f"<LazySingleton (uninitialized) of {object.__getattribute__(self, '_factory')!r}>"
+
+
+class LazyModule:
+    """Proxy that imports a module on first attribute access."""
+
+    def __init__(self, module_name):
+        """
+        Initialize the proxy.
+
+        Args:
+            module_name (str): Fully qualified module name, e.g. "streamlit".
+        """
+        self._module_name = module_name
+        self._module = None
+
+    def _load(self):
+        """Import and cache the wrapped module."""
+        if self._module is None:
+            self._module = importlib.import_module(self._module_name)
+        return self._module
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._load(), name)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<LazyModule {self._module_name!r} ({state})>"
+
+
+def lazy_import(module_name):
+    """
+    Defer importing a module until one of its attributes is used.
+
+    Args:
+        module_name (str): Fully qualified module name.
+
+    Returns:
+        LazyModule: A proxy for the module.
+    """
+    return LazyModule(module_name)
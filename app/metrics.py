@@ -0,0 +1,106 @@
+"""
+Lightweight in-process metrics registry.
+
+Counters, gauges and histograms are kept in memory per process and exposed
+as a plain dictionary snapshot (e.g. through the report service /metrics
+endpoint).
+"""
+
+import threading
+
+
+class Histogram:
+    """Running summary of observed values with fixed upper-bound buckets."""
+
+    def __init__(self, buckets):
+        """
+        Initialize the histogram.
+
+        Args:
+            buckets (list): Sorted bucket upper bounds.
+        """
+        self.buckets = list(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+
+    def observe(self, value):
+        """Record a value."""
+        self.count += 1
+        self.total += value
+        self.max = value if self.max is None else max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                return
+        self.bucket_counts[-1] += 1
+
+    def snapshot(self):
+        """Return the histogram as a dictionary."""
+        labels = [f"le_{bound:g}" for bound in self.buckets] + ["le_inf"]
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "buckets": dict(zip(labels, self.bucket_counts)),
+        }
+
+
+# Default buckets suit millisecond latencies from sub-ms to minutes
+DEFAULT_BUCKETS = [1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 30000, 60000]
+
+
+class MetricsRegistry:
+    """Thread-safe registry of named counters, gauges and histograms."""
+
+    def __init__(self):
+        """Initialize an empty registry."""
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def increment(self, name, value=1):
+        """Increment a counter."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        """Set a gauge to the given value."""
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, value, buckets=None):
+        """Record a value in a histogram."""
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(buckets or DEFAULT_BUCKETS)
+            histogram.observe(value)
+
+    def get_counter(self, name):
+        """Get the current value of a counter."""
+        with self._lock:
+            return self.counters.get(name, 0)
+
+    def snapshot(self):
+        """Return all metrics as a dictionary."""
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "histograms": {name: h.snapshot() for name, h in self.histograms.items()},
+            }
+
+    def reset(self):
+        """Clear all metrics."""
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+
+# Create a process-wide singleton instance
+metrics = MetricsRegistry()
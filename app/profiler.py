@@ -0,0 +1,266 @@
+"""
+Per-request sampling profiler with a buffer of the slowest requests.
+
+Wrap a request in request_profiler.profile(name) and its steps in
+request_profiler.stage(name). Stage timings are always recorded (they cost a
+couple of perf_counter calls). A request is additionally sampled when it is
+forced (a UI flag or X-Profile header) or picked at the configured
+sample_rate: a background thread then snapshots the request thread's stack
+every interval_ms.
+
+The slowest requests are kept, with their stage timings and stack samples,
+in a bounded in-memory buffer. collapsed_stacks() renders the samples in the
+"frame;frame;frame count" format read by flamegraph.pl and speedscope.
+
+Only the thread that entered profile() is sampled; work handed to thread
+pools (e.g. FINDINGS fan-out) shows up as that thread waiting on futures.
+"""
+
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from app.config_manager import config_manager
+from app.lazy import LazySingleton
+
+_current_profile = contextvars.ContextVar("request_profile", default=None)
+
+
+def current_profile():
+    """Get the profile of the request running in this context, if any."""
+    return _current_profile.get()
+
+
+def _frame_name(frame):
+    """Name a frame as module:function for collapsed stacks."""
+    filename = frame.f_code.co_filename
+    # Pseudo-files such as "<frozen importlib._bootstrap>" are kept whole
+    module = filename.strip("<>") if filename.startswith("<") else os.path.splitext(os.path.basename(filename))[0]
+    return f"{module}:{frame.f_code.co_name}"
+
+
+class RequestProfile:
+    """Timings and stack samples for one request."""
+
+    def __init__(self, name, request_id=None, sampled=False):
+        """
+        Initialize the profile.
+
+        Args:
+            name (str): The request type (e.g. "ui.submit").
+            request_id (str): The report ID, if known.
+            sampled (bool): Whether stack samples are collected.
+        """
+        self.name = name
+        self.request_id = request_id
+        self.sampled = sampled
+        self.started_at = time.time()
+        self.duration_ms = None
+        self.stages = []
+        self.samples = Counter()
+        self.sample_count = 0
+        self._active_stages = []
+
+    def add_sample(self, frame, max_depth):
+        """Record one stack sample, rooted at the request and its current stage."""
+        frames = []
+        while frame is not None and len(frames) < max_depth:
+            frames.append(_frame_name(frame))
+            frame = frame.f_back
+        frames.reverse()
+        stage = self._active_stages[-1] if self._active_stages else "other"
+        self.samples[";".join([self.name, f"stage:{stage}"] + frames)] += 1
+        self.sample_count += 1
+
+    def summary(self):
+        """
+        Summarize the profile.
+
+        Returns:
+            dict: Name, request ID, start time, duration, stage timings and sample count.
+        """
+        return {
+            "name": self.name,
+            "request_id": self.request_id,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms or 0.0, 1),
+            "stages": [{"name": name, "ms": round(ms, 1)} for name, ms in self.stages],
+            "sampled": self.sampled,
+            "samples": self.sample_count,
+        }
+
+    def __getstate__(self):
+        """Drop the transient stage stack when sent between processes."""
+        state = self.__dict__.copy()
+        state["_active_stages"] = []
+        return state
+
+
+class _StackSampler(threading.Thread):
+    """Background thread sampling one thread's stack into a profile."""
+
+    def __init__(self, profile, thread_id, interval, max_depth):
+        super().__init__(name="request-profiler", daemon=True)
+        self.profile = profile
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_depth = max_depth
+        self._stop_event = threading.Event()
+
+    def run(self):
+        """Sample until stopped or the target thread is gone."""
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            self.profile.add_sample(frame, self.max_depth)
+
+    def stop(self):
+        """Stop sampling and wait for the thread to finish."""
+        self._stop_event.set()
+        self.join()
+
+
+class RequestProfiler:
+    """Process-wide request profiler keeping the slowest requests."""
+
+    def __init__(self, settings=None):
+        """
+        Initialize the profiler.
+
+        Args:
+            settings (dict): Profiling settings (defaults to settings.yaml profiling).
+        """
+        settings = config_manager.get_profiling_config() if settings is None else settings
+        self.enabled = settings.get("enabled", True)
+        self.sample_rate = settings.get("sample_rate", 0.0)
+        self.interval = settings.get("interval_ms", 5) / 1000.0
+        self.max_depth = settings.get("max_stack_depth", 64)
+        self.capacity = settings.get("slowest_capacity", 20)
+        self._slowest = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def profile(self, name, force=False, request_id=None):
+        """
+        Profile a request.
+
+        Nested calls (e.g. analyze_xray_images inside the UI submit path) are
+        recorded as a stage of the enclosing request.
+
+        Args:
+            name (str): The request type.
+            force (bool): Collect stack samples regardless of the sample rate.
+            request_id (str): The report ID, if known.
+
+        Yields:
+            RequestProfile: The profile, or None while profiling is disabled.
+        """
+        parent = _current_profile.get()
+        if parent is not None:
+            with self.stage(name):
+                yield parent
+            return
+        if not self.enabled:
+            yield None
+            return
+
+        sampled = force or (self.sample_rate > 0 and random.random() < self.sample_rate)
+        profile = RequestProfile(name, request_id, sampled)
+        token = _current_profile.set(profile)
+        sampler = None
+        if sampled:
+            sampler = _StackSampler(profile, threading.get_ident(), self.interval, self.max_depth)
+            sampler.start()
+        started = time.perf_counter()
+        try:
+            yield profile
+        finally:
+            profile.duration_ms = (time.perf_counter() - started) * 1000.0
+            if sampler is not None:
+                sampler.stop()
+            _current_profile.reset(token)
+            self.record(profile)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a stage of the current request (a no-op outside profile()).
+
+        Args:
+            name (str): The stage name (e.g. "image_qa", "upstream").
+        """
+        profile = _current_profile.get()
+        if profile is None:
+            yield
+            return
+        profile._active_stages.append(name)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            profile._active_stages.pop()
+            profile.stages.append((name, (time.perf_counter() - started) * 1000.0))
+
+    def record(self, profile):
+        """
+        Offer a finished profile to the slowest-requests buffer.
+
+        Args:
+            profile (RequestProfile): The finished profile.
+        """
+        if profile is None or profile.duration_ms is None or self.capacity <= 0:
+            return
+        entry = (profile.duration_ms, next(self._counter), profile)
+        with self._lock:
+            if len(self._slowest) < self.capacity:
+                heapq.heappush(self._slowest, entry)
+            elif profile.duration_ms > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def slowest(self):
+        """
+        Get the buffered profiles.
+
+        Returns:
+            list: RequestProfile objects, slowest first.
+        """
+        with self._lock:
+            entries = list(self._slowest)
+        return [profile for _, _, profile in sorted(entries, key=lambda entry: -entry[0])]
+
+    def collapsed_stacks(self, profiles=None):
+        """
+        Render stack samples as collapsed stacks for flame graphs.
+
+        Args:
+            profiles (list): Profiles to render (defaults to the slowest buffer).
+
+        Returns:
+            str: One "frame;frame;frame count" line per distinct stack.
+        """
+        profiles = self.slowest() if profiles is None else profiles
+        lines = []
+        for profile in profiles:
+            # Keep each request separately selectable in the flame graph
+            label = f"{profile.request_id or 'request'} ({profile.duration_ms:.0f} ms)"
+            for stack, count in profile.samples.items():
+                lines.append(f"{label};{stack} {count}")
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def reset(self):
+        """Clear the slowest-requests buffer."""
+        with self._lock:
+            self._slowest = []
+
+
+# Create a lazily-initialized process-wide instance
+request_profiler = LazySingleton(RequestProfiler)
@@ -18,9 +18,51 @@ def _format_subsection(subsection):
     return result
 
 
+def _format_clinical_context(patient_age=None, patient_sex=None, indication="",
+                             clinical_history="", comparison="", technique=""):
+    """Format the clinical context block shared by all prompts."""
+    context = "CLINICAL CONTEXT:\n"
+    context += f"- Patient Age: {patient_age if patient_age else 'Not provided'}\n"
+    context += f"- Patient Sex: {patient_sex if patient_sex else 'Not provided'}\n"
+    context += f"- Clinical Indication: {indication}\n"
+    context += f"- Clinical History: {clinical_history if clinical_history else 'Not provided'}\n"
+    context += f"- Comparison Studies: {comparison}\n"
+    context += f"- Technique: {technique}\n\n"
+    return context
+
+
+def _format_report_section(section):
+    """Format a report section entry from the prompt template."""
+    section_name = section.get("name", "")
+    section_desc = section.get("description", "")
+
+    result = f"{section.get('index', '')}{section_name}: {section_desc}\n"
+
+    # Add subsections for FINDINGS
+    if section_name == "FINDINGS":
+        result += "\n"
+        for subsection in section.get("subsections", []):
+            result += _format_subsection(subsection)
+
+    # Add guidelines for certain sections
+    if section.get("guidelines"):
+        result += "   " + _format_list_as_string(section.get("guidelines", [])).replace("\n", "\n   ")
+
+    return result + "\n"
+
+
+def _find_report_section(template, section_name):
+    """Find the report_sections entry matching a section name (with or without colon)."""
+    section_name = section_name.rstrip(":").strip().upper()
+    for section in template.get("report_sections", []):
+        if section.get("name", "").upper() == section_name:
+            return section
+    return None
+
+
 def build_xray_analysis_prompt(patient_age=None, patient_sex=None,
                                indication="", clinical_history="",
-                               comparison="", technique=""):
+                               comparison="", technique="", exemplars=None):
     """
     Build a prompt for X-ray image analysis.
 
@@ -31,6 +73,7 @@ def build_xray_analysis_prompt(patient_age=None, patient_sex=None,
         clinical_history: The patient's clinical history (optional)
         comparison: Previous studies for comparison (optional)
         technique: The imaging technique used
+        exemplars: Texts of similar past reports to follow in style (optional)
 
     Returns:
         str: The formatted prompt for the AI model
@@ -49,13 +92,8 @@ def build_xray_analysis_prompt(patient_age=None, patient_sex=None,
     prompt += "\n\n"
 
     # Add clinical context
-    prompt += "CLINICAL CONTEXT:\n"
-    prompt += f"- Patient Age: {patient_age if patient_age else 'Not provided'}\n"
-    prompt += f"- Patient Sex: {patient_sex if patient_sex else 'Not provided'}\n"
-    prompt += f"- Clinical Indication: {indication}\n"
-    prompt += f"- Clinical History: {clinical_history if clinical_history else 'Not provided'}\n"
-    prompt += f"- Comparison Studies: {comparison}\n"
-    prompt += f"- Technique: {technique}\n\n"
+    prompt += _format_clinical_context(patient_age, patient_sex, indication,
+                                       clinical_history, comparison, technique)
 
     # Add X-ray image information
     prompt += "You have reviewed two high-quality chest X-ray images:\n"
@@ -66,28 +104,181 @@ def build_xray_analysis_prompt(patient_age=None, patient_sex=None,
     prompt += "Based on your expertise and the clinical information provided, generate a comprehensive, professional-grade radiology report following the ACR (American College of Radiology) standard format:\n\n"
 
     for section in template.get("report_sections", []):
-        section_name = section.get("name", "")
-        section_desc = section.get("description", "")
-
-        prompt += f"{section.get('index', '')}{section_name}: {section_desc}\n"
-
-        # Add subsections for FINDINGS
-        if section_name == "FINDINGS":
-            prompt += "\n"
-            for subsection in section.get("subsections", []):
-                prompt += _format_subsection(subsection)
-
-        # Add guidelines for certain sections
-        if section.get("guidelines"):
-            prompt += "   " + _format_list_as_string(section.get("guidelines", [])).replace("\n", "\n   ")
-
-        prompt += "\n"
+        prompt += _format_report_section(section)
 
     # Add report quality guidelines
     prompt += "Your report should:\n"
     prompt += _format_list_as_string(template.get("report_quality_guidelines", []))
 
+    # Add few-shot examples of house style
+    if exemplars:
+        prompt += "\n\nEXAMPLE REPORTS FROM THIS DEPARTMENT (follow their style, structure and level of detail; "
+        prompt += "do not copy their findings):\n"
+        for i, exemplar in enumerate(exemplars, start=1):
+            prompt += f"\n--- Example {i} ---\n{exemplar.strip()}\n"
+
     # Add final instruction
     prompt += "\n\nWrite the report from the perspective of having thoroughly examined these specific X-ray images."
 
-    return prompt
\ No newline at end of file
+    return prompt
+
+
+def build_section_regeneration_prompt(section_name, report_sections, reviewer_notes="",
+                                      patient_age=None, patient_sex=None,
+                                      indication="", clinical_history="",
+                                      comparison="", technique=""):
+    """
+    Build a prompt that regenerates a single report section.
+
+    Only the matching report_sections entry from the prompt template is used;
+    the other sections of the current report are included as fixed context.
+
+    Args:
+        section_name: The section to regenerate (e.g. "IMPRESSION" or "IMPRESSION:")
+        report_sections: Dict of section header -> text for the current report
+        reviewer_notes: The radiologist's corrections or instructions (optional)
+        patient_age: The patient's age (optional)
+        patient_sex: The patient's sex (optional)
+        indication: The clinical indication for the X-ray
+        clinical_history: The patient's clinical history (optional)
+        comparison: Previous studies for comparison (optional)
+        technique: The imaging technique used
+
+    Returns:
+        str: The formatted prompt for the AI model
+    """
+    template = config_manager.get_xray_prompt_template()
+    section_key = f"{section_name.rstrip(':').strip().upper()}:"
+    section = _find_report_section(template, section_key) or {"name": section_key.rstrip(":")}
+
+    prompt = template.get("system_role", "")
+    prompt += f"\nYou are revising only the {section_key} section of an existing chest X-ray radiology report.\n\n"
+
+    prompt += "IMPORTANT FORMATTING INSTRUCTIONS:\n"
+    prompt += _format_list_as_string(template.get("formatting_instructions", []))
+    prompt += "\n\n"
+
+    prompt += _format_clinical_context(patient_age, patient_sex, indication,
+                                       clinical_history, comparison, technique)
+
+    # Keep the other sections as context so the revision stays consistent
+    prompt += "CURRENT REPORT (these sections are final and must stay consistent with your revision):\n"
+    for header, text in report_sections.items():
+        if header != section_key:
+            prompt += f"{header}\n{text}\n\n"
+
+    if report_sections.get(section_key):
+        prompt += f"PREVIOUS VERSION OF {section_key}\n{report_sections[section_key]}\n\n"
+
+    if reviewer_notes:
+        prompt += f"RADIOLOGIST'S CORRECTIONS (these take precedence):\n{reviewer_notes}\n\n"
+
+    prompt += "Write the revised section following this specification:\n"
+    prompt += _format_report_section(section)
+
+    prompt += f"\nReturn only the {section_key} section, starting with the header \"{section_key}\". "
+    prompt += "Do not repeat any other section."
+
+    return prompt
+
+
+def get_findings_subsections():
+    """
+    Get the FINDINGS subsection entries from the prompt template.
+
+    Returns:
+        list: The subsection dicts ("name" and "points"), in report order.
+    """
+    template = config_manager.get_xray_prompt_template()
+    findings = _find_report_section(template, "FINDINGS") or {}
+    return findings.get("subsections", [])
+
+
+def build_findings_subsection_prompt(subsection, patient_age=None, patient_sex=None,
+                                     indication="", clinical_history="",
+                                     comparison="", technique=""):
+    """
+    Build a prompt that generates a single FINDINGS subsection.
+
+    Args:
+        subsection: The subsection entry from the prompt template
+        patient_age: The patient's age (optional)
+        patient_sex: The patient's sex (optional)
+        indication: The clinical indication for the X-ray
+        clinical_history: The patient's clinical history (optional)
+        comparison: Previous studies for comparison (optional)
+        technique: The imaging technique used
+
+    Returns:
+        str: The formatted prompt for the AI model
+    """
+    template = config_manager.get_xray_prompt_template()
+
+    prompt = template.get("system_role", "")
+    prompt += "\nYou are writing one subsection of the FINDINGS section of a chest X-ray radiology report.\n\n"
+
+    prompt += "IMPORTANT FORMATTING INSTRUCTIONS:\n"
+    prompt += _format_list_as_string(template.get("formatting_instructions", []))
+    prompt += "\n\n"
+
+    prompt += _format_clinical_context(patient_age, patient_sex, indication,
+                                       clinical_history, comparison, technique)
+
+    prompt += "You have reviewed two high-quality chest X-ray images:\n"
+    prompt += "1. A frontal (PA) view\n"
+    prompt += "2. A lateral view\n\n"
+
+    prompt += "Describe only the following subsection, including pertinent positive AND negative findings:\n"
+    prompt += _format_subsection(subsection)
+
+    prompt += f"\nReturn only this subsection, starting with the header \"{subsection['name']}:\". "
+    prompt += "Do not write any other section or subsection."
+
+    return prompt
+
+
+def build_sections_prompt(section_names, context_sections=None, patient_age=None, patient_sex=None,
+                          indication="", clinical_history="", comparison="", technique=""):
+    """
+    Build a prompt that generates only the named report sections.
+
+    Args:
+        section_names: The sections to generate (e.g. ["IMPRESSION", "RECOMMENDATIONS"])
+        context_sections: Dict of section header -> text to condition on (optional)
+        patient_age: The patient's age (optional)
+        patient_sex: The patient's sex (optional)
+        indication: The clinical indication for the X-ray
+        clinical_history: The patient's clinical history (optional)
+        comparison: Previous studies for comparison (optional)
+        technique: The imaging technique used
+
+    Returns:
+        str: The formatted prompt for the AI model
+    """
+    template = config_manager.get_xray_prompt_template()
+    headers = [f"{name.rstrip(':').strip().upper()}:" for name in section_names]
+
+    prompt = template.get("system_role", "")
+    prompt += f"\nYou are writing the {', '.join(headers)} section(s) of a chest X-ray radiology report.\n\n"
+
+    prompt += "IMPORTANT FORMATTING INSTRUCTIONS:\n"
+    prompt += _format_list_as_string(template.get("formatting_instructions", []))
+    prompt += "\n\n"
+
+    prompt += _format_clinical_context(patient_age, patient_sex, indication,
+                                       clinical_history, comparison, technique)
+
+    if context_sections:
+        prompt += "REPORT SO FAR (base your sections on these findings):\n"
+        for header, text in context_sections.items():
+            prompt += f"{header}\n{text}\n\n"
+
+    prompt += "Write the following sections:\n\n"
+    for header in headers:
+        section = _find_report_section(template, header) or {"name": header.rstrip(":")}
+        prompt += _format_report_section(section)
+
+    prompt += f"\nReturn only these sections, in this order, each starting with its header ({', '.join(headers)}). "
+    prompt += "Do not write any other section."
+
+    return prompt
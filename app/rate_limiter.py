@@ -0,0 +1,335 @@
+"""
+Adaptive admission control for upstream API calls.
+
+A process-wide controller gates every chat completion request:
+
+- Two token buckets (requests and tokens) are seeded from the upstream
+  rate-limit headers (x-ratelimit-remaining-*, x-ratelimit-reset-*).
+- The concurrency limit adapts AIMD-style: it grows additively while calls
+  succeed within the target latency and shrinks multiplicatively on 429s,
+  timeouts and slow responses.
+- A circuit breaker fails fast while upstream is unhealthy.
+
+Queueing delay, shed requests and the current limits are recorded in the
+metrics registry.
+"""
+
+import re
+import threading
+import time
+
+from app.config_manager import config_manager
+from app.constants import ERROR_UPSTREAM_BUSY, ERROR_UPSTREAM_UNAVAILABLE
+from app.lazy import LazySingleton
+from app.metrics import metrics
+
+# Circuit breaker states
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+class AdmissionError(Exception):
+    """Raised when a request is not admitted to the upstream API."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(AdmissionError):
+    """Raised while the circuit breaker is open."""
+
+
+class AdmissionTimeoutError(AdmissionError):
+    """Raised when a request would wait longer than the allowed queueing delay."""
+
+
+def parse_duration(value):
+    """
+    Parse an upstream reset duration such as "2m59.56s", "7.66s" or "500ms".
+
+    Args:
+        value (str): The header value.
+
+    Returns:
+        float: The duration in seconds, or None if it cannot be parsed.
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    scale = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+
+def estimate_tokens(payload):
+    """
+    Estimate the tokens a chat completion request will consume.
+
+    Args:
+        payload (dict): The request payload.
+
+    Returns:
+        int: Approximate prompt tokens (4 characters per token) plus max_tokens.
+    """
+    prompt_chars = sum(len(message.get("content", "")) for message in payload.get("messages", []))
+    return prompt_chars // 4 + int(payload.get("max_tokens", 0))
+
+
+class TokenBucket:
+    """Token bucket whose level and refill rate can be re-seeded from headers."""
+
+    def __init__(self, capacity, refill_per_second):
+        """
+        Initialize the bucket.
+
+        Args:
+            capacity (float): Maximum number of tokens.
+            refill_per_second (float): Refill rate.
+        """
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        """Add tokens accrued since the last update."""
+        elapsed = max(0.0, now - self.updated)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_per_second)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until the bucket holds the given amount (0 if available)."""
+        self._refill(now)
+        # A request larger than the bucket would never fit; let it through when full
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        if self.refill_per_second <= 0:
+            return float("inf")
+        return (amount - self.tokens) / self.refill_per_second
+
+    def consume(self, amount, now):
+        """Take tokens from the bucket."""
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+    def seed(self, remaining, reset_seconds, limit=None, now=None):
+        """
+        Re-seed the bucket from upstream rate-limit headers.
+
+        Args:
+            remaining (float): Remaining quota reported by upstream.
+            reset_seconds (float): Time until the quota is fully restored.
+            limit (float): Full quota reported by upstream (optional).
+            now (float): Current monotonic time (optional).
+        """
+        now = time.monotonic() if now is None else now
+        if limit:
+            self.capacity = float(limit)
+        self.tokens = min(self.capacity, float(remaining))
+        self.updated = now
+        # Refill so the quota is fully restored when upstream says it resets
+        if reset_seconds and self.tokens < self.capacity:
+            self.refill_per_second = (self.capacity - self.tokens) / reset_seconds
+
+
+class AdmissionTicket:
+    """Handle for an admitted request."""
+
+    def __init__(self, tokens, queued_at, admitted_at):
+        self.tokens = tokens
+        self.queued_at = queued_at
+        self.admitted_at = admitted_at
+
+
+class AdmissionController:
+    """Process-wide admission controller around upstream API calls."""
+
+    def __init__(self, settings=None):
+        """
+        Initialize the controller.
+
+        Args:
+            settings (dict): Rate-limit settings (defaults to settings.yaml rate_limit).
+        """
+        settings = config_manager.get_rate_limit_config() if settings is None else settings
+        self.enabled = settings.get("enabled", True)
+        self.min_concurrency = settings.get("min_concurrency", 1)
+        self.max_concurrency = settings.get("max_concurrency", 16)
+        self.concurrency_limit = float(settings.get("initial_concurrency", 4))
+        self.target_latency = settings.get("target_latency_s", 20)
+        self.decrease_factor = settings.get("decrease_factor", 0.7)
+        self.max_queue_delay = settings.get("max_queue_delay_s", 30)
+        self.failure_threshold = settings.get("circuit_failure_threshold", 5)
+        self.cooldown = settings.get("circuit_cooldown_s", 30)
+
+        requests_per_minute = settings.get("requests_per_minute", 30)
+        tokens_per_minute = settings.get("tokens_per_minute", 6000)
+        self.request_bucket = TokenBucket(requests_per_minute, requests_per_minute / 60.0)
+        self.token_bucket = TokenBucket(tokens_per_minute, tokens_per_minute / 60.0)
+
+        self.in_flight = 0
+        self.circuit_state = CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.blocked_until = 0.0
+        self._condition = threading.Condition()
+        self._publish_gauges()
+
+    def _publish_gauges(self):
+        """Publish the controller state as gauges."""
+        metrics.set_gauge("admission.concurrency_limit", round(self.concurrency_limit, 2))
+        metrics.set_gauge("admission.in_flight", self.in_flight)
+        metrics.set_gauge("admission.tokens_available", round(self.token_bucket.tokens))
+        metrics.set_gauge("admission.requests_available", round(self.request_bucket.tokens, 2))
+        metrics.set_gauge("circuit.state", self.circuit_state)
+
+    def _check_circuit(self, now):
+        """Raise if the circuit is open; move to half-open after the cooldown."""
+        if self.circuit_state == CIRCUIT_OPEN:
+            if now - self.opened_at < self.cooldown:
+                metrics.increment("admission.shed")
+                metrics.increment("admission.shed.circuit_open")
+                raise CircuitOpenError(ERROR_UPSTREAM_UNAVAILABLE,
+                                       retry_after=self.cooldown - (now - self.opened_at))
+            self.circuit_state = CIRCUIT_HALF_OPEN
+
+    def _wait_time(self, tokens, now):
+        """Seconds until a request of the given size can be admitted."""
+        # Only a single probe is allowed while half-open
+        limit = 1 if self.circuit_state == CIRCUIT_HALF_OPEN else int(self.concurrency_limit)
+        if self.in_flight >= max(limit, self.min_concurrency):
+            return None
+        return max(self.blocked_until - now,
+                   self.request_bucket.wait_time(1, now),
+                   self.token_bucket.wait_time(tokens, now))
+
+    def acquire(self, tokens):
+        """
+        Wait until a request may be sent upstream.
+
+        Args:
+            tokens (int): Estimated tokens the request will consume.
+
+        Returns:
+            AdmissionTicket: Ticket to pass to release().
+
+        Raises:
+            CircuitOpenError: If upstream is considered unhealthy.
+            AdmissionTimeoutError: If the request would queue too long.
+        """
+        queued_at = time.monotonic()
+        if not self.enabled:
+            return AdmissionTicket(tokens, queued_at, queued_at)
+
+        deadline = queued_at + self.max_queue_delay
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._check_circuit(now)
+                wait = self._wait_time(tokens, now)
+                if wait == 0:
+                    break
+
+                # None means we wait for a concurrency slot to be released
+                if wait is not None and now + wait > deadline or now >= deadline:
+                    metrics.increment("admission.shed")
+                    metrics.increment("admission.shed.queue_timeout")
+                    raise AdmissionTimeoutError(ERROR_UPSTREAM_BUSY, retry_after=wait)
+                self._condition.wait(timeout=min(wait if wait is not None else deadline - now,
+                                                 deadline - now))
+
+            self.request_bucket.consume(1, now)
+            self.token_bucket.consume(tokens, now)
+            self.in_flight += 1
+            self._publish_gauges()
+
+        metrics.observe("admission.queue_delay_ms", (now - queued_at) * 1000.0)
+        return AdmissionTicket(tokens, queued_at, now)
+
+    def release(self, ticket, status_code=None, headers=None, timed_out=False):
+        """
+        Record the outcome of an admitted request.
+
+        Args:
+            ticket (AdmissionTicket): The ticket returned by acquire().
+            status_code (int): Upstream HTTP status, or None on network failure.
+            headers (Mapping): Upstream response headers (optional).
+            timed_out (bool): Whether the request hit the client timeout.
+        """
+        now = time.monotonic()
+        latency = now - ticket.admitted_at
+        metrics.observe("upstream.latency_ms", latency * 1000.0)
+        metrics.increment("upstream.timeouts" if timed_out else f"upstream.status.{status_code or 'network_error'}")
+
+        if not self.enabled:
+            return
+
+        with self._condition:
+            self.in_flight -= 1
+            if headers:
+                self._seed_from_headers(headers, now)
+
+            failed = status_code is None or status_code == 429 or status_code >= 500
+            if status_code == 429 or timed_out or latency > self.target_latency:
+                # Multiplicative decrease
+                self.concurrency_limit = max(self.min_concurrency,
+                                             self.concurrency_limit * self.decrease_factor)
+            elif not failed:
+                # Additive increase of roughly one slot per limit's worth of successes
+                self.concurrency_limit = min(self.max_concurrency,
+                                             self.concurrency_limit + 1.0 / self.concurrency_limit)
+
+            if status_code == 429:
+                retry_after = parse_duration((headers or {}).get("retry-after"))
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, now + retry_after)
+
+            self._update_circuit(failed, now)
+            self._publish_gauges()
+            self._condition.notify_all()
+
+    def _seed_from_headers(self, headers, now):
+        """Re-seed the token buckets from upstream rate-limit headers."""
+        headers = {name.lower(): value for name, value in headers.items()}
+        for kind, bucket in (("requests", self.request_bucket), ("tokens", self.token_bucket)):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is None:
+                continue
+            try:
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                bucket.seed(float(remaining),
+                            parse_duration(headers.get(f"x-ratelimit-reset-{kind}")),
+                            float(limit) if limit is not None else None,
+                            now)
+            except ValueError:
+                continue
+
+    def _update_circuit(self, failed, now):
+        """Advance the circuit breaker state machine."""
+        if not failed:
+            self.consecutive_failures = 0
+            self.circuit_state = CIRCUIT_CLOSED
+            return
+
+        self.consecutive_failures += 1
+        if self.circuit_state == CIRCUIT_HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.circuit_state != CIRCUIT_OPEN:
+                metrics.increment("circuit.opened")
+            self.circuit_state = CIRCUIT_OPEN
+            self.opened_at = now
+
+
+# Create a lazily-initialized process-wide instance
+admission_controller = LazySingleton(AdmissionController)
@@ -0,0 +1,455 @@
+"""
+Stateless HTTP report service.
+
+Decouples report generation from the Streamlit UI so that PACS integrations
+and several UI replicas can share one pool of generation workers.
+
+Endpoints:
+    GET  /health              Liveness and saturation information.
+    GET  /metrics             Service metrics plus the latest snapshot from each worker.
+    GET  /debug/slowest       Stage timings of the slowest recent requests.
+    GET  /debug/slowest/collapsed
+                              Their stack samples as collapsed stacks (flame graphs).
+    POST /v1/reports          Generate a report from images and clinical fields.
+    POST /v1/reports/section  Regenerate one section of an existing report.
+
+Send "X-Profile: 1" with a POST to collect stack samples for that request.
+
+Requests beyond the pool capacity (workers + queue_depth) are rejected with
+429 so callers can back off instead of piling up.
+
+Run with:
+    python -m app.report_service [--host HOST] [--port PORT] [--workers N]
+"""
+
+import argparse
+import base64
+import io
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.config_manager import config_manager
+from app.metrics import metrics
+from app.profiler import request_profiler
+
+
+class RequestError(Exception):
+    """Raised for requests the service cannot process."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _decode_image(data, field):
+    """
+    Decode and verify a base64 image.
+
+    Args:
+        data (str): The base64-encoded image.
+        field (str): The request field name (for error messages).
+
+    Returns:
+        tuple: The decoded PIL.Image.Image and the raw image bytes.
+    """
+    from PIL import Image
+
+    if not data:
+        raise RequestError(f"Missing required field: {field}")
+    try:
+        raw = base64.b64decode(data, validate=True)
+        image = Image.open(io.BytesIO(raw))
+        image.load()
+    except Exception as e:
+        raise RequestError(f"Invalid image in {field}: {e}")
+    return image, raw
+
+
+def _clinical_arguments(request):
+    """
+    Extract the clinical fields from a request, applying the UI defaults.
+
+    Args:
+        request (dict): The decoded request body.
+
+    Returns:
+        dict: Keyword arguments for the APIClient generation methods.
+    """
+    from app.constants import DEFAULT_COMPARISON, DEFAULT_TECHNIQUE
+
+    if not request.get("indication"):
+        raise RequestError("Missing required field: indication")
+
+    patient_sex = request.get("patient_sex")
+    return {
+        "indication": request["indication"],
+        "comparison": request.get("comparison") or DEFAULT_COMPARISON,
+        "technique": request.get("technique") or DEFAULT_TECHNIQUE,
+        "patient_age": request.get("patient_age") or None,
+        "patient_sex": patient_sex if patient_sex and patient_sex != "Other" else None,
+        "clinical_history": request.get("clinical_history") or None,
+    }
+
+
+def _audit_fields(request):
+    """
+    Extract the audit fields from a request, assigning a report ID if missing.
+
+    Returns:
+        dict: The report_id, operator, patient_id and study digests for the audit log.
+    """
+    from app.utils import generate_report_id
+
+    audit = request.get("audit") or {}
+    if not isinstance(audit, dict):
+        raise RequestError("Field audit must be a JSON object")
+    return {
+        "report_id": audit.get("report_id") or generate_report_id(),
+        "operator": audit.get("operator") or request.get("operator"),
+        "patient_id": audit.get("patient_id") or request.get("patient_id"),
+        "study": audit.get("study"),
+    }
+
+
+def _retain_study(frontal_bytes, lateral_bytes):
+    """
+    Keep the uploaded films in the blob store for later reprocessing.
+
+    Returns:
+        dict: The frontal and lateral SHA-256 digests, or None if storage is disabled.
+    """
+    from app.blob_store import blob_store
+
+    if not blob_store.enabled:
+        return None
+    try:
+        return {"frontal": blob_store.put(frontal_bytes), "lateral": blob_store.put(lateral_bytes)}
+    except Exception as e:
+        print(f"Error storing study: {e}")
+        return None
+
+
+def _configured_client():
+    """Create an API client, failing if the service has no API key."""
+    from app.api import APIClient
+
+    client = APIClient()
+    if not client.is_configured():
+        raise RequestError("Report service is missing its API key", 503)
+    return client
+
+
+def generate_report_job(request):
+    """
+    Generate a report in a worker process.
+
+    Args:
+        request (dict): The decoded request body.
+
+    Returns:
+        dict: The report ID, report text, parsed sections, image QA results and
+              the blob store digests of the films.
+    """
+    from app.image_qa import assess_study, add_quality_to_technique
+    from app.utils import format_report_for_display
+
+    with request_profiler.stage("decode_images"):
+        frontal_image, frontal_bytes = _decode_image(request.get("frontal_image"), "frontal_image")
+        lateral_image, lateral_bytes = _decode_image(request.get("lateral_image"), "lateral_image")
+    arguments = _clinical_arguments(request)
+    audit = _audit_fields(request)
+
+    # Reject unusable studies before spending an API call
+    image_qa = None
+    if config_manager.get_image_qa_config().get("enabled", True):
+        with request_profiler.stage("image_qa"):
+            image_qa = assess_study(frontal_image, lateral_image)
+        if image_qa["blocked"]:
+            messages = [issue["message"] for issue in image_qa["issues"] if issue["severity"] == "block"]
+            raise RequestError(" ".join(messages), 422)
+        arguments["technique"] = add_quality_to_technique(arguments["technique"], image_qa)
+
+    # Only films that passed the checks are kept; callers that already stored
+    # the study (the UI does) send its digests, which are recorded as given
+    if not audit["study"]:
+        with request_profiler.stage("store_study"):
+            audit["study"] = _retain_study(frontal_bytes, lateral_bytes)
+
+    analysis = _configured_client().generate_report(**arguments, audit=audit)
+    with request_profiler.stage("format"):
+        sections = format_report_for_display(analysis)
+    return {"report_id": audit["report_id"], "analysis": analysis,
+            "sections": sections, "image_qa": image_qa, "study": audit["study"]}
+
+
+def regenerate_section_job(request):
+    """
+    Regenerate a single report section in a worker process.
+
+    Args:
+        request (dict): The decoded request body, with "analysis", "section"
+                        and optional "reviewer_notes" besides the clinical fields.
+
+    Returns:
+        dict: The updated report text and its parsed sections.
+    """
+    from app.constants import REPORT_SECTIONS
+    from app.utils import format_report_for_display
+
+    analysis = request.get("analysis")
+    if not analysis:
+        raise RequestError("Missing required field: analysis")
+    section = f"{str(request.get('section', '')).rstrip(':').strip().upper()}:"
+    if section not in REPORT_SECTIONS:
+        raise RequestError(f"Unknown report section: {request.get('section')}")
+    arguments = _clinical_arguments(request)
+
+    audit = _audit_fields(request)
+
+    updated = _configured_client().regenerate_section(analysis, section, request.get("reviewer_notes") or "",
+                                                      **arguments, audit=audit)
+    return {"report_id": audit["report_id"], "analysis": updated,
+            "sections": format_report_for_display(updated)}
+
+
+def _run_job(job, request, profile=False):
+    """
+    Run a job in a worker, mapping failures to HTTP errors.
+
+    Args:
+        job (callable): The worker job.
+        request (dict): The decoded request body.
+        profile (bool): Collect stack samples for this request.
+
+    Returns:
+        dict: The job result or {"error", "status_code"}, plus the worker's
+              metrics snapshot under "_metrics" and the request profile under
+              "_profile".
+    """
+    from app.api import APIError
+    from app.rate_limiter import AdmissionError
+
+    request_profile = None
+    try:
+        with request_profiler.profile(job.__name__, force=profile) as request_profile:
+            result = job(request)
+    except RequestError as e:
+        result = {"error": str(e), "status_code": e.status_code}
+    except AdmissionError as e:
+        result = {"error": str(e), "status_code": 503, "retry_after": e.retry_after}
+    except APIError as e:
+        result = {"error": f"Upstream error: {e}", "status_code": 502}
+    except Exception as e:
+        result = {"error": str(e), "status_code": 500}
+
+    if request_profile is not None:
+        request_profile.request_id = result.get("report_id")
+    result["_metrics"] = (os.getpid(), metrics.snapshot())
+    result["_profile"] = request_profile
+    return result
+
+
+class ReportService(ThreadingHTTPServer):
+    """HTTP server owning the worker pool and admission state."""
+
+    daemon_threads = True
+
+    def __init__(self, address, workers, queue_depth, max_body_bytes):
+        """
+        Initialize the service.
+
+        Args:
+            address (tuple): (host, port) to bind.
+            workers (int): Number of worker processes.
+            queue_depth (int): Requests allowed to wait for a free worker.
+            max_body_bytes (int): Maximum accepted request body size.
+        """
+        super().__init__(address, ReportRequestHandler)
+        self.workers = workers
+        self.capacity = workers + queue_depth
+        self.max_body_bytes = max_body_bytes
+        self.in_flight = 0
+        self.worker_metrics = {}
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._lock = threading.Lock()
+        # Spawned workers do not inherit the server's threads or sockets
+        self.pool = ProcessPoolExecutor(max_workers=workers,
+                                        mp_context=multiprocessing.get_context("spawn"))
+
+    def try_acquire(self):
+        """Reserve a slot for a request; return False if saturated."""
+        if not self._slots.acquire(blocking=False):
+            return False
+        with self._lock:
+            self.in_flight += 1
+        return True
+
+    def release(self):
+        """Release a slot reserved with try_acquire."""
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def submit(self, job, request, profile=False):
+        """Run a job on the worker pool and wait for its result."""
+        result = self.pool.submit(_run_job, job, request, profile).result()
+        pid, snapshot = result.pop("_metrics", (None, None))
+        if pid is not None:
+            self.worker_metrics[pid] = snapshot
+        # Keep the slowest requests of all workers in the service process
+        request_profiler.record(result.pop("_profile", None))
+        return result
+
+    def server_close(self):
+        """Shut down the worker pool along with the socket."""
+        super().server_close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class ReportRequestHandler(BaseHTTPRequestHandler):
+    """Request handler for the report service."""
+
+    # Routes for POST requests: path -> worker job
+    POST_ROUTES = {
+        "/v1/reports": generate_report_job,
+        "/v1/reports/section": regenerate_section_job,
+    }
+
+    def _send_json(self, status_code, body, headers=None):
+        """Send a JSON response."""
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_text(self, status_code, text):
+        """Send a plain-text response."""
+        data = text.encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        """Read and decode the JSON request body."""
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > self.server.max_body_bytes:
+            raise RequestError("Request body too large", 413)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError as e:
+            raise RequestError(f"Invalid JSON: {e}")
+        if not isinstance(body, dict):
+            raise RequestError("Request body must be a JSON object")
+        return body
+
+    def do_GET(self):
+        """Handle GET requests."""
+        if self.path == "/health":
+            server = self.server
+            self._send_json(200, {
+                "status": "saturated" if server.in_flight >= server.capacity else "ok",
+                "workers": server.workers,
+                "capacity": server.capacity,
+                "in_flight": server.in_flight,
+            })
+        elif self.path == "/metrics":
+            self._send_json(200, {
+                "service": metrics.snapshot(),
+                "workers": {str(pid): snapshot for pid, snapshot in self.server.worker_metrics.items()},
+            })
+        elif self.path == "/debug/slowest":
+            self._send_json(200, {"requests": [profile.summary() for profile in request_profiler.slowest()]})
+        elif self.path == "/debug/slowest/collapsed":
+            self._send_text(200, request_profiler.collapsed_stacks())
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        """Handle POST requests."""
+        job = self.POST_ROUTES.get(self.path)
+        if job is None:
+            self._send_json(404, {"error": "Not found"})
+            return
+
+        if not self.server.try_acquire():
+            metrics.increment("service.shed")
+            self._send_json(429, {"error": "Report service is saturated, retry later"},
+                            headers={"Retry-After": "1"})
+            return
+
+        try:
+            request = self._read_json()
+            result = self.server.submit(job, request, self.headers.get("X-Profile") == "1")
+        except RequestError as e:
+            result = {"error": str(e), "status_code": e.status_code}
+        except Exception as e:
+            result = {"error": f"Worker failure: {e}", "status_code": 500}
+        finally:
+            self.server.release()
+
+        metrics.increment("service.requests")
+        if "error" in result:
+            status_code = result.pop("status_code", 500)
+            retry_after = result.pop("retry_after", None)
+            headers = {"Retry-After": str(max(1, round(retry_after)))} if retry_after else None
+            metrics.increment(f"service.status.{status_code}")
+            self._send_json(status_code, result, headers=headers)
+        else:
+            metrics.increment("service.status.200")
+            self._send_json(200, result)
+
+
+def create_service(host=None, port=None, workers=None, queue_depth=None):
+    """
+    Create a report service using configured defaults.
+
+    Returns:
+        ReportService: The (not yet serving) service.
+    """
+    service_config = config_manager.get_service_config()
+    address = (host or service_config.get("host", "127.0.0.1"),
+               port if port is not None else service_config.get("port", 8600))
+    workers = workers or service_config.get("workers", 4)
+    queue_depth = queue_depth if queue_depth is not None else service_config.get("queue_depth", 8)
+    max_body_bytes = int(service_config.get("max_body_mb", 40) * 1024 * 1024)
+
+    return ReportService(address, workers, queue_depth, max_body_bytes)
+
+
+def main():
+    """Run the report service from the command line."""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Stateless HTTP radiology report service")
+    parser.add_argument("--host", help="Address to bind")
+    parser.add_argument("--port", type=int, help="Port to bind")
+    parser.add_argument("--workers", type=int, help="Number of worker processes")
+    parser.add_argument("--queue-depth", type=int, help="Requests allowed to wait for a worker")
+    args = parser.parse_args()
+
+    service = create_service(args.host, args.port, args.workers, args.queue_depth)
+    host, port = service.server_address[:2]
+    print(f"Report service listening on http://{host}:{port} "
+          f"({service.workers} workers, capacity {service.capacity})")
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.server_close()
+
+
+if __name__ == "__main__":
+    main()
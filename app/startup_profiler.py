@@ -0,0 +1,156 @@
+"""
+Startup profiler for measuring worker cold-start cost.
+
+Reports an import-time breakdown (measured in a fresh interpreter with
+``-X importtime``) and an init-time breakdown of the lazy singletons, and
+compares both against the budgets in the ``startup`` section of config.json.
+
+Run with:
+    python main.py --profile-startup
+"""
+
+import subprocess
+import sys
+import time
+
+from app.constants import ROOT_DIR
+
+# Modules imported by a Streamlit worker when it serves the app
+DEFAULT_TARGET_MODULES = ["main"]
+
+
+def measure_imports(modules=None):
+    """
+    Measure import times of the given modules in a fresh interpreter.
+
+    Args:
+        modules (list): Module names to import (defaults to the app entry point).
+
+    Returns:
+        tuple: (total_ms, rows) where total_ms is the cumulative import time of
+               the target modules and rows are dicts with "module", "self_ms"
+               and "cumulative_ms" for each module they import directly,
+               sorted by cumulative time descending.
+    """
+    modules = modules or DEFAULT_TARGET_MODULES
+    code = "; ".join(f"import {module}" for module in modules)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=str(ROOT_DIR),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        print(f"Error importing {', '.join(modules)}: {lines[-1] if lines else 'unknown error'}")
+
+    total_ms = 0.0
+    rows = []
+    # Children are reported before their parent, so buffer them until the
+    # enclosing top-level import tells us whether it is one of ours
+    pending = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        parts = line.split(":", 1)[1].split("|")
+        if len(parts) != 3:
+            continue
+        self_us, cumulative_us, name = parts
+        # Nesting depth is encoded as two extra spaces per level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        cumulative_ms = int(cumulative_us.strip()) / 1000.0
+        if depth == 0:
+            if name.strip() in modules:
+                total_ms += cumulative_ms
+                rows.extend(pending)
+            pending = []
+        elif depth == 1:
+            pending.append({
+                "module": name.strip(),
+                "self_ms": int(self_us.strip()) / 1000.0,
+                "cumulative_ms": cumulative_ms,
+            })
+
+    return total_ms, sorted(rows, key=lambda row: row["cumulative_ms"], reverse=True)
+
+
+def measure_inits():
+    """
+    Measure initialization times of the application singletons.
+
+    Returns:
+        list: Dicts with "component", "ms" and "detail" for each singleton.
+    """
+    from app.config_manager import ConfigManager
+    from app.api import create_api_client
+
+    rows = []
+
+    start = time.perf_counter()
+    manager = ConfigManager()
+    rows.append({
+        "component": "config_manager",
+        "ms": (time.perf_counter() - start) * 1000.0,
+        "detail": "warm (precompiled cache)" if manager.loaded_from_cache else "cold (parsed YAML/JSON)",
+    })
+
+    start = time.perf_counter()
+    create_api_client()
+    rows.append({
+        "component": "api_client",
+        "ms": (time.perf_counter() - start) * 1000.0,
+        "detail": "",
+    })
+
+    return rows
+
+
+def _format_status(value_ms, budget_ms):
+    """Format a value against its budget."""
+    if budget_ms is None:
+        return ""
+    return "OK" if value_ms <= budget_ms else "OVER BUDGET"
+
+
+def profile_startup(modules=None, top_n=15):
+    """
+    Print the startup profile and compare it against the configured budget.
+
+    Args:
+        modules (list): Module names to profile (defaults to the app entry point).
+        top_n (int): Number of direct imports to list.
+
+    Returns:
+        bool: True if every budget was met, False otherwise.
+    """
+    import_total, import_rows = measure_imports(modules)
+    init_rows = measure_inits()
+
+    from app.config_manager import config_manager
+    budgets = config_manager.get_startup_config()
+    import_budget = budgets.get("import_budget_ms")
+    init_budget = budgets.get("init_budget_ms")
+    total_budget = budgets.get("budget_ms")
+
+    init_total = sum(row["ms"] for row in init_rows)
+    total = import_total + init_total
+
+    print("STARTUP PROFILE")
+    print("=" * 60)
+    print(f"Imports (slowest {min(top_n, len(import_rows))} of {len(import_rows)} direct imports):")
+    for row in import_rows[:top_n]:
+        print(f"  {row['module']:<40} {row['cumulative_ms']:>9.1f} ms")
+    print(f"  {'total':<40} {import_total:>9.1f} ms  "
+          f"(budget {import_budget} ms) {_format_status(import_total, import_budget)}")
+    print("-" * 60)
+    print("Initialization:")
+    for row in init_rows:
+        print(f"  {row['component']:<40} {row['ms']:>9.1f} ms  {row['detail']}")
+    print(f"  {'total':<40} {init_total:>9.1f} ms  "
+          f"(budget {init_budget} ms) {_format_status(init_total, init_budget)}")
+    print("-" * 60)
+    print(f"  {'STARTUP TOTAL':<40} {total:>9.1f} ms  "
+          f"(budget {total_budget} ms) {_format_status(total, total_budget)}")
+
+    checks = [(import_total, import_budget), (init_total, init_budget), (total, total_budget)]
+    return all(budget is None or value <= budget for value, budget in checks)
@@ -2,13 +2,16 @@
 UI components for the application.
 """
 
+import hashlib
 import streamlit as st
 from datetime import datetime
 from PIL import Image
 from app.constants import DEFAULT_TECHNIQUE, ERROR_MISSING_IMAGES, ERROR_MISSING_INDICATION
 from app.utils import (format_report_for_display, format_section_text, format_findings_text,
-                       generate_report_text, generate_report_id, generate_doctor_signature)
+                       generate_report_text, generate_report_file_name, generate_doctor_signature)
 from app.config_manager import config_manager
+from app.blob_store import blob_store
+from app.exemplars import exemplar_index
 
 
 def render_sidebar():
@@ -41,6 +44,50 @@ def render_sidebar():
     }
 
 
+def _record_upload(uploaded_file, view):
+    """
+    Remember the SHA-256 digest of an upload.
+
+    Streamlit reruns the page on every interaction, so each upload is keyed by
+    its file ID and only hashed the first time it is seen. The digest
+    identifies the study for pre-generated drafts; the film itself is only
+    stored once it passes the image checks (see retain_study).
+
+    Args:
+        uploaded_file (UploadedFile): The uploaded image.
+        view (str): "frontal" or "lateral".
+    """
+    digests = st.session_state.setdefault("upload_digests", {})
+    key = getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}"
+    if key not in digests:
+        digests[key] = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+    st.session_state.setdefault("study_digests", {})[view] = digests[key]
+
+
+def retain_study(frontal_image_file, lateral_image_file):
+    """
+    Keep the films of a study that passed the image checks in the blob store.
+
+    Each film is stored (and referenced) once, however many reports are
+    generated from it.
+
+    Args:
+        frontal_image_file (UploadedFile): The uploaded frontal image.
+        lateral_image_file (UploadedFile): The uploaded lateral image.
+    """
+    if not blob_store.enabled:
+        return
+    stored = st.session_state.setdefault("stored_digests", set())
+    digests = st.session_state.get("study_digests") or {}
+    for view, uploaded_file in (("frontal", frontal_image_file), ("lateral", lateral_image_file)):
+        if digests.get(view) in stored:
+            continue
+        try:
+            stored.add(blob_store.put_file(uploaded_file))
+        except Exception as e:
+            print(f"Error storing upload: {e}")
+
+
 def render_image_upload():
     """Render the image upload section."""
     # Create two columns for image upload
@@ -55,7 +102,10 @@ def render_image_upload():
                                               type=config_manager.settings.get("upload", {}).get("allowed_types",
                                                                                                  ["png", "jpg",
                                                                                                   "jpeg"]))
-        if frontal_image_file is not None:
+        if frontal_image_file is None:
+            st.session_state.get("study_digests", {}).pop("frontal", None)
+        else:
+            _record_upload(frontal_image_file, "frontal")
             frontal_image = Image.open(frontal_image_file)
             st.image(frontal_image, caption="Frontal (PA) View", use_column_width=True)
 
@@ -65,7 +115,10 @@ def render_image_upload():
                                               type=config_manager.settings.get("upload", {}).get("allowed_types",
                                                                                                  ["png", "jpg",
                                                                                                   "jpeg"]))
-        if lateral_image_file is not None:
+        if lateral_image_file is None:
+            st.session_state.get("study_digests", {}).pop("lateral", None)
+        else:
+            _record_upload(lateral_image_file, "lateral")
             lateral_image = Image.open(lateral_image_file)
             st.image(lateral_image, caption="Lateral View", use_column_width=True)
 
@@ -130,7 +183,138 @@ def validate_inputs(frontal_image_file, lateral_image_file, clinical_form):
     return True
 
 
-def display_report(analysis, patient_info, clinical_form):
+def render_image_qa(assessment):
+    """
+    Show the results of the pre-flight image quality checks.
+
+    Args:
+        assessment (dict): The result of assess_study(), or None if QA is disabled.
+
+    Returns:
+        bool: True if the submission may proceed, False if it is blocked.
+    """
+    if not assessment:
+        return True
+
+    for issue in assessment["issues"]:
+        if issue["severity"] == "block":
+            st.error(f"⛔ {issue['message']}")
+        else:
+            st.warning(f"⚠️ {issue['message']}")
+
+    if assessment["blocked"]:
+        st.error("Please correct the uploaded images before generating a report.")
+        return False
+
+    return True
+
+
+def render_draft_notice(draft):
+    """
+    Tell the user that the report shown was pre-generated by the ingest daemon.
+
+    Args:
+        draft (dict): The cached draft.
+    """
+    created = datetime.fromtimestamp(draft["created"]).strftime("%Y-%m-%d %H:%M")
+    patient = draft.get("patient_name") or draft.get("patient_id") or "an unnamed patient"
+    st.info(f"Showing the draft pre-generated on {created} for {patient}, indication "
+            f"\"{draft['clinical']['indication']}\". It keeps the patient and clinical details it was "
+            f"generated with. Review it, revise single sections below, or submit the form to generate "
+            f"a new report from your clinical details.")
+
+
+def render_request_profile(profile, collapsed_stacks):
+    """
+    Show the stage timings of a profiled request with a flame graph download.
+
+    Args:
+        profile (RequestProfile): The finished request profile.
+        collapsed_stacks (str): The profile's stack samples as collapsed stacks.
+    """
+    if profile is None:
+        return
+
+    with st.expander(f"Request profile ({profile.duration_ms / 1000:.2f} s)"):
+        for name, ms in profile.stages:
+            st.text(f"{name:<24}{ms:>10.1f} ms")
+        if collapsed_stacks:
+            st.download_button("Download collapsed stacks", collapsed_stacks,
+                               file_name=f"{profile.request_id or 'request'}.collapsed.txt",
+                               mime="text/plain")
+
+
+def render_slowest_requests(profiles, collapsed_stacks):
+    """
+    Show the slowest requests profiled in this process with a flame graph download.
+
+    Args:
+        profiles (list): RequestProfile objects, slowest first.
+        collapsed_stacks (str): Their stack samples as collapsed stacks.
+    """
+    if not profiles:
+        return
+
+    with st.expander(f"Slowest requests on this app server ({len(profiles)})"):
+        for profile in profiles:
+            stages = ", ".join(f"{name} {ms:.0f} ms" for name, ms in profile.stages)
+            st.text(f"{profile.request_id or profile.name}: {profile.duration_ms / 1000:.2f} s ({stages})")
+        if collapsed_stacks:
+            st.download_button("Download collapsed stacks", collapsed_stacks,
+                               file_name="slowest.collapsed.txt", mime="text/plain",
+                               key="download_slowest_stacks")
+
+
+def render_section_regeneration(analysis):
+    """
+    Render the form for regenerating a single report section.
+
+    Args:
+        analysis (str): The current report text.
+
+    Returns:
+        dict: The selected section, the reviewer's notes and the submit state.
+    """
+    section_content = format_report_for_display(analysis)
+    sections = [f"{section}:" for section in config_manager.get_report_sections()]
+    # Offer sections already in the report first, then any that are missing
+    options = [s for s in sections if s in section_content] + [s for s in sections if s not in section_content]
+
+    st.markdown("---")
+    st.subheader("Revise a Section")
+
+    with st.form("section_regeneration"):
+        default_index = options.index("IMPRESSION:") if "IMPRESSION:" in options else 0
+        section = st.selectbox("Section to regenerate", options=options, index=default_index)
+        reviewer_notes = st.text_area("Corrections and instructions",
+                                      placeholder="E.g., No pleural effusion is present; "
+                                                  "mention the right lower lobe opacity first")
+        submit_button = st.form_submit_button("🔄 REGENERATE SECTION")
+
+    return {
+        "section": section,
+        "reviewer_notes": reviewer_notes,
+        "submit_button": submit_button
+    }
+
+
+def _index_finalized_report(report_id, analysis, patient_info, clinical_form):
+    """
+    Add a finalized report to the exemplar index (once per report).
+
+    Only the report body is kept, without the patient name or ID.
+    """
+    indexed = st.session_state.setdefault("indexed_reports", set())
+    if not exemplar_index.enabled or analysis.startswith("Error:") or report_id in indexed:
+        return
+    try:
+        exemplar_index.add(report_id, clinical_form["indication"], patient_info["clinical_history"], analysis)
+        indexed.add(report_id)
+    except Exception as e:
+        print(f"Error indexing finalized report: {e}")
+
+
+def display_report(analysis, patient_info, clinical_form, report_id):
     """
     Display the radiology report.
 
@@ -138,6 +322,7 @@ def display_report(analysis, patient_info, clinical_form):
         analysis (str): The report analysis text.
         patient_info (dict): The patient information.
         clinical_form (dict): The clinical form data.
+        report_id (str): The unique report ID.
     """
     st.markdown("---")
     st.markdown("""
@@ -211,16 +396,17 @@ def display_report(analysis, patient_info, clinical_form):
     # Add download buttons
     col1, col2 = st.columns(2)
     with col1:
-        current_date = datetime.now().strftime("%Y-%m-%d")
-        report_id = generate_report_id(patient_info["patient_name"])
-
-        st.download_button(
+        downloaded = st.download_button(
             label="📄 Download Report (TXT)",
             data=report_txt,
-            file_name=f"{report_id}_xray_report_{current_date}.txt",
+            file_name=generate_report_file_name(report_id, patient_info["patient_name"]),
             mime="text/plain"
         )
 
+    # A downloaded report is final: keep it as a style exemplar for future prompts
+    if downloaded:
+        _index_finalized_report(report_id, analysis, patient_info, clinical_form)
+
     # Add doctor signature
     with col2:
-        st.markdown(generate_doctor_signature(), unsafe_allow_html=True)
\ No newline at end of file
+        st.markdown(generate_doctor_signature(report_id), unsafe_allow_html=True)
\ No newline at end of file
@@ -2,11 +2,18 @@
 Utility functions for the application.
 """
 
-import streamlit as st
+import os
+import threading
+import time
 from datetime import datetime
 from app.constants import REPORT_SECTIONS
 from app.config_manager import config_manager
 
+# Crockford base32 alphabet and per-process state for ULID generation
+_ULID_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_ulid_lock = threading.Lock()
+_ulid_state = {"timestamp_ms": -1, "randomness": 0}
+
 
 def format_report_for_display(analysis):
     """
@@ -49,6 +56,128 @@ def format_report_for_display(analysis):
     return section_content
 
 
+def _find_section_span(analysis, section):
+    """
+    Find where a section's body starts and ends in the raw report text.
+
+    Args:
+        analysis (str): The raw report text.
+        section (str): The section header (e.g. "IMPRESSION:").
+
+    Returns:
+        tuple: (body_start, body_end) indices, or None if the section is absent.
+    """
+    start_idx = analysis.find(section)
+    if start_idx == -1:
+        return None
+
+    body_start = start_idx + len(section)
+    body_end = len(analysis)
+    for next_section in REPORT_SECTIONS[REPORT_SECTIONS.index(section) + 1:]:
+        next_idx = analysis.find(next_section, body_start)
+        if next_idx != -1:
+            body_end = min(body_end, next_idx)
+
+    return body_start, body_end
+
+
+def extract_section_text(response, section):
+    """
+    Extract a single section's body from a model response.
+
+    Args:
+        response (str): The model output, usually starting with the section header.
+        section (str): The section header (e.g. "IMPRESSION:").
+
+    Returns:
+        str: The section body without its header.
+    """
+    span = _find_section_span(response, section)
+    if span is None:
+        return response.strip()
+    return response[span[0]:span[1]].strip()
+
+
+def splice_section(analysis, section, section_text):
+    """
+    Replace one section's body in the raw report text, keeping the rest verbatim.
+
+    Args:
+        analysis (str): The raw report text.
+        section (str): The section header (e.g. "IMPRESSION:").
+        section_text (str): The new section body.
+
+    Returns:
+        str: The updated report text.
+    """
+    span = _find_section_span(analysis, section)
+    if span is not None:
+        body_start, body_end = span
+        trailing = "\n\n" if body_end < len(analysis) else "\n"
+        return f"{analysis[:body_start]}\n{section_text.strip()}{trailing}{analysis[body_end:]}"
+
+    # Section missing: insert it before the first section that follows it
+    for next_section in REPORT_SECTIONS[REPORT_SECTIONS.index(section) + 1:]:
+        next_idx = analysis.find(next_section)
+        if next_idx != -1:
+            return f"{analysis[:next_idx]}{section}\n{section_text.strip()}\n\n{analysis[next_idx:]}"
+
+    return f"{analysis.rstrip()}\n\n{section}\n{section_text.strip()}\n"
+
+
+def assemble_report(section_content):
+    """
+    Assemble report text from parsed sections in the standard order.
+
+    Args:
+        section_content (dict): Section header -> section text.
+
+    Returns:
+        str: The report text.
+    """
+    return "\n\n".join(f"{section}\n{section_content[section]}"
+                       for section in REPORT_SECTIONS if section_content.get(section))
+
+
+def split_at_last_section(analysis):
+    """
+    Split a truncated report before its last, possibly incomplete, section.
+
+    Args:
+        analysis (str): The raw report text cut off at the token limit.
+
+    Returns:
+        tuple: (complete_text, remaining_sections) where remaining_sections
+               are the headers still to be written, starting with the cut one.
+    """
+    positions = sorted((analysis.find(section), section) for section in REPORT_SECTIONS if section in analysis)
+    if not positions:
+        return "", list(REPORT_SECTIONS)
+    start_idx, last_section = positions[-1]
+    return analysis[:start_idx].rstrip(), REPORT_SECTIONS[REPORT_SECTIONS.index(last_section):]
+
+
+def stitch_continuation(complete_text, continuation, first_section):
+    """
+    Append a continuation to the complete part of a truncated report.
+
+    Args:
+        complete_text (str): The report up to the last complete section.
+        continuation (str): The model output for the remaining sections.
+        first_section (str): The header the continuation should start with.
+
+    Returns:
+        str: The stitched report text.
+    """
+    start_idx = continuation.find(first_section)
+    if start_idx != -1:
+        continuation = continuation[start_idx:]
+    else:
+        continuation = f"{first_section}\n{continuation.strip()}"
+    continuation = continuation.strip()
+    return f"{complete_text}\n\n{continuation}" if complete_text else continuation
+
+
 def format_section_text(section_text):
     """
     Format the text for a regular section.
@@ -135,36 +264,90 @@ DISCLAIMER: {disclaimer}
     return report_txt
 
 
-def generate_report_id(patient_name=""):
+def generate_ulid():
+    """
+    Generate a ULID: a 26-character, time-sortable, collision-free identifier.
+
+    The first 48 bits are the millisecond timestamp and the remaining 80 bits
+    are random. IDs generated within the same millisecond by one process are
+    strictly increasing; forked workers draw fresh randomness, so IDs stay
+    unique across processes.
+
+    Returns:
+        str: The ULID in Crockford base32.
+    """
+    with _ulid_lock:
+        timestamp_ms = time.time_ns() // 1_000_000
+        if timestamp_ms <= _ulid_state["timestamp_ms"]:
+            # Same (or an earlier, if the clock stepped back) millisecond:
+            # keep ordering by incrementing the random part
+            timestamp_ms = _ulid_state["timestamp_ms"]
+            randomness = _ulid_state["randomness"] + 1
+            if randomness >= 1 << 80:
+                timestamp_ms += 1
+                randomness = int.from_bytes(os.urandom(10), "big")
+        else:
+            randomness = int.from_bytes(os.urandom(10), "big")
+        _ulid_state["timestamp_ms"] = timestamp_ms
+        _ulid_state["randomness"] = randomness
+
+    value = (timestamp_ms << 80) | randomness
+    return "".join(_ULID_ALPHABET[(value >> shift) & 0x1F] for shift in range(125, -1, -5))
+
+
+def _reset_ulid_state():
+    """Forget the parent's ULID state in a forked child."""
+    _ulid_state["timestamp_ms"] = -1
+    _ulid_state["randomness"] = 0
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_ulid_state)
+
+
+def generate_report_id():
     """
     Generate a unique report ID.
 
+    Returns:
+        str: The report ID (e.g. "AI-XR-01J9Z3...").
+    """
+    return f"AI-XR-{generate_ulid()}"
+
+
+def generate_report_file_name(report_id, patient_name=""):
+    """
+    Generate the download file name for a report.
+
     Args:
+        report_id (str): The report ID.
         patient_name (str): The patient's name.
 
     Returns:
-        str: The report ID.
+        str: The file name.
     """
-    report_id = f"{patient_name.replace(' ', '_') if patient_name else 'Patient'}"
-    return report_id
+    patient = patient_name.replace(' ', '_') if patient_name else 'Patient'
+    current_date = datetime.now().strftime("%Y-%m-%d")
+    return f"{patient}_{report_id}_xray_report_{current_date}.txt"
 
 
-def generate_doctor_signature():
+def generate_doctor_signature(report_id):
     """
     Generate a doctor signature HTML.
 
+    Args:
+        report_id (str): The report ID.
+
     Returns:
         str: The HTML for the doctor signature.
     """
-    report_id = datetime.now().strftime("%Y%m%d%H%M%S")
-
     signature_html = f"""
     <div style="text-align: right; margin-top: 20px;">
         <p><em>Electronically signed by</em></p>
         <p style="font-weight: bold;">AI Assistant, MD</p>
         <p>Board Certified Radiologist</p>
-        <p style="font-size: 0.8em;">Report ID: AI-XR-{report_id}</p>
+        <p style="font-size: 0.8em;">Report ID: {report_id}</p>
     </div>
     """
 
-    return signature_html
\ No newline at end of file
+    return signature_html
@@ -0,0 +1,89 @@
+"""
+Benchmark exemplar index build and top-k search latency.
+
+Builds a throwaway index of synthetic finalized reports (random combinations
+of common indications and histories) in a temporary directory, then times
+top-k searches against it.
+
+Run with:
+    python benchmarks/exemplar_search.py [--reports N] [--queries N]
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from app.exemplars import ExemplarIndex  # noqa: E402
+
+INDICATIONS = ["cough", "fever", "shortness of breath", "chest pain", "pneumonia", "trauma",
+               "line placement", "tube placement", "hemoptysis", "weight loss", "preoperative",
+               "follow-up of nodule", "heart failure", "COPD exacerbation", "pleural effusion",
+               "suspected pneumothorax", "aspiration", "sepsis", "tuberculosis screening", "asthma"]
+HISTORIES = ["smoker", "former smoker", "hypertension", "diabetes", "lung cancer", "CABG",
+             "renal failure", "immunosuppressed", "recent surgery", "HIV", "asbestos exposure",
+             "atrial fibrillation", "obesity", "sarcoidosis", "cystic fibrosis", ""]
+REPORT_TEXT = "FINDINGS:\nLungs are clear.\n\nIMPRESSION:\nNo acute cardiopulmonary process."
+
+
+def synthetic_records(count, seed=0):
+    """Generate synthetic finalized reports."""
+    rng = random.Random(seed)
+    for i in range(count):
+        yield {
+            "report_id": f"BENCH-{i:07d}",
+            "indication": " and ".join(rng.sample(INDICATIONS, rng.randint(1, 2))),
+            "clinical_history": ", ".join(rng.sample(HISTORIES, rng.randint(0, 3))),
+            "text": REPORT_TEXT,
+        }
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description="Time exemplar index build and top-k search")
+    parser.add_argument("--reports", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--dims", type=int, default=256)
+    parser.add_argument("--batch", type=int, default=50_000, help="Reports added per batch")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        index = ExemplarIndex(directory, settings={"dims": args.dims, "top_k": 2})
+
+        start = time.perf_counter()
+        batch = []
+        for record in synthetic_records(args.reports):
+            batch.append(record)
+            if len(batch) == args.batch:
+                index.add_batch(batch)
+                batch = []
+        index.add_batch(batch)
+        build_seconds = time.perf_counter() - start
+        print(f"Indexed {index.count} reports in {build_seconds:.1f}s "
+              f"({index.count / build_seconds:,.0f} reports/s)")
+
+        queries = list(synthetic_records(args.queries, seed=1))
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query["indication"], query["clinical_history"])
+            latencies.append((time.perf_counter() - start) * 1000.0)
+
+        latencies.sort()
+        print(f"top-2 search over {index.count} reports: mean={statistics.mean(latencies):.1f}ms "
+              f"p50={statistics.median(latencies):.1f}ms p95={latencies[int(len(latencies) * 0.95) - 1]:.1f}ms")
+
+        best = index.search(queries[0]["indication"], queries[0]["clinical_history"])
+        print(f"Example: '{queries[0]['indication']}; {queries[0]['clinical_history']}' -> "
+              + "; ".join(f"{score:.2f} '{record['indication']}; {record['clinical_history']}'"
+                          for score, record in best))
+
+
+if __name__ == "__main__":
+    main()
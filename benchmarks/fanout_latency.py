@@ -0,0 +1,119 @@
+"""
+Benchmark end-to-end report latency: single completion vs. FINDINGS fan-out.
+
+Runs against the local mock API by default, whose latency model is a fixed
+time-to-first-token plus a per-output-token cost. Pass --endpoint to measure
+against a real OpenAI-compatible API (GROQ_API_KEY must be set).
+
+Both modes are measured twice: with the admission controller as configured in
+settings.yaml, and with it bypassed. With the default rate_limit settings the
+controller admits fewer concurrent requests than one fan-out report issues, so
+the first figure is what a default deployment gets and the second is the
+ceiling of the fan-out itself.
+
+Run with:
+    python benchmarks/fanout_latency.py [--runs N] [--per-token-ms MS] [--admission default|off|both]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from app.constants import ENV_VAR_API_ENDPOINT, ENV_VAR_API_KEY  # noqa: E402
+
+STUDY = {
+    "indication": "Shortness of breath and fever",
+    "comparison": "No prior studies available for comparison.",
+    "technique": "PA and lateral views of the chest",
+    "patient_age": 64,
+    "patient_sex": "Female",
+    "clinical_history": "Former smoker, hypertension",
+}
+
+
+def run_mode(client, mode, runs):
+    """Generate reports in one mode and return the latencies in seconds."""
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        client.generate_report(mode=mode, **STUDY)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def summarize(name, latencies):
+    """Print a latency summary line."""
+    print(f"  {name:<8} runs={len(latencies):<3} mean={statistics.mean(latencies):6.2f}s "
+          f"p50={statistics.median(latencies):6.2f}s max={max(latencies):6.2f}s")
+
+
+def run_configuration(client, label, settings, runs):
+    """Measure both modes behind a fresh admission controller."""
+    import app.api
+    from app.rate_limiter import AdmissionController
+
+    app.api.admission_controller = AdmissionController(settings)
+    single = run_mode(client, "single", runs)
+    app.api.admission_controller = AdmissionController(settings)
+    fanout = run_mode(client, "fanout", runs)
+
+    print(label)
+    summarize("single", single)
+    summarize("fanout", fanout)
+    print(f"  speedup  {statistics.mean(single) / statistics.mean(fanout):.2f}x (mean)")
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description="Compare single-call and fan-out report latency")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--endpoint", help="Real chat completions endpoint (default: local mock)")
+    parser.add_argument("--ttft-ms", type=float, default=200.0, help="Mock time to first token")
+    parser.add_argument("--per-token-ms", type=float, default=2.0, help="Mock time per output token")
+    parser.add_argument("--admission", choices=["default", "off", "both"], default="both",
+                        help="Measure with the configured admission controller, bypassed, or both")
+    args = parser.parse_args()
+
+    server = None
+    if args.endpoint:
+        os.environ[ENV_VAR_API_ENDPOINT] = args.endpoint
+    else:
+        from tools.mock_openai_server import start_server
+
+        server = start_server(ttft_ms=args.ttft_ms, per_token_ms=args.per_token_ms)
+        os.environ[ENV_VAR_API_ENDPOINT] = f"{server.url}/v1/chat/completions"
+        os.environ.setdefault(ENV_VAR_API_KEY, "benchmark")
+
+    from app.api import APIClient
+    from app.config_manager import config_manager
+    from app.prompt_builder import get_findings_subsections
+
+    rate_limit = config_manager.get_rate_limit_config()
+    generation = config_manager.get_generation_config()
+    configurations = []
+    if args.admission in ("default", "both"):
+        configurations.append((f"admission as configured (initial_concurrency="
+                               f"{rate_limit.get('initial_concurrency', 4)}, fan-out width "
+                               f"{len(get_findings_subsections()) + 1}, "
+                               f"max_workers={generation.get('max_workers', 8)})", rate_limit))
+    if args.admission in ("off", "both"):
+        configurations.append(("admission bypassed", dict(rate_limit, enabled=False)))
+
+    client = APIClient()
+    print(f"Endpoint: {client.endpoint}")
+    try:
+        for label, settings in configurations:
+            run_configuration(client, label, settings, args.runs)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
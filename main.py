@@ -5,7 +5,9 @@ This application uses AI to generate comprehensive radiology reports from chest
 """
 
 import os
+import sys
 import streamlit as st
+from datetime import datetime
 from PIL import Image
 from dotenv import load_dotenv
 
@@ -13,14 +15,180 @@ from dotenv import load_dotenv
 from app.constants import ERROR_API_KEY_MISSING
 from app.config_manager import config_manager
 from app.api import api_client
+from app.image_qa import assess_study, add_quality_to_technique
+from app.draft_cache import draft_cache
+from app.profiler import request_profiler
+from app.utils import generate_report_id
 from app.styles import get_css, get_app_header_html, get_app_description_html
-from app.ui_components import (render_sidebar, render_image_upload,
-                               render_clinical_form, validate_inputs, display_report)
+from app.ui_components import (render_sidebar, render_image_upload, render_clinical_form, render_image_qa,
+                               render_draft_notice, render_request_profile, render_section_regeneration,
+                               render_slowest_requests, retain_study, validate_inputs, display_report)
 
 # Load environment variables
 load_dotenv()
 
 
+def build_clinical_context(patient_info, clinical_form, image_qa=None):
+    """
+    Build the clinical arguments for report generation from the form data.
+
+    Args:
+        patient_info (dict): The patient information from the sidebar.
+        clinical_form (dict): The clinical form data.
+        image_qa (dict): The pre-flight image quality assessment (optional).
+
+    Returns:
+        dict: Keyword arguments for the API client generation methods.
+    """
+    return {
+        "indication": clinical_form["indication"],
+        "comparison": clinical_form["comparison"] if clinical_form[
+            "comparison"] else "No prior studies available for comparison.",
+        "technique": add_quality_to_technique(clinical_form["technique"], image_qa),
+        "patient_age": patient_info["patient_age"] if patient_info["patient_age"] else None,
+        "patient_sex": patient_info["patient_sex"] if patient_info["patient_sex"] != "Other" else None,
+        "clinical_history": patient_info["clinical_history"] if patient_info["clinical_history"] else None,
+    }
+
+
+def build_audit_context(report_id, patient_info, study=None):
+    """
+    Build the audit fields recorded for a generation request.
+
+    Args:
+        report_id (str): The unique report ID.
+        patient_info (dict): The patient information from the sidebar.
+        study (dict): SHA-256 digests of the frontal and lateral films (optional).
+
+    Returns:
+        dict: The audit fields.
+    """
+    return {
+        "report_id": report_id,
+        "patient_id": patient_info["patient_id"] or None,
+        "study": study or None,
+    }
+
+
+def current_study():
+    """
+    Get the film digests of the uploaded study.
+
+    Returns:
+        tuple: The frontal and lateral SHA-256 digests, or None until both films are uploaded.
+    """
+    digests = st.session_state.get("study_digests") or {}
+    study = (digests.get("frontal"), digests.get("lateral"))
+    return study if all(study) else None
+
+
+def build_report_context(patient_info, clinical_form, clinical, identity):
+    """
+    Capture the patient and clinical context a report was generated for.
+
+    The report is rendered, downloaded, revised and indexed from this copy,
+    so later edits to the sidebar or form never relabel it.
+
+    Args:
+        patient_info (dict): The patient information the report belongs to.
+        clinical_form (dict): The examination details (indication, exam date, ...).
+        clinical (dict): The clinical arguments the report was generated with.
+        identity (tuple): The sidebar patient name and ID the report is tied
+                          to, or None if it does not depend on the sidebar.
+
+    Returns:
+        dict: The report context.
+    """
+    return {
+        "patient_info": dict(patient_info),
+        "clinical_form": {key: value for key, value in clinical_form.items() if key != "submit_button"},
+        "clinical": dict(clinical),
+        "study": current_study(),
+        "identity": identity,
+    }
+
+
+def patient_identity(patient_info):
+    """Get the sidebar fields that identify the patient."""
+    return patient_info["patient_name"], patient_info["patient_id"]
+
+
+def clear_stale_report(patient_info):
+    """
+    Drop the report on screen once the films or the patient change.
+
+    Args:
+        patient_info (dict): The patient information from the sidebar.
+    """
+    context = st.session_state.get("report_context")
+    if (context is not None and context["study"] == current_study()
+            and context["identity"] in (None, patient_identity(patient_info))):
+        return
+    # Dropping draft_study lets the draft of the current films be looked up again
+    for key in ("analysis", "report_id", "image_qa", "report_context", "request_profile", "draft",
+                "draft_study"):
+        st.session_state.pop(key, None)
+
+
+def build_draft_context(draft):
+    """
+    Build the report context of a pre-generated draft from its own stored fields.
+
+    The draft was generated for the patient and clinical details in its
+    sidecar, so it is shown, revised, downloaded and indexed with those rather
+    than whatever the sidebar and form hold.
+
+    Args:
+        draft (dict): The cached draft.
+
+    Returns:
+        dict: The report context (see build_report_context).
+    """
+    clinical = draft["clinical"]
+    patient_info = {
+        "patient_name": draft.get("patient_name") or "",
+        "patient_id": draft.get("patient_id") or "",
+        "patient_age": clinical.get("patient_age"),
+        "patient_sex": clinical.get("patient_sex") or "Other",
+        "clinical_history": clinical.get("clinical_history") or "",
+    }
+    clinical_form = {
+        "indication": clinical["indication"],
+        "technique": clinical["technique"],
+        "comparison": clinical["comparison"],
+        "exam_date": datetime.fromtimestamp(draft["created"]).date(),
+    }
+    # A draft does not depend on the sidebar, only on its films
+    return build_report_context(patient_info, clinical_form, clinical, None)
+
+
+def load_pregenerated_draft(frontal_image_file, lateral_image_file):
+    """
+    Show the draft report pre-generated by the ingest daemon for the uploaded films.
+
+    Only looks up a study once, so a report generated or revised afterwards
+    is not replaced on the next rerun.
+
+    Args:
+        frontal_image_file (UploadedFile): The uploaded frontal image.
+        lateral_image_file (UploadedFile): The uploaded lateral image.
+    """
+    study = current_study()
+    if frontal_image_file is None or lateral_image_file is None or study is None:
+        return
+    if st.session_state.get("draft_study") == study:
+        return
+
+    st.session_state["draft_study"] = study
+    draft = draft_cache.get(*study)
+    st.session_state["draft"] = draft
+    if draft:
+        st.session_state["analysis"] = draft["analysis"]
+        st.session_state["report_id"] = draft["report_id"]
+        st.session_state["image_qa"] = draft.get("image_qa")
+        st.session_state["report_context"] = build_draft_context(draft)
+
+
 def main():
     """Main application entry point."""
     # Configure the Streamlit page
@@ -49,29 +217,87 @@ def main():
     # Render clinical information form
     clinical_form = render_clinical_form()
 
+    # A report belongs to the films and patient it was generated for
+    clear_stale_report(patient_info)
+
+    # Show a pre-generated draft as soon as its films are uploaded
+    load_pregenerated_draft(frontal_image_file, lateral_image_file)
+
     # Process form submission
     if clinical_form["submit_button"]:
         if validate_inputs(frontal_image_file, lateral_image_file, clinical_form):
-            # Load images
-            frontal_image = Image.open(frontal_image_file)
-            lateral_image = Image.open(lateral_image_file)
-
-            # Generate report
-            analysis = api_client.analyze_xray_images(
-                frontal_image,
-                lateral_image,
-                clinical_form["indication"],
-                clinical_form["comparison"] if clinical_form[
-                    "comparison"] else "No prior studies available for comparison.",
-                clinical_form["technique"],
-                patient_info["patient_age"] if patient_info["patient_age"] else None,
-                patient_info["patient_sex"] if patient_info["patient_sex"] != "Other" else None,
-                patient_info["clinical_history"] if patient_info["clinical_history"] else None
-            )
-
-            # Display the report
-            display_report(analysis, patient_info, clinical_form)
+            # Open the app with ?profile=1 to sample this request's stacks
+            force_profile = st.query_params.get("profile") == "1"
+            report_id = generate_report_id()
+            st.session_state["draft"] = None
+            with request_profiler.profile("ui.submit", force=force_profile, request_id=report_id) as profile:
+                # Load images
+                with request_profiler.stage("decode_images"):
+                    frontal_image = Image.open(frontal_image_file)
+                    lateral_image = Image.open(lateral_image_file)
+                    frontal_image.load()
+                    lateral_image.load()
+
+                # Check image quality before spending an API call
+                image_qa = None
+                if config_manager.get_image_qa_config().get("enabled", True):
+                    with request_profiler.stage("image_qa"):
+                        image_qa = assess_study(frontal_image, lateral_image)
+
+                if render_image_qa(image_qa):
+                    with request_profiler.stage("store_study"):
+                        retain_study(frontal_image_file, lateral_image_file)
+
+                    # Generate report
+                    clinical = build_clinical_context(patient_info, clinical_form, image_qa)
+                    st.session_state["image_qa"] = image_qa
+                    st.session_state["report_id"] = report_id
+                    st.session_state["report_context"] = build_report_context(
+                        patient_info, clinical_form, clinical, patient_identity(patient_info))
+                    st.session_state["analysis"] = api_client.analyze_xray_images(
+                        frontal_image_file,
+                        lateral_image_file,
+                        **clinical,
+                        audit=build_audit_context(report_id, patient_info, st.session_state.get("study_digests"))
+                    )
+
+            st.session_state["request_profile"] = profile if force_profile else None
+
+    # Keep the report across reruns so single sections can be revised
+    analysis = st.session_state.get("analysis")
+    if analysis:
+        # Display the report with the patient and clinical details it was generated for
+        context = st.session_state["report_context"]
+        if st.session_state.get("draft"):
+            render_draft_notice(st.session_state["draft"])
+        display_report(analysis, context["patient_info"], context["clinical_form"], st.session_state["report_id"])
+
+        profile = st.session_state.get("request_profile")
+        if profile is not None:
+            render_request_profile(profile, request_profiler.collapsed_stacks([profile]))
+
+        if not analysis.startswith("Error:"):
+            regeneration = render_section_regeneration(analysis)
+            if regeneration["submit_button"]:
+                updated = api_client.regenerate_report_section(
+                    analysis,
+                    regeneration["section"],
+                    regeneration["reviewer_notes"],
+                    **context["clinical"],
+                    audit=build_audit_context(st.session_state["report_id"], context["patient_info"],
+                                              st.session_state.get("study_digests"))
+                )
+                if updated:
+                    st.session_state["analysis"] = updated
+                    st.rerun()
+
+    # The local backend keeps its slowest requests in this process; show them with ?profile=1
+    if st.query_params.get("profile") == "1":
+        render_slowest_requests(request_profiler.slowest(), request_profiler.collapsed_stacks())
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if "--profile-startup" in sys.argv:
+        from app.startup_profiler import profile_startup
+        sys.exit(0 if profile_startup() else 1)
+    main()
@@ -0,0 +1,27 @@
+"""Shared fixtures for the test suite."""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from tools.mock_openai_server import start_server  # noqa: E402
+
+
+@pytest.fixture
+def mock_upstream():
+    """Start a mock OpenAI-compatible server; call it with server options."""
+    servers = []
+
+    def start(**options):
+        server = start_server(**options)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
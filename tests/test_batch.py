@@ -0,0 +1,84 @@
+"""Batch jobs against the mock batch API."""
+
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import app.batch
+import app.blob_store
+from app.batch import BatchJob
+from app.blob_store import BlobStore
+from app.draft_cache import DraftCache
+
+
+class AuditRecorder:
+    """Collects audit records instead of writing the log."""
+
+    def __init__(self):
+        self.records = []
+
+    def record(self, event, **fields):
+        self.records.append(dict(fields, event=event))
+
+    def flush(self, timeout=5.0):
+        return True
+
+
+def write_study(directory, name, seed):
+    """Write a pair of noisy films and a sidecar in the hot-folder layout."""
+    rng = np.random.default_rng(seed)
+    for view in ("frontal", "lateral"):
+        pixels = (rng.random((256, 256)) * 200 + 20).astype(np.uint8)
+        Image.fromarray(pixels).save(directory / f"{name}_{view}.png")
+    (directory / f"{name}.json").write_text(json.dumps({"indication": "cough", "patient_id": name}))
+
+
+@pytest.fixture
+def job(tmp_path, mock_upstream, monkeypatch):
+    """A compiled batch job of two studies, with its outputs kept under tmp_path."""
+    server = mock_upstream(ttft_ms=0, per_token_ms=0, batch_delay_s=0.1)
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    monkeypatch.setenv("GROQ_API_ENDPOINT", f"{server.url}/v1/chat/completions")
+    monkeypatch.setattr(app.blob_store, "blob_store", BlobStore(str(tmp_path / "blobs")))
+    monkeypatch.setattr(app.batch, "DraftCache", lambda: DraftCache(str(tmp_path / "drafts")))
+    monkeypatch.setattr(app.batch, "audit_logger", AuditRecorder())
+
+    source = tmp_path / "studies"
+    source.mkdir()
+    write_study(source, "s1", 1)
+    write_study(source, "s2", 2)
+    job = BatchJob("test", settings={"directory": str(tmp_path / "batches"), "poll_interval_s": 0.05})
+    assert job.compile(str(source)) == 2
+    return job
+
+
+def test_collect_again_only_redownloads(job):
+    job.submit()
+    first = job.collect(wait=True, timeout=10)
+    second = job.collect()
+
+    assert first == {"reports": 2, "truncated": 0, "failed": 0, "already_ingested": 0}
+    assert second == {"reports": 0, "truncated": 0, "failed": 0, "already_ingested": 2}
+
+    records = app.batch.audit_logger.records
+    report_ids = [record["report_id"] for record in records]
+    assert len(report_ids) == len(set(report_ids)) == 2
+    assert all(record["mode"] == "batch" and record["status"] == "ok" for record in records)
+    assert job.load_state()["summary"]["reports"] == 2
+
+
+def test_compile_again_keeps_report_ids_and_references(job, tmp_path):
+    source = tmp_path / "studies"
+    first = json.loads((tmp_path / "batches" / "test" / "studies.json").read_text())
+    references = app.blob_store.blob_store.stats()["references"]
+
+    assert job.compile(str(source)) == 2
+    assert json.loads((tmp_path / "batches" / "test" / "studies.json").read_text()).keys() == first.keys()
+    assert app.blob_store.blob_store.stats()["references"] == references
+
+    for path in source.glob("s2*"):
+        path.unlink()
+    assert job.compile(str(source)) == 1
+    assert app.blob_store.blob_store.stats()["references"] == references - 2
@@ -0,0 +1,32 @@
+"""Blob store garbage collection running alongside writers."""
+
+import threading
+
+from app.blob_store import BlobStore
+
+
+def test_gc_never_unlinks_a_referenced_blob(tmp_path):
+    store = BlobStore(root=str(tmp_path), settings={"codec": "raw"})
+    data = b"film" * 1024
+    stop = threading.Event()
+    errors = []
+
+    def collect():
+        while not stop.is_set():
+            store.gc(grace_seconds=0)
+
+    collector = threading.Thread(target=collect)
+    collector.start()
+    try:
+        for _ in range(300):
+            digest = store.put(data)
+            try:
+                assert bytes(store.read(digest)) == data
+            except (FileNotFoundError, AssertionError) as e:
+                errors.append(e)
+            store.release(digest)
+    finally:
+        stop.set()
+        collector.join()
+
+    assert not errors
@@ -0,0 +1,52 @@
+"""Exemplar index consistency under concurrent writers."""
+
+import multiprocessing
+
+import numpy as np
+
+from app.exemplars import ExemplarIndex, embed_text, quantize, query_text
+
+SETTINGS = {"dims": 64, "top_k": 1}
+RECORDS_PER_PROCESS = 640
+BATCH_SIZE = 16
+
+
+def add_reports(directory, writer):
+    """Add this writer's reports in small batches."""
+    index = ExemplarIndex(directory, settings=SETTINGS)
+    for start in range(0, RECORDS_PER_PROCESS, BATCH_SIZE):
+        index.add_batch([{
+            "report_id": f"{writer}-{i}",
+            "indication": f"indication {writer} {i}",
+            "clinical_history": f"history {i}",
+            "text": f"Report {writer}-{i}",
+        } for i in range(start, start + BATCH_SIZE)])
+
+
+def test_two_processes_adding_at_once(tmp_path):
+    directory = str(tmp_path)
+    context = multiprocessing.get_context("spawn")
+    writers = [context.Process(target=add_reports, args=(directory, writer)) for writer in ("a", "b")]
+    for process in writers:
+        process.start()
+    for process in writers:
+        process.join(120)
+        assert process.exitcode == 0
+
+    index = ExemplarIndex(directory, settings=SETTINGS)
+    index._refresh()
+    # Enough reports to grow past the initial capacity while the other writer appends
+    assert index.count == 2 * RECORDS_PER_PROCESS > 1024
+
+    seen = set()
+    for position in range(index.count):
+        record = index._read_record(position)
+        seen.add(record["report_id"])
+        vector, scale = quantize(embed_text(query_text(record["indication"], record["clinical_history"]),
+                                            index.dims))
+        assert np.array_equal(index._vectors[:, position], vector)
+        assert index._scales[position] == np.float32(scale)
+    assert len(seen) == index.count
+
+    with open(tmp_path / "reports.jsonl", "rb") as f:
+        assert sum(1 for _ in f) == index.count
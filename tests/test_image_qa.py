@@ -0,0 +1,86 @@
+"""Pre-flight image QA on 8-bit and high-bit-depth films."""
+
+import warnings
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.image_qa import assess_study, measure_image
+
+SETTINGS = {"analysis_size": 256}
+
+
+def synthetic_frontal(size=512):
+    """A frontal-like film: dark lung fields either side of a bright mediastinum, above the diaphragm."""
+    x = np.linspace(-1.0, 1.0, size)
+    columns = 0.25 + 0.55 * np.exp(-(x / 0.18) ** 2) + 0.3 * np.abs(x) ** 3
+    y = np.linspace(0.0, 1.0, size)[:, None]
+    film = columns[None, :] * (0.8 + 0.2 * y) + 0.35 / (1.0 + np.exp(-(y - 0.7) * 30.0))
+    noise = np.random.default_rng(0).normal(0.0, 0.02, (size, size))
+    film = film + noise
+    return (film - film.min()) / (film.max() - film.min())
+
+
+def save_png(path, pixels, max_value, dtype):
+    """Save a [0, 1] array as a grayscale PNG with the given integer range."""
+    Image.fromarray(np.round(pixels * max_value).astype(dtype)).save(path)
+    return Image.open(path)
+
+
+@pytest.fixture
+def film():
+    return synthetic_frontal()
+
+
+def test_16_bit_png_matches_8_bit(film, tmp_path):
+    eight_bit = save_png(tmp_path / "film8.png", film, 255, np.uint8)
+    sixteen_bit = save_png(tmp_path / "film16.png", film, 65535, np.uint16)
+    assert sixteen_bit.mode.startswith("I")
+
+    expected = measure_image(eight_bit, SETTINGS)
+    measured = measure_image(sixteen_bit, SETTINGS)
+
+    assert measured["exposure"] == expected["exposure"] != "blank"
+    assert measured["view"] == expected["view"]
+    assert measured["mean"] == pytest.approx(expected["mean"], abs=0.03)
+    assert measured["std"] == pytest.approx(expected["std"], abs=0.03)
+
+
+def test_12_bit_film_in_16_bit_png_is_not_blank(film, tmp_path):
+    twelve_bit = save_png(tmp_path / "film12.png", film, 4095, np.uint16)
+
+    measured = measure_image(twelve_bit, SETTINGS)
+
+    assert measured["exposure"] != "blank"
+    assert measured["std"] > 0.05
+    assert not assess_study(twelve_bit, twelve_bit, SETTINGS)["blocked"]
+
+
+def test_flat_16_bit_png_is_blank(tmp_path):
+    flat = save_png(tmp_path / "flat.png", np.full((256, 256), 0.5), 65535, np.uint16)
+
+    assert measure_image(flat, SETTINGS)["exposure"] == "blank"
+
+
+def test_tiny_image_is_blocked_without_warnings():
+    tiny = Image.fromarray(np.full((8, 8), 128, dtype=np.uint8))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        measured = measure_image(tiny, SETTINGS)
+        assessment = assess_study(tiny, tiny, SETTINGS)
+
+    assert measured["exposure"] == "too_small"
+    assert assessment["blocked"]
+    assert len(assessment["issues"]) == 2
+
+
+def test_upside_down_film_is_flagged(film):
+    upright = Image.fromarray(np.round(film * 255).astype(np.uint8))
+    upside_down = upright.rotate(180)
+
+    assert measure_image(upright, SETTINGS)["orientation"] == "upright"
+    assert measure_image(upside_down, SETTINGS)["orientation"] == "rotated_180"
+    messages = [issue["message"] for issue in assess_study(upside_down, upright, SETTINGS)["issues"]]
+    assert "The frontal image may be upside down." in messages
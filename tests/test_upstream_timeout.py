@@ -0,0 +1,49 @@
+"""Upstream request timeouts in APIClient and the admission controller."""
+
+import pytest
+
+import app.api
+from app.api import APIClient, APIError
+from app.rate_limiter import CIRCUIT_HALF_OPEN, CIRCUIT_OPEN, AdmissionController
+
+SETTINGS = {"initial_concurrency": 4, "circuit_failure_threshold": 5, "circuit_cooldown_s": 0,
+            "requests_per_minute": 600, "tokens_per_minute": 1_000_000}
+
+
+@pytest.fixture
+def client(mock_upstream, monkeypatch):
+    """An APIClient pointed at a mock upstream that answers after one second."""
+    server = mock_upstream(ttft_ms=1000, per_token_ms=0)
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    monkeypatch.setenv("GROQ_API_ENDPOINT", f"{server.url}/v1/chat/completions")
+    client = APIClient()
+    client.timeout = 0.2
+    return client
+
+
+def test_timeout_raises_and_counts_as_failure(client, monkeypatch):
+    controller = AdmissionController(SETTINGS)
+    monkeypatch.setattr(app.api, "admission_controller", controller)
+
+    with pytest.raises(APIError) as excinfo:
+        client._complete(client.build_payload("FINDINGS:"))
+
+    assert excinfo.value.status_code == 504
+    assert controller.in_flight == 0
+    assert controller.consecutive_failures == 1
+    assert controller.concurrency_limit < SETTINGS["initial_concurrency"]
+
+
+def test_timeout_frees_the_half_open_probe_slot(client, monkeypatch):
+    controller = AdmissionController(SETTINGS)
+    controller.circuit_state = CIRCUIT_OPEN
+    monkeypatch.setattr(app.api, "admission_controller", controller)
+
+    with pytest.raises(APIError):
+        client._complete(client.build_payload("FINDINGS:"))
+
+    # The probe failed, so the breaker reopens instead of holding its only slot
+    assert controller.in_flight == 0
+    assert controller.circuit_state == CIRCUIT_OPEN
+    controller.acquire(10)
+    assert controller.circuit_state == CIRCUIT_HALF_OPEN
@@ -0,0 +1,358 @@
+"""
+Local stand-in for an OpenAI-compatible chat completions API.
+
+Simulates generation latency as a fixed time-to-first-token plus a per-token
+cost, so benchmarks and manual testing can run without network access or an
+API key. Responses contain the report sections the prompt asks for.
+
+The batch API is simulated too: POST /v1/files uploads a JSONL request file,
+POST /v1/batches starts a batch that completes after batch_delay_s, and
+GET /v1/batches/{id} and GET /v1/files/{id}/content serve status and results.
+
+Run with:
+    python tools/mock_openai_server.py [--port PORT] [--per-token-ms MS]
+
+then point the app at it:
+    GROQ_API_ENDPOINT=http://127.0.0.1:8700/v1/chat/completions GROQ_API_KEY=test streamlit run main.py
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPORT_HEADERS = ["EXAMINATION:", "CLINICAL INFORMATION:", "COMPARISON:", "TECHNIQUE:",
+                  "FINDINGS:", "IMPRESSION:", "RECOMMENDATIONS:"]
+FILLER_LINE = "- No acute abnormality is identified in this region."
+
+_SINGLE_HEADER = re.compile(r'starting with the header "([^"]+)"')
+_MULTIPLE_HEADERS = re.compile(r"each starting with its header \(([^)]+)\)")
+
+
+def _requested_headers(prompt):
+    """Work out which headers the prompt asks for (the full report by default)."""
+    match = _SINGLE_HEADER.search(prompt)
+    if match:
+        return [match.group(1)]
+    match = _MULTIPLE_HEADERS.search(prompt)
+    if match:
+        return [header.strip() for header in match.group(1).split(",")]
+    return REPORT_HEADERS
+
+
+def _generate_text(headers, tokens):
+    """Generate roughly the given number of whitespace-separated tokens."""
+    words_per_header = max(1, tokens // len(headers))
+    filler = FILLER_LINE.split()
+    parts = []
+    for header in headers:
+        words = [header if header.endswith(":") else f"{header}:"]
+        while len(words) < words_per_header:
+            words.extend(filler)
+        parts.append(" ".join(words[:words_per_header]))
+    return "\n\n".join(parts)
+
+
+def _parse_multipart(content_type, body):
+    """
+    Parse a multipart/form-data body.
+
+    Returns:
+        dict: Field name -> (filename, bytes).
+    """
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body)
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        fields[name] = (part.get_filename(), part.get_payload(decode=True))
+    return fields
+
+
+class MockChatHandler(BaseHTTPRequestHandler):
+    """Handler for chat completions and the batch API."""
+
+    def log_message(self, format, *args):
+        """Keep benchmark output quiet."""
+
+    def _send_json(self, status_code, body, headers=None):
+        """Send a JSON response."""
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        """Read the raw request body."""
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length)
+
+    def _read_json(self):
+        """Read the JSON request body."""
+        return json.loads(self._read_body() or b"{}")
+
+    def _not_found(self):
+        """Send a 404 in the upstream error format."""
+        self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        """Handle chat completion, file upload and batch creation requests."""
+        path = self.path.rstrip("/")
+        if path.endswith("/chat/completions"):
+            body = self._read_json()
+            self._send_json(200, self.server.complete(body), headers=self.server.rate_limit_headers())
+        elif path.endswith("/files"):
+            fields = _parse_multipart(self.headers.get("Content-Type", ""), self._read_body())
+            filename, content = fields.get("file", (None, None))
+            if content is None:
+                self._send_json(400, {"error": {"message": "Missing file"}})
+                return
+            purpose = (fields.get("purpose") or (None, b"batch"))[1].decode("utf-8")
+            self._send_json(200, self.server.store_file(filename or "upload.jsonl", content, purpose))
+        elif path.endswith("/batches"):
+            body = self._read_json()
+            batch = self.server.create_batch(body.get("input_file_id"), body.get("endpoint"),
+                                             body.get("completion_window"))
+            if batch is None:
+                self._send_json(400, {"error": {"message": "Unknown input_file_id"}})
+                return
+            self._send_json(200, batch)
+        else:
+            self._not_found()
+
+    def do_GET(self):
+        """Handle batch status and file content requests."""
+        match = re.search(r"/batches/([^/]+)$", self.path)
+        if match:
+            batch = self.server.get_batch(match.group(1))
+            self._send_json(200, batch) if batch else self._not_found()
+            return
+
+        match = re.search(r"/files/([^/]+)/content$", self.path)
+        content = self.server.files.get(match.group(1), {}).get("content") if match else None
+        if content is None:
+            self._not_found()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    """Threaded mock server with configurable latency and output length."""
+
+    daemon_threads = True
+
+    def __init__(self, address, ttft_ms=200.0, per_token_ms=2.0, fill_ratio=0.8, section_tokens=None,
+                 batch_delay_s=1.0, handler=MockChatHandler):
+        """
+        Initialize the server.
+
+        Args:
+            address (tuple): (host, port) to bind; port 0 picks a free port.
+            ttft_ms (float): Simulated time to first token.
+            per_token_ms (float): Simulated time per output token.
+            fill_ratio (float): Fraction of max_tokens each completion uses;
+                                1.0 or more simulates truncation.
+            section_tokens (int): If set, each requested section takes this many
+                                  tokens instead, and output beyond max_tokens is
+                                  cut mid-section with finish_reason "length".
+            batch_delay_s (float): Time a batch stays in progress before completing.
+            handler (type): Request handler class.
+        """
+        super().__init__(address, handler)
+        self.ttft_ms = ttft_ms
+        self.per_token_ms = per_token_ms
+        self.fill_ratio = fill_ratio
+        self.section_tokens = section_tokens
+        self.batch_delay_s = batch_delay_s
+        self.request_count = 0
+        self.files = {}
+        self.batches = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        """Base URL of the server."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def rate_limit_headers(self):
+        """Rate-limit headers in the format upstream uses."""
+        return {
+            "x-ratelimit-limit-requests": "14400",
+            "x-ratelimit-remaining-requests": "14000",
+            "x-ratelimit-reset-requests": "2m59.56s",
+            "x-ratelimit-limit-tokens": "1000000",
+            "x-ratelimit-remaining-tokens": "990000",
+            "x-ratelimit-reset-tokens": "0.6s",
+        }
+
+    def complete(self, body, sleep=True):
+        """
+        Produce a chat completion response for a request body.
+
+        Args:
+            body (dict): The chat completion request.
+            sleep (bool): Whether to simulate generation latency.
+
+        Returns:
+            dict: The chat completion response.
+        """
+        with self._lock:
+            self.request_count += 1
+
+        prompt = "\n".join(message.get("content", "") for message in body.get("messages", []))
+        max_tokens = int(body.get("max_tokens") or 1500)
+        headers = _requested_headers(prompt)
+        if self.section_tokens:
+            target = self.section_tokens * len(headers)
+            finish_reason = "length" if target > max_tokens else "stop"
+        else:
+            target = int(max_tokens * self.fill_ratio)
+            finish_reason = "length" if target >= max_tokens else "stop"
+        tokens = min(max_tokens, target)
+        # Generate the full answer, then cut it off where the token limit falls
+        content = " ".join(_generate_text(headers, target).split(" ")[:tokens])
+
+        if sleep:
+            time.sleep((self.ttft_ms + tokens * self.per_token_ms) / 1000.0)
+
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": finish_reason,
+            }],
+            "usage": {
+                "prompt_tokens": len(prompt) // 4,
+                "completion_tokens": tokens,
+                "total_tokens": len(prompt) // 4 + tokens,
+            },
+        }
+
+    def store_file(self, filename, content, purpose):
+        """Keep an uploaded file and return its file object."""
+        file_id = f"file_{uuid.uuid4().hex}"
+        self.files[file_id] = {"filename": filename, "purpose": purpose, "content": content}
+        return {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose}
+
+    def create_batch(self, input_file_id, endpoint, completion_window):
+        """Start a batch; it completes after batch_delay_s on a background thread."""
+        if input_file_id not in self.files:
+            return None
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        with self._lock:
+            self.batches[batch_id] = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": endpoint,
+                "input_file_id": input_file_id,
+                "completion_window": completion_window,
+                "status": "in_progress",
+                "output_file_id": None,
+                "error_file_id": None,
+                "created_at": int(time.time()),
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            }
+        timer = threading.Timer(self.batch_delay_s, self._run_batch, args=(batch_id,))
+        timer.daemon = True
+        timer.start()
+        return dict(self.batches[batch_id])
+
+    def get_batch(self, batch_id):
+        """Return a batch object, or None if it does not exist."""
+        with self._lock:
+            batch = self.batches.get(batch_id)
+            return dict(batch) if batch else None
+
+    def _run_batch(self, batch_id):
+        """Answer every request line of a batch and publish the results."""
+        batch = self.batches[batch_id]
+        outputs = []
+        errors = []
+        for line in self.files[batch["input_file_id"]]["content"].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                body = self.complete(request["body"], sleep=False)
+                outputs.append({"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request.get("custom_id"),
+                                "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": body},
+                                "error": None})
+            except (ValueError, KeyError, TypeError) as e:
+                errors.append({"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": None, "response": None,
+                               "error": {"code": "invalid_request", "message": str(e)}})
+
+        output_file = self.store_file(f"{batch_id}_output.jsonl",
+                                      "".join(json.dumps(item) + "\n" for item in outputs).encode("utf-8"),
+                                      "batch_output")
+        error_file = None
+        if errors:
+            error_file = self.store_file(f"{batch_id}_errors.jsonl",
+                                         "".join(json.dumps(item) + "\n" for item in errors).encode("utf-8"),
+                                         "batch_output")
+        with self._lock:
+            batch.update({
+                "status": "completed",
+                "output_file_id": output_file["id"],
+                "error_file_id": error_file["id"] if error_file else None,
+                "completed_at": int(time.time()),
+                "request_counts": {"total": len(outputs) + len(errors), "completed": len(outputs),
+                                   "failed": len(errors)},
+            })
+
+
+def start_server(host="127.0.0.1", port=0, **options):
+    """
+    Start a mock server on a background thread.
+
+    Returns:
+        MockOpenAIServer: The running server; call shutdown() to stop it.
+    """
+    server = MockOpenAIServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    """Run the mock server from the command line."""
+    parser = argparse.ArgumentParser(description="Local stand-in for an OpenAI-compatible API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--ttft-ms", type=float, default=200.0)
+    parser.add_argument("--per-token-ms", type=float, default=2.0)
+    parser.add_argument("--fill-ratio", type=float, default=0.8)
+    parser.add_argument("--section-tokens", type=int,
+                        help="Tokens per requested section (output beyond max_tokens is truncated)")
+    parser.add_argument("--batch-delay-s", type=float, default=1.0, help="Time until a batch completes")
+    args = parser.parse_args()
+
+    server = MockOpenAIServer((args.host, args.port), ttft_ms=args.ttft_ms,
+                              per_token_ms=args.per_token_ms, fill_ratio=args.fill_ratio,
+                              section_tokens=args.section_tokens, batch_delay_s=args.batch_delay_s)
+    print(f"Mock OpenAI-compatible API listening on {server.url}/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()